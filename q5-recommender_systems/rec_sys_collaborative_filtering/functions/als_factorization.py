@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import os
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from functions.matrix_factorization_recommendations import predict_ratings_from_rows
+
+# same fields as the predictions returned by the surprise library
+Prediction = namedtuple('Prediction', ['uid', 'iid', 'r_ui', 'est', 'details'])
+
+# ---------------------------------------------------------------------------------------------------
+# Class to factorize the rating matrix with Alternating Least Squares (ALS)
+# ---------------------------------------------------------------------------------------------------
+
+class ALSFactorization:
+
+    # - Learns the same model as surprise's SVD: r_ui = mu + bu + bi + qi @ pu (or qi @ pu if not biased).
+    # - Each half-epoch fixes one side and solves a ridge regression for every row of the other side.
+    #   The rows are grouped into blocks of similar length, and each block is solved with one batched
+    #   np.linalg.solve. A block gathers (rows x longest row x k) features and builds (rows x k x k) normal
+    #   equations (k = n_factors + 1 if biased), and its rows are chosen so that together they stay within
+    #   block_budget float64 values, so memory is about num_threads x block_budget x 8 bytes.
+    # - Blocks are solved concurrently on a thread pool (NumPy releases the GIL in BLAS/LAPACK).
+    # - fit(..., warm_start=True) starts from the current factors of the users and jokes seen before.
+    # - The factors dict of the last fit is built once (get_factors), so predict only looks up two rows.
+    
+    def __init__(self,
+                 n_factors:int=100, # number of latent factors
+                 n_epochs:int=10, # number of ALS sweeps (users + jokes)
+                 reg:float=0.1, # regularization of the factors (scaled by the number of ratings)
+                 reg_bias:float=0.1, # regularization of the biases (scaled by the number of ratings)
+                 biased:bool=True, # learn the global mean and the user/joke biases
+                 init_std_dev:float=0.1, # standard deviation of the initial factors
+                 rating_scale:tuple=(-10,10), # estimates are clipped into this range
+                 num_threads:int=None, # number of blocks solved concurrently (number of cores if None)
+                 block_budget:int=2**21, # maximum float64 values (features and normal equations) held per block
+                 random_state:int=None):
+        
+        # store the hyperparameters
+        self.n_factors = n_factors
+        self.n_epochs = n_epochs
+        self.reg = reg
+        self.reg_bias = reg_bias
+        self.biased = biased
+        self.init_std_dev = init_std_dev
+        self.rating_scale = rating_scale
+        self.num_threads = num_threads or os.cpu_count() or 1
+        self.block_budget = block_budget
+        self.rng = np.random.default_rng(random_state)
+        
+        # nothing is fitted yet
+        self.pu, self.qi, self.bu, self.bi = None, None, None, None
+        self.global_mean = 0.0
+        self.user_index, self.item_index = dict(), dict()
+        self.factors = None
+    
+    def fit(self,
+            matrices:dict, # output of build_rating_matrices
+            warm_start:bool=False): # start from the current factors of known users and jokes
+        
+        # get the CSR ratings (users x jokes) and the CSR transpose (jokes x users)
+        R = matrices['ratings'].astype(np.float64).tocsr()
+        Rt = R.T.tocsr()
+        
+        # the factors are about to change
+        self.factors = None
+        
+        # get the new id maps
+        user_index = {user_id:i for i, user_id in enumerate(matrices['user_ids'].tolist())}
+        item_index = {joke_id:j for j, joke_id in enumerate(matrices['joke_ids'].tolist())}
+        
+        # initialize the factors (reusing the previous ones if warm starting)
+        self.pu, self.bu = self._init_factors(user_index, self.user_index, self.pu, self.bu, warm_start)
+        self.qi, self.bi = self._init_factors(item_index, self.item_index, self.qi, self.bi, warm_start)
+        self.user_index, self.item_index = user_index, item_index
+        
+        # global mean of the ratings
+        self.global_mean = float(R.data.mean()) if self.biased and R.nnz > 0 else 0.0
+        
+        # alternate between users and jokes
+        with ThreadPoolExecutor(max_workers=self.num_threads) as executor:
+            for epoch in range(self.n_epochs):
+            
+                # fix the jokes and solve the users
+                self.pu, self.bu = self._solve_side(R, self.qi, self.bi, executor)
+                
+                # fix the users and solve the jokes
+                self.qi, self.bi = self._solve_side(Rt, self.pu, self.bu, executor)
+        
+        return self
+    
+    def _init_factors(self,
+                      new_index:dict, # raw id as key, new row as value
+                      old_index:dict, # raw id as key, previous row as value
+                      old_factors:np.ndarray,
+                      old_biases:np.ndarray,
+                      warm_start:bool):
+        
+        # random factors and zero biases
+        factors = self.rng.normal(0, self.init_std_dev, (len(new_index), self.n_factors))
+        biases = np.zeros(len(new_index))
+        
+        # nothing to reuse
+        if not warm_start or old_factors is None: return factors, biases
+        
+        # copy the factors of the ids that were already known
+        common = [(new_row, old_index[raw_id]) for raw_id, new_row in new_index.items() if raw_id in old_index]
+        if common:
+            new_rows, old_rows = np.array(common).T
+            factors[new_rows] = old_factors[old_rows]
+            biases[new_rows] = old_biases[old_rows]
+        
+        return factors, biases
+    
+    def _solve_side(self,
+                    R, # CSR ratings of the side being solved (rows x other side)
+                    other_factors:np.ndarray, # fixed factors of the other side
+                    other_biases:np.ndarray, # fixed biases of the other side
+                    executor:ThreadPoolExecutor):
+        
+        # number of rows and unknowns per row (factors, plus the bias if biased)
+        num_rows = R.shape[0]
+        k = self.n_factors + int(self.biased)
+        
+        # features of the other side: [factors, 1] so that the bias is solved along with the factors
+        features = np.hstack([other_factors, np.ones((len(other_factors), 1))]) if self.biased else other_factors
+        
+        # regularization of each unknown
+        reg_diag = np.full(k, self.reg)
+        if self.biased: reg_diag[-1] = self.reg_bias
+        
+        # targets: ratings minus the parts that are fixed
+        targets = R.data - self.global_mean - (other_biases[R.indices] if self.biased else 0)
+        
+        # number of ratings of each row
+        row_lengths = np.diff(R.indptr)
+        
+        # arrays to store the solutions
+        solution = np.zeros((num_rows, k))
+        
+        # function to solve one block of rows
+        def solve_block(rows:np.ndarray):
+        
+            # slices of the rows in the CSR arrays
+            starts, lengths = R.indptr[rows], row_lengths[rows]
+            longest = lengths.max()
+            
+            # gather the ratings of the block into padded (rows x longest) arrays
+            positions = np.arange(longest)
+            is_valid = positions[None,:] < lengths[:,None]
+            entries = np.where(is_valid, starts[:,None] + positions[None,:], 0)
+            
+            # features and targets of the ratings (zero for the padding)
+            Y = features[R.indices[entries]] * is_valid[:,:,None]
+            t = targets[entries] * is_valid
+            
+            # normal equations of every row: (Y^T Y + reg * n * I) x = Y^T t
+            Yt = Y.transpose(0,2,1)
+            A = Yt @ Y
+            A[:, np.arange(k), np.arange(k)] += lengths[:,None] * reg_diag[None,:]
+            b = Yt @ t[:,:,None]
+            
+            # solve all the rows of the block at once
+            solution[rows] = np.linalg.solve(A, b)[:,:,0]
+        
+        # sort the rows by length (rows without ratings keep a zero solution)
+        order = np.argsort(row_lengths, kind='stable')
+        order = order[row_lengths[order] > 0]
+        sorted_lengths = row_lengths[order]
+        
+        # most rows a block can hold: every row needs at least one rating, so (1 + k + 1) x k values
+        max_rows = max(1, self.block_budget // ((k + 2) * k))
+        
+        # group rows of similar length into blocks within the budget
+        blocks, start = list(), 0
+        while start < len(order):
+        
+            # values held by the block for every possible end (the last row is the longest):
+            # padded features (longest x k), normal equations (k x k) and right-hand side (k) of each row
+            sizes = np.arange(1, min(len(order) - start, max_rows) + 1) * (sorted_lengths[start:start + max_rows] + k + 1) * k
+            
+            # largest block within the budget (at least one row)
+            end = start + max(1, int(np.searchsorted(sizes, self.block_budget, side='right')))
+            blocks.append(order[start:end])
+            start = end
+        
+        # solve the blocks in the thread pool
+        list(executor.map(solve_block, blocks))
+        
+        # split the factors from the biases
+        if self.biased: return solution[:,:-1], solution[:,-1]
+        
+        return solution, np.zeros(num_rows)
+    
+    def get_factors(self) -> dict:
+    
+        # same layout as extract_svd_factors, built once per fit
+        if self.factors is None:
+            self.factors = {'global_mean':self.global_mean,
+                            'bu':self.bu,
+                            'bi':self.bi,
+                            'pu':self.pu,
+                            'qi':self.qi,
+                            'biased':self.biased,
+                            'user_index':self.user_index,
+                            'item_index':self.item_index,
+                            'rating_scale':self.rating_scale}
+        
+        return self.factors
+    
+    def predict(self,
+                uid:int,
+                iid:int,
+                r_ui:float=None):
+        
+        # rows of the user and the joke (-1 if unknown)
+        u, i = self.user_index.get(uid, -1), self.item_index.get(iid, -1)
+        
+        # predict the rating with the same fallbacks and clipping as surprise
+        est = float(predict_ratings_from_rows(self.get_factors(), np.array([u]), np.array([i]))[0])
+        
+        return Prediction(uid, iid, r_ui, est, {'was_impossible':False})
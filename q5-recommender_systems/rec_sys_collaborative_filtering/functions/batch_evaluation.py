@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import numpy as np
+from functions.data_preprocessing import POLARITY_CODES
+
+# ---------------------------------------------------------------------------------------------------
+# Function to build a padded ranked-list matrix from per-user recommendations
+# ---------------------------------------------------------------------------------------------------
+
+def build_ranked_items_matrix(recommendations:dict, # userID as key, ranked list of jokeIDs as value
+                              user_index:dict, # userID as key, row of the user in the relevance matrix as value
+                              joke_index:dict, # jokeID as key, column of the joke in the relevance matrix as value
+                              list_length:int=None): # length of the ranked lists (longest list if None)
+    
+    # get the length of the ranked lists
+    if list_length is None: list_length = max([len(v) for v in recommendations.values()], default=0)
+    
+    # initialize the matrix of ranked jokes
+    # -1 marks an empty position (shorter ranked list)
+    ranked_items = np.full((len(user_index), list_length), -1, dtype=np.int64)
+    
+    # loop through users and their ranked jokes
+    for user_id, ranked_jokes in recommendations.items():
+    
+        # convert joke ids to columns of the relevance matrix
+        columns = [joke_index[joke_id] for joke_id in list(ranked_jokes)[:list_length]]
+        
+        # store the ranked list in the row of the user
+        ranked_items[user_index[user_id], :len(columns)] = columns
+    
+    return ranked_items
+
+# ---------------------------------------------------------------------------------------------------
+# Function to precompute the log2 discounts of each rank position
+# ---------------------------------------------------------------------------------------------------
+
+def compute_log2_discounts(list_length:int) -> np.ndarray:
+
+    # the item at (zero-based) position i is discounted by log2((i+1)+1)
+    return 1 / np.log2(np.arange(list_length) + 2)
+
+# ---------------------------------------------------------------------------------------------------
+# Function to evaluate the ranked lists of many users at once
+# ---------------------------------------------------------------------------------------------------
+
+def evaluate_ranked_lists(ranked_items:np.ndarray, # users x ranked positions, column of each joke or -1
+                          polarities, # users x jokes, polarity codes (dense array or scipy sparse matrix)
+                          discounts:np.ndarray=None): # precomputed log2 discounts (computed if None)
+    
+    # - The metrics reproduce the single-user evaluation functions of the item-based recommender.
+    # - As in those functions, only the recommended jokes that the user has rated are considered,
+    #   keeping the order in which they have been recommended.
+    # - Users without any rated recommendations (or positive ratings) get a score of 0.
+    
+    # number of users and length of the ranked lists
+    num_users, list_length = ranked_items.shape
+    
+    # get the log2 discounts
+    if discounts is None: discounts = compute_log2_discounts(list_length)
+    
+    # ---------------------------------
+    # - Gather the polarity codes of the recommended jokes
+    # - Keep only the rated jokes, in their recommended order
+    # ---------------------------------
+    
+    # mask of the non-empty positions
+    is_filled = ranked_items >= 0
+    
+    # rows and columns to gather from the polarity matrix
+    rows = np.broadcast_to(np.arange(num_users)[:,None], ranked_items.shape)
+    columns = np.where(is_filled, ranked_items, 0)
+    
+    # gather the polarity codes of the recommended jokes
+    codes = np.asarray(polarities[rows.ravel(), columns.ravel()]).reshape(ranked_items.shape)
+    codes = np.where(is_filled, codes, 0)
+    
+    # move the rated jokes to the front of each row, keeping their order
+    order = np.argsort(codes == 0, axis=1, kind='stable')
+    codes = np.take_along_axis(codes, order, axis=1)
+    
+    # masks of the rated and the relevant (positively rated) jokes
+    is_rated = codes > 0
+    is_relevant = codes == POLARITY_CODES['P']
+    
+    # number of rated and relevant recommended jokes
+    count_total = is_rated.sum(axis=1)
+    count_p = is_relevant.sum(axis=1)
+    
+    # total number of positively rated jokes per user
+    count_total_p = np.asarray((polarities == POLARITY_CODES['P']).sum(axis=1)).ravel()
+    
+    # one-based rank positions
+    ranks = np.arange(1, list_length + 1)
+    
+    # ---------------------------------
+    # Precision & Recall
+    # ---------------------------------
+    
+    precision = np.divide(count_p, count_total, out=np.zeros(num_users), where=count_total > 0)
+    recall = np.divide(count_p, count_total_p, out=np.zeros(num_users), where=count_total_p > 0)
+    
+    # ---------------------------------
+    # nDCG
+    # - Relevancy score: "P" = 2, "A" = 1, "N" = 0
+    # ---------------------------------
+    
+    # relevancy score of each ranked joke
+    relevancy = np.where(is_rated, codes - 1, 0)
+    
+    # discounted cumulative gain
+    DCG = relevancy @ discounts
+    
+    # ideal discounted cumulative gain
+    IDCG = -np.sort(-relevancy, axis=1) @ discounts
+    
+    nDCG = np.divide(DCG, IDCG, out=np.zeros(num_users), where=(DCG > 0) & (IDCG > 0))
+    
+    # ---------------------------------
+    # Mean Reciprocal Rank
+    # ---------------------------------
+    
+    MRR = np.divide((is_relevant / ranks).sum(axis=1), count_p, out=np.zeros(num_users), where=count_p > 0)
+    
+    # ---------------------------------
+    # Average Precision
+    # ---------------------------------
+    
+    # precision at each relevant position
+    precisions = np.where(is_relevant, np.cumsum(is_relevant, axis=1) / ranks, 0)
+    
+    AP = np.divide(precisions.sum(axis=1), count_p, out=np.zeros(num_users), where=count_p > 0)
+    
+    # per-user scores
+    per_user = {'precision':precision, 'recall':recall, 'nDCG':nDCG, 'MRR':MRR, 'AP':AP}
+    
+    # average scores over all users
+    aggregate = {metric:float(np.mean(scores)) if num_users > 0 else 0.0 for metric, scores in per_user.items()}
+    
+    return aggregate, per_user
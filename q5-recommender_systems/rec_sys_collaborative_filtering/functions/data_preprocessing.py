@@ -3,6 +3,9 @@
 
 import pandas as pd
 import numpy as np
+import scipy.sparse as sp
+import os
+from hashlib import sha1
 
 # ---------------------------------------------------------------------------------------------------
 # Function to preprocess the ratings dataset and bring it to the appropriate format
@@ -59,4 +62,237 @@ def unpivot_ratings(df:pd.DataFrame) -> pd.DataFrame:
     # sort data by user_id
     df_unpivot.sort_values(by='user_id', ascending=True, ignore_index=True, inplace=True)
     
-    return df_unpivot
\ No newline at end of file
+    return df_unpivot
+
+# ---------------------------------------------------------------------------------------------------
+# Function to discretize an array of ratings into integer polarity codes
+# ---------------------------------------------------------------------------------------------------
+
+# integer codes of the polarities produced by "discretize_rating"
+# 0 is reserved for jokes that have not been rated by the user
+POLARITY_CODES = {'N':1, 'A':2, 'P':3}
+
+def encode_polarities(ratings:np.ndarray) -> np.ndarray:
+    
+    # convert to a float array
+    ratings = np.asarray(ratings, dtype=np.float64)
+    
+    # initialize all ratings as average
+    codes = np.full(ratings.shape, POLARITY_CODES['A'], dtype=np.int8)
+    
+    # ratings below 0 are negative
+    codes[ratings < 0] = POLARITY_CODES['N']
+    
+    # ratings above 5 are positive
+    codes[ratings > 5] = POLARITY_CODES['P']
+    
+    # jokes without a rating get no polarity
+    codes[np.isnan(ratings)] = 0
+    
+    return codes
+
+
+# ---------------------------------------------------------------------------------------------------
+# Function to compute a fingerprint of the wide ratings dataset (to detect a stale cache)
+# ---------------------------------------------------------------------------------------------------
+
+def fingerprint_ratings(df:pd.DataFrame) -> str:
+    
+    # hash of each row (user id and rating values), in a single vectorized pass
+    digest = sha1(pd.util.hash_pandas_object(df, index=True).to_numpy().tobytes())
+    
+    # the jokes of the columns
+    digest.update(repr(df.columns.tolist()).encode('utf8'))
+    
+    return digest.hexdigest()
+
+# ---------------------------------------------------------------------------------------------------
+# Function to build the sparse user x joke rating and polarity matrices from the wide ratings dataset
+# ---------------------------------------------------------------------------------------------------
+
+def build_rating_matrices(df:pd.DataFrame, # preprocessed ratings (users as rows, jokes as columns)
+                          cache_path:str=None, # .npz file (str or path) to load the matrices from or save them to
+                          chunk_size:int=10000) -> dict: # number of users converted at once
+    
+    # np.savez appends the .npz suffix, so look for the file under the same name
+    if cache_path is not None:
+        cache_path = os.fspath(cache_path)
+        if os.path.splitext(cache_path)[1] != '.npz': cache_path = cache_path + '.npz'
+    
+    # fingerprint of the ratings (users, jokes and values)
+    fingerprint = fingerprint_ratings(df) if cache_path is not None else None
+    
+    # reuse the cached matrices, if they have been built from the same ratings
+    if cache_path is not None and os.path.exists(cache_path):
+        
+        # load the cached matrices
+        matrices = load_rating_matrices(cache_path)
+        
+        # a stale cache (e.g., changed rating values) is rebuilt (and overwritten) below
+        if matrices.get('fingerprint') == fingerprint: return matrices
+    
+    # convert the wide ratings chunk by chunk
+    rows, indices, ratings = convert_ratings_to_coo(df, chunk_size)
+    
+    # the rated cells come in row-major order, which is exactly the CSR layout
+    indptr = np.zeros(len(df) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=len(df)), out=indptr[1:])
+    
+    # polarities of the rated cells
+    polarities = encode_polarities(ratings)
+    
+    # put everything together
+    matrices = create_rating_matrices(ratings, polarities, indices, indptr,
+                                      df.index.to_numpy(), df.columns.to_numpy())
+    matrices['fingerprint'] = fingerprint
+    
+    # cache the matrices
+    if cache_path is not None: save_rating_matrices(matrices, cache_path)
+    
+    return matrices
+
+# ---------------------------------------------------------------------------------------------------
+# Function to convert the wide ratings dataset to COO arrays, a chunk of users at a time
+# ---------------------------------------------------------------------------------------------------
+
+def convert_ratings_to_coo(df:pd.DataFrame, # preprocessed ratings (users as rows, jokes as columns)
+                           chunk_size:int=10000, # number of users converted at once
+                           dtype=np.float32): # data type of the ratings
+    
+    # initialize lists
+    # to store the rows, columns and ratings of each chunk
+    rows, columns, ratings = list(), list(), list()
+    
+    # loop through chunks of users
+    for start in range(0, len(df), chunk_size):
+        
+        # get the dense ratings of the chunk only
+        values = df.iloc[start:start+chunk_size].to_numpy(dtype=dtype)
+        
+        # mask of the rated jokes
+        is_rated = ~np.isnan(values)
+        
+        # positions of the rated cells (row-major order)
+        chunk_rows, chunk_columns = np.nonzero(is_rated)
+        
+        # store the rated cells of the chunk
+        rows.append((chunk_rows + start).astype(np.int32))
+        columns.append(chunk_columns.astype(np.int32))
+        ratings.append(values[is_rated])
+    
+    # an empty dataset has no cells
+    if not rows: return np.empty(0, dtype=np.int32), np.empty(0, dtype=np.int32), np.empty(0, dtype=dtype)
+    
+    return np.concatenate(rows), np.concatenate(columns), np.concatenate(ratings)
+
+# ---------------------------------------------------------------------------------------------------
+# Function to load all the ratings submitted by each user without an intermediate long dataframe
+# ---------------------------------------------------------------------------------------------------
+
+def unpivot_ratings_to_coo(df:pd.DataFrame, # preprocessed ratings (users as rows, jokes as columns)
+                           chunk_size:int=10000) -> dict: # number of users converted at once
+    
+    # convert the wide ratings chunk by chunk
+    # (keeping the original precision of the ratings)
+    rows, columns, ratings = convert_ratings_to_coo(df, chunk_size, dtype=np.float64)
+    
+    # same columns as "unpivot_ratings" (already sorted by user_id)
+    # pd.DataFrame(...) of the result can be passed to surprise's Dataset.load_from_df
+    return {'user_id':df.index.to_numpy()[rows],
+            'joke_id':df.columns.to_numpy()[columns],
+            'rating':ratings}
+
+# ---------------------------------------------------------------------------------------------------
+# Function to create the rating and polarity matrices on top of the same CSR index arrays
+# ---------------------------------------------------------------------------------------------------
+
+def create_rating_matrices(ratings:np.ndarray, # rating of each rated cell
+                           polarities:np.ndarray, # polarity code of each rated cell
+                           indices:np.ndarray, # CSR column indices
+                           indptr:np.ndarray, # CSR row pointers
+                           user_ids:np.ndarray, # user id of each row
+                           joke_ids:np.ndarray) -> dict: # joke id of each column
+    
+    # shape of the matrices
+    shape = (len(user_ids), len(joke_ids))
+    
+    # both matrices share the index arrays (no copies)
+    return {'ratings':sp.csr_matrix((ratings, indices, indptr), shape=shape, copy=False),
+            'polarities':sp.csr_matrix((polarities, indices, indptr), shape=shape, copy=False),
+            'user_ids':user_ids,
+            'joke_ids':joke_ids,
+            'user_index':{user_id:i for i, user_id in enumerate(user_ids.tolist())},
+            'joke_index':{joke_id:j for j, joke_id in enumerate(joke_ids.tolist())}}
+
+# ---------------------------------------------------------------------------------------------------
+# Function to save the rating and polarity matrices to an .npz file
+# ---------------------------------------------------------------------------------------------------
+
+def save_rating_matrices(matrices:dict,
+                         cache_path:str): # .npz file (str or path)
+    
+    # store the raw arrays, uncompressed so that loading them is a plain read
+    np.savez(cache_path,
+             ratings=matrices['ratings'].data,
+             polarities=matrices['polarities'].data,
+             indices=matrices['ratings'].indices,
+             indptr=matrices['ratings'].indptr,
+             user_ids=matrices['user_ids'],
+             joke_ids=matrices['joke_ids'],
+             fingerprint=np.array(matrices.get('fingerprint') or ''))
+
+# ---------------------------------------------------------------------------------------------------
+# Function to load the rating and polarity matrices from an .npz file
+# ---------------------------------------------------------------------------------------------------
+
+def load_rating_matrices(cache_path:str) -> dict: # .npz file (str or path)
+    
+    # read the raw arrays
+    with np.load(cache_path, allow_pickle=False) as f:
+        arrays = {name:f[name] for name in f.files}
+    
+    # put everything together
+    matrices = create_rating_matrices(arrays['ratings'], arrays['polarities'], arrays['indices'],
+                                      arrays['indptr'], arrays['user_ids'], arrays['joke_ids'])
+    
+    # fingerprint of the ratings the matrices were built from (None for older caches)
+    matrices['fingerprint'] = (str(arrays['fingerprint']) or None) if 'fingerprint' in arrays else None
+    
+    return matrices
+
+# ---------------------------------------------------------------------------------------------------
+# Function to get the jokes rated by a user from the rating matrices
+# ---------------------------------------------------------------------------------------------------
+
+def get_user_ratings(matrices:dict,
+                     user_id:int,
+                     matrix:str='ratings') -> dict: # 'ratings' or 'polarities'
+    
+    # get the row of the user
+    # unknown users have not rated anything
+    row = matrices['user_index'].get(user_id)
+    if row is None: return dict()
+    
+    # get the slice of the user in the CSR arrays
+    csr = matrices[matrix]
+    start, end = csr.indptr[row], csr.indptr[row+1]
+    
+    # jokeIDs as keys, ratings (or polarity codes) as values
+    return dict(zip(matrices['joke_ids'][csr.indices[start:end]].tolist(), csr.data[start:end].tolist()))
+
+# ---------------------------------------------------------------------------------------------------
+# Function to unpivot the rating matrices to the long (user_id, joke_id, rating) format
+# ---------------------------------------------------------------------------------------------------
+
+def unpivot_rating_matrices(matrices:dict) -> pd.DataFrame:
+    
+    # get the CSR ratings
+    csr = matrices['ratings']
+    
+    # repeat each user id once per rated joke
+    user_ids = np.repeat(matrices['user_ids'], np.diff(csr.indptr))
+    
+    # rows are already sorted by user_id
+    return pd.DataFrame({'user_id':user_ids,
+                         'joke_id':matrices['joke_ids'][csr.indices],
+                         'rating':csr.data.astype(np.float64)})
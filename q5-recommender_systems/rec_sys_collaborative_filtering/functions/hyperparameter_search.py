@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import pandas as pd
+import numpy as np
+import time
+import os
+from itertools import product
+from math import ceil
+from multiprocessing import shared_memory
+from concurrent.futures import ProcessPoolExecutor
+from surprise import Reader, Dataset, SVD
+from functions.matrix_factorization_recommendations import extract_svd_factors, predict_ratings
+
+# read-only rating arrays of each worker process
+# (attached once per worker by "init_search_worker", instead of being sent with every task)
+_shared = dict()
+
+# ---------------------------------------------------------------------------------------------------
+# Function to copy an array into shared memory
+# ---------------------------------------------------------------------------------------------------
+
+def share_array(array:np.ndarray):
+    
+    # create the shared memory block and copy the array into it
+    shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)[:] = array
+    
+    # the block is attached by the workers from its name, shape and type
+    return shm, (shm.name, array.shape, array.dtype.str)
+
+# ---------------------------------------------------------------------------------------------------
+# Function to attach the shared rating arrays once in each worker process
+# ---------------------------------------------------------------------------------------------------
+
+def init_search_worker(shared_arrays:dict, # array name as key, (name, shape, dtype) of its shared memory block as value
+                       rating_scale:tuple):
+    
+    # keep the blocks attached while the worker lives
+    _shared['shm'] = list()
+    
+    # attach the arrays without copying them (user_ids, joke_ids, ratings and the fold of each rating)
+    for key, (name, shape, dtype) in shared_arrays.items():
+        shm = shared_memory.SharedMemory(name=name)
+        array = np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+        array.setflags(write=False)
+        _shared['shm'].append(shm)
+        _shared[key] = array
+    
+    # keep the rating scale for the tasks of this worker
+    _shared['rating_scale'] = rating_scale
+
+# ---------------------------------------------------------------------------------------------------
+# Function to train the SVD on all folds but one and compute the RMSE on the held-out fold
+# ---------------------------------------------------------------------------------------------------
+
+def evaluate_svd_fold(params:dict, # SVD hyperparameters
+                      n_epochs:int, # epochs budget of the current rung
+                      fold:int, # held-out fold
+                      random_state:int):
+    
+    # start time
+    st = time.time()
+    
+    # split the ratings
+    is_test = _shared['folds'] == fold
+    df_train = pd.DataFrame({'user_id':_shared['user_ids'][~is_test],
+                             'joke_id':_shared['joke_ids'][~is_test],
+                             'rating':_shared['ratings'][~is_test]})
+    
+    # fit the SVD on the training folds
+    data = Dataset.load_from_df(df_train, Reader(rating_scale=_shared['rating_scale']))
+    svd = SVD(n_epochs=n_epochs, random_state=random_state, **params)
+    svd.fit(data.build_full_trainset())
+    
+    # predict the held-out ratings at once
+    predicted = predict_ratings(extract_svd_factors(svd), _shared['user_ids'][is_test], _shared['joke_ids'][is_test])
+    
+    # compute RMSE
+    rmse = float(np.sqrt(np.mean((_shared['ratings'][is_test] - predicted)**2)))
+    
+    return rmse, time.time() - st
+
+# ---------------------------------------------------------------------------------------------------
+# Function to tune the SVD with parallel cross-validation and successive halving on the epochs
+# ---------------------------------------------------------------------------------------------------
+
+def search_svd_hyperparameters(coo:dict, # output of unpivot_ratings_to_coo (user_id, joke_id and rating arrays)
+                               param_grid:dict, # SVD hyperparameters to search (except n_epochs)
+                               n_folds:int=5, # number of cross-validation folds
+                               min_epochs:int=5, # epochs budget of the first rung
+                               max_epochs:int=20, # epochs budget of the last rung
+                               eta:int=3, # only the best 1/eta configurations move to the next rung
+                               num_workers:int=None, # number of worker processes (number of cores if None)
+                               rating_scale:tuple=(-10,10),
+                               random_state:int=0):
+    
+    # - Every rung trains each surviving configuration on every fold, with the folds spread over a process pool.
+    #   The rating arrays are copied once into shared memory and attached by every worker (no pickling).
+    # - After each rung, only the best 1/eta configurations (by mean RMSE) are trained again with eta times more epochs,
+    #   so bad configurations are pruned after a few cheap epochs instead of a full cross-validation.
+    # - Once a single configuration is left, it is trained with max_epochs, so the winner always gets the full budget.
+    # - Returns the best hyperparameters and a table with the RMSE and wall time of every trial.
+    
+    # get the number of workers
+    if num_workers is None: num_workers = os.cpu_count() or 1
+    
+    # expand the grid into configurations
+    names = list(param_grid.keys())
+    configs = [dict(zip(names, values)) for values in product(*param_grid.values())]
+    
+    # assign each rating to a random fold
+    rng = np.random.default_rng(random_state)
+    folds = rng.permutation(len(coo['rating'])) % n_folds
+    
+    # initialize a list
+    # to store the result of each trial
+    trials = list()
+    
+    # epochs budget of the first rung (the full budget if there is nothing to prune)
+    n_epochs, rung = min(min_epochs, max_epochs) if len(configs) > 1 else max_epochs, 0
+    
+    # copy the rating arrays into shared memory
+    blocks = {key:share_array(array) for key, array in [('user_ids', np.asarray(coo['user_id'])),
+                                                        ('joke_ids', np.asarray(coo['joke_id'])),
+                                                        ('ratings', np.asarray(coo['rating'], dtype=np.float64)),
+                                                        ('folds', folds)]}
+    
+    # start the worker processes with the shared rating arrays
+    try:
+        with ProcessPoolExecutor(max_workers=num_workers,
+                                 initializer=init_search_worker,
+                                 initargs=({key:spec for key, (_, spec) in blocks.items()}, rating_scale)) as executor:
+            
+            while True:
+            
+                # start time
+                st = time.time()
+                
+                # submit every (configuration, fold) pair of the rung
+                futures = {(c, fold):executor.submit(evaluate_svd_fold, config, n_epochs, fold, random_state)
+                           for c, config in enumerate(configs) for fold in range(n_folds)}
+                
+                # collect the results of each configuration
+                scores = list()
+                for c, config in enumerate(configs):
+                
+                    # RMSE and fit time of each fold
+                    results = np.array([futures[(c, fold)].result() for fold in range(n_folds)])
+                    
+                    # store the trial
+                    trials.append({**config,
+                                   'rung':rung,
+                                   'n_epochs':n_epochs,
+                                   'rmse':results[:,0].mean(),
+                                   'rmse_std':results[:,0].std(),
+                                   'fit_time':results[:,1].sum()})
+                    scores.append(results[:,0].mean())
+                
+                # wall time of the rung
+                for trial in trials[-len(configs):]: trial['rung_wall_time'] = time.time() - st
+                
+                print(f'Rung {rung}: {len(configs)} configurations x {n_folds} folds with {n_epochs} epochs ({int(time.time()-st)} secs.)')
+                
+                # stop when the full budget has been used
+                if n_epochs >= max_epochs: break
+                
+                # keep the best configurations
+                keep = np.argsort(scores, kind='stable')[:max(1, ceil(len(configs) / eta))]
+                configs = [configs[c] for c in keep]
+                
+                # move to the next rung with more epochs (the full budget for the last configuration)
+                n_epochs, rung = min(n_epochs * eta, max_epochs) if len(configs) > 1 else max_epochs, rung + 1
+    
+    # release the shared memory
+    finally:
+        for shm, _ in blocks.values():
+            shm.close()
+            shm.unlink()
+    
+    # the best configuration of the last rung
+    best_params = configs[int(np.argmin(scores))]
+    
+    return best_params, pd.DataFrame(trials)
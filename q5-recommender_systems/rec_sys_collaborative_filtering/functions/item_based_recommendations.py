@@ -3,9 +3,16 @@
 
 import pandas as pd
 import numpy as np
-from datasketch import MinHash, MinHashLSH
+from datasketch import MinHash, MinHashLSH, LeanMinHash
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import os
+import json
+import struct
+import itertools
 from math import log2
+from functions.data_preprocessing import POLARITY_CODES, get_user_ratings
+from functions.lru_cache import LRUCache
 
 # ---------------------------------------------------------------------------------------------------
 # Function to discretize ratings
@@ -50,6 +57,63 @@ def load_ratings(df:pd.DataFrame):
     
     return ratings
 
+# ---------------------------------------------------------------------------------------------------
+# Function to create the same dictionary as "load_ratings" from the polarity matrix
+# ---------------------------------------------------------------------------------------------------
+
+def load_ratings_from_matrices(matrices:dict): # output of build_rating_matrices
+    
+    # convert polarity codes back to letters
+    letters = {code:polarity for polarity, code in POLARITY_CODES.items()}
+    
+    # switch to a column-major layout
+    # so that the ratings of each joke are contiguous
+    csc = matrices['polarities'].tocsc()
+    
+    # get the user ids of the stored cells
+    user_ids = matrices['user_ids'][csc.indices].tolist()
+    polarities = [letters[code] for code in csc.data.tolist()]
+    
+    # initialize a dict
+    # to store the ratings per each item ID
+    ratings = dict()
+    
+    # loop through jokes
+    for j, item in enumerate(matrices['joke_ids'].tolist()):
+        
+        # get the slice of the joke
+        start, end = csc.indptr[j], csc.indptr[j+1]
+        
+        # skip jokes without ratings
+        if start == end: continue
+        
+        # attach the users and their polarities to the joke
+        ratings[item] = set(zip(user_ids[start:end], polarities[start:end]))
+    
+    return ratings
+
+# ---------------------------------------------------------------------------------------------------
+# Function to create the min hash signature of an entity
+# ---------------------------------------------------------------------------------------------------
+
+def create_min_hash_signature(its_ratings:set, # userID and rating (polarity) pairs of the entity
+                              num_perm:int=1000): # number of random permutations (hash functions)
+    
+    # create a min hash signature for this entity
+    signature = MinHash(num_perm=num_perm)
+    
+    # for the current entity (e.g., joke)
+    # loop through users (that have rated the joke) and polarities (ratings given to the joke)
+    for user_id, polarity in its_ratings:
+        
+        # create a key string
+        ks = str(user_id) + '_' + polarity
+        
+        # add the key string to the min hash signature for this entity
+        signature.update(ks.encode('utf8'))
+    
+    return signature
+
 # ---------------------------------------------------------------------------------------------------
 # Function to create an index for each entity using Locality Sensitive Hashing (LSH)
 # ---------------------------------------------------------------------------------------------------
@@ -58,10 +122,11 @@ def create_LSH_index(ratings:dict, # itemID as key, userID and rating as values
                      jaccard_threshold:float=0.2, # lower similarity bound for the LSH
                      index_weights:tuple=(0.2,0.8), # false pos and false neg weights
                      num_perm:int=1000, # number of random permutations (hash functions)
-                     min_num_ratings:int=10): # entities with less than this many ratings will be ignored
+                     min_num_ratings:int=10, # entities with less than this many ratings will be ignored
+                     storage_config:dict=None): # LSH storage backend (see make_LSH_storage_config)
     
     # initialize the LSH index
-    index = MinHashLSH(threshold=jaccard_threshold, weights=index_weights, num_perm=num_perm)
+    index = make_LSH_index(jaccard_threshold, index_weights, num_perm, storage_config, get_key_type(ratings))
     
     # create a dict
     # to store the hashes (min hash signatures) of each entity
@@ -93,24 +158,354 @@ def create_LSH_index(ratings:dict, # itemID as key, userID and rating as values
         if len(its_ratings) < min_num_ratings: continue
         
         # create a min hash signature for this entity
-        signature = MinHash(num_perm=num_perm)
-        
-        # for the current entity (e.g., joke)
-        # loop through users (that have rated the joke) and polarities (ratings given to the joke)
-        for user_id, polarity in its_ratings:
-            
-            # create a key string
-            ks = str(user_id) + '_' + polarity
-            
-            # add the key string to the min hash signature for this entity
-            signature.update(ks.encode('utf8'))
+        signature = create_min_hash_signature(its_ratings, num_perm)
             
         # store the min hash signature for this entity
         min_hash_signatures[entity_id] = signature
         
         # index the entity based on its hash signature
         index.insert(entity_id, signature)
+    
+    # share the signatures with other processes using the same storage
+    save_min_hash_signatures(min_hash_signatures, storage_config, jaccard_threshold, index_weights, num_perm)
+        
+    return index, min_hash_signatures
+
+# ---------------------------------------------------------------------------------------------------
+# Function to compute the raw min hash values of a shard of entities (runs in a worker process)
+# ---------------------------------------------------------------------------------------------------
+
+def compute_min_hash_values(shard:list, # list of (entity_id, its_ratings) pairs
+                            num_perm:int=1000): # number of random permutations (hash functions)
+    
+    # create the min hash signatures of the whole shard at once
+    # (the random permutations are generated only once and shared)
+    signatures = MinHash.bulk([[(str(user_id) + '_' + polarity).encode('utf8') for user_id, polarity in its_ratings]
+                               for _, its_ratings in shard], num_perm=num_perm)
+    
+    # stack the raw hash values of the entities
+    hash_values = np.array([signature.hashvalues for signature in signatures], dtype=np.uint64).reshape(len(shard), num_perm)
+    
+    # newer datasketch versions need the hashing scheme to rebuild a signature from its hash values
+    scheme = getattr(signatures[0], 'scheme', None) if signatures else None
+    
+    return [entity_id for entity_id, _ in shard], hash_values, scheme
+
+# ---------------------------------------------------------------------------------------------------
+# Function to create the LSH index computing the min hash signatures in parallel across item shards
+# ---------------------------------------------------------------------------------------------------
+
+def create_LSH_index_in_parallel(ratings:dict, # itemID as key, userID and rating as values
+                                 jaccard_threshold:float=0.2, # lower similarity bound for the LSH
+                                 index_weights:tuple=(0.2,0.8), # false pos and false neg weights
+                                 num_perm:int=1000, # number of random permutations (hash functions)
+                                 min_num_ratings:int=10, # entities with less than this many ratings will be ignored
+                                 num_workers:int=None, # number of worker processes (number of cores if None)
+                                 shards_per_worker:int=4, # number of item shards handed to each worker
+                                 storage_config:dict=None): # LSH storage backend (see make_LSH_storage_config)
+    
+    # get the number of workers
+    if num_workers is None: num_workers = os.cpu_count() or 1
+    
+    # keep only the entities that have received enough ratings
+    entities = [(entity_id, its_ratings) for entity_id, its_ratings in ratings.items() if len(its_ratings) >= min_num_ratings]
+    
+    # split the entities into shards
+    num_shards = max(1, min(len(entities), num_workers * shards_per_worker))
+    shards = [entities[i::num_shards] for i in range(num_shards)]
+    
+    # create a dict
+    # to store the hashes (min hash signatures) of each entity
+    min_hash_signatures = dict()
+    
+    # compute the hash values of each shard in a process pool
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        
+        # submit the shards
+        futures = [executor.submit(compute_min_hash_values, shard, num_perm) for shard in shards]
         
+        # loop through the finished shards
+        for counter, future in enumerate(as_completed(futures), start=1):
+            
+            # get the entity ids and their hash values
+            entity_ids, hash_values, scheme = future.result()
+            
+            # pass the hashing scheme only if there is one
+            kwargs = {'scheme':scheme} if scheme else {}
+            
+            # rebuild the min hash signatures from the raw hash values
+            for entity_id, values in zip(entity_ids, hash_values):
+                min_hash_signatures[entity_id] = LeanMinHash(seed=1, hashvalues=values, **kwargs)
+            
+            # print progress
+            print(f'{counter} out of {num_shards} shards hashed.')
+    
+    # initialize the LSH index
+    index = make_LSH_index(jaccard_threshold, index_weights, num_perm, storage_config, get_key_type(ratings))
+    
+    # index all the entities in a single bulk insertion
+    with index.insertion_session() as session:
+        for entity_id, signature in min_hash_signatures.items():
+            session.insert(entity_id, signature)
+    
+    # share the signatures with other processes using the same storage
+    save_min_hash_signatures(min_hash_signatures, storage_config, jaccard_threshold, index_weights, num_perm)
+    
+    return index, min_hash_signatures
+
+# ---------------------------------------------------------------------------------------------------
+# Function to define the storage backend of the LSH index
+# ---------------------------------------------------------------------------------------------------
+
+def make_LSH_storage_config(backend:str='dict', # 'dict' (in-process) or 'redis' (shared across processes)
+                            basename:str='jokes', # prefix of the keys of the index in the storage
+                            host:str='localhost', # redis host
+                            port:int=6379, # redis port
+                            db:int=0): # redis database number
+    
+    # in-process storage, only visible to the process that builds the index
+    if backend == 'dict': return {'type':'dict'}
+    
+    # redis storage, shared by every process that connects with the same basename
+    if backend == 'redis':
+        return {'type':'redis',
+                'basename':basename.encode('utf8'),
+                'redis':{'host':host, 'port':port, 'db':db}}
+    
+    raise ValueError(f"Unknown LSH storage backend: {backend}")
+
+# ---------------------------------------------------------------------------------------------------
+# Class to index entities in a shared storage with plain string keys
+# ---------------------------------------------------------------------------------------------------
+
+class PlainKeyMinHashLSH(MinHashLSH):
+    
+    # datasketch pickles the keys of a redis index by default, and unpickles whatever it reads back,
+    # so anyone able to write to the redis instance could run code in every process using the index;
+    # here the keys are stored as utf8 strings and converted back with key_type ('int' or 'str')
+    
+    def __init__(self,
+                 threshold:float,
+                 weights:tuple,
+                 num_perm:int,
+                 storage_config:dict,
+                 key_type:str='int'): # type of the entity ids
+        
+        # the storage receives the encoded keys as they are
+        super().__init__(threshold=threshold, weights=weights, num_perm=num_perm, storage_config=storage_config, prepickle=False)
+        
+        # type of the entity ids
+        self.key_type = key_type
+    
+    def encode_key(self,
+                   key) -> bytes:
+        
+        return str(key).encode('utf8')
+    
+    def decode_key(self,
+                   key:bytes):
+        
+        # decode the key and restore its type
+        key = key.decode('utf8')
+        
+        return int(key) if self.key_type == 'int' else key
+    
+    def _insert(self,
+                key,
+                *args,
+                **kwargs):
+        
+        # also used by the insertion sessions
+        return super()._insert(self.encode_key(key), *args, **kwargs)
+    
+    def _remove(self,
+                key,
+                *args,
+                **kwargs):
+        
+        return super()._remove(self.encode_key(key), *args, **kwargs)
+    
+    def __contains__(self,
+                     key) -> bool:
+        
+        return super().__contains__(self.encode_key(key))
+    
+    def query(self,
+              minhash) -> list:
+        
+        return [self.decode_key(key) for key in super().query(minhash)]
+
+# ---------------------------------------------------------------------------------------------------
+# Function to get the type of the entity ids stored in a shared LSH index
+# ---------------------------------------------------------------------------------------------------
+
+def get_key_type(entity_ids) -> str:
+    
+    # integer ids are restored as integers, anything else as strings
+    return 'int' if all(isinstance(entity_id, (int, np.integer)) for entity_id in entity_ids) else 'str'
+
+# ---------------------------------------------------------------------------------------------------
+# Function to initialize an empty LSH index in the given storage backend
+# ---------------------------------------------------------------------------------------------------
+
+def make_LSH_index(jaccard_threshold:float, # lower similarity bound for the LSH
+                   index_weights:tuple, # false pos and false neg weights
+                   num_perm:int, # number of random permutations (hash functions)
+                   storage_config:dict=None, # LSH storage backend (see make_LSH_storage_config)
+                   key_type:str='int'): # type of the entity ids ('int' or 'str')
+    
+    # in-process storage
+    if storage_config is None or storage_config['type'] != 'redis':
+        return MinHashLSH(threshold=jaccard_threshold, weights=index_weights, num_perm=num_perm, storage_config=storage_config)
+    
+    # an index built under an existing basename replaces the previous one
+    # (inserting the same entities again would fail with "The given key already exists")
+    clear_LSH_storage(storage_config)
+    
+    return PlainKeyMinHashLSH(jaccard_threshold, index_weights, num_perm, storage_config, key_type)
+
+# ---------------------------------------------------------------------------------------------------
+# Function to connect to the redis instance of a shared LSH storage
+# ---------------------------------------------------------------------------------------------------
+
+def connect_to_LSH_storage(storage_config:dict): # redis LSH storage backend
+    
+    # import here, so that redis is only needed for the redis backend
+    import redis
+    
+    return redis.Redis(**storage_config['redis'])
+
+# ---------------------------------------------------------------------------------------------------
+# Function to list the keys of an LSH index (hash tables, signatures and parameters) in a shared storage
+# ---------------------------------------------------------------------------------------------------
+
+def get_LSH_storage_keys(client, # redis client
+                         basename:bytes) -> list: # basename of the index
+    
+    # hash tables of the index: one per band (numbered from 0, as datasketch names them) and one for the keys
+    tables = list()
+    for band in itertools.count():
+        table = basename + b'_bucket_' + struct.pack('>H', band)
+        if not client.exists(table): break
+        tables.append(table)
+    tables.append(basename + b'_keys')
+    
+    # each hash table maps its entries to the redis keys of their lists (or sets),
+    # so the keys of the index are listed exactly (another basename with the same prefix is never matched)
+    keys = [basename + b'_signatures', basename + b'_params'] + tables
+    for table in tables: keys.extend(client.hvals(table))
+    
+    return keys
+
+# ---------------------------------------------------------------------------------------------------
+# Function to delete an LSH index (hash tables, signatures and parameters) from a shared storage
+# ---------------------------------------------------------------------------------------------------
+
+def clear_LSH_storage(storage_config:dict): # redis LSH storage backend
+    
+    # connect to the storage
+    client = connect_to_LSH_storage(storage_config)
+    
+    # get the keys owned by the index
+    keys = get_LSH_storage_keys(client, storage_config['basename'])
+    
+    # delete them in batches
+    for start in range(0, len(keys), 10000): client.delete(*keys[start:start+10000])
+
+# ---------------------------------------------------------------------------------------------------
+# Function to store the min hash signatures next to a shared LSH index
+# ---------------------------------------------------------------------------------------------------
+
+def save_min_hash_signatures(hashes:dict, # dict with jokes and their min hash signatures
+                             storage_config:dict, # LSH storage backend
+                             jaccard_threshold:float, # parameters the index was created with
+                             index_weights:tuple,
+                             num_perm:int):
+    
+    # the in-process storage cannot be shared
+    # so the signatures stay with the process that created them
+    if storage_config is None or storage_config['type'] != 'redis': return
+    
+    # connect to the storage
+    client = connect_to_LSH_storage(storage_config)
+    
+    # keys of the signatures and the index parameters
+    signatures_key = storage_config['basename'] + b'_signatures'
+    params_key = storage_config['basename'] + b'_params'
+    
+    # get the hashing scheme of the signatures (newer datasketch versions only)
+    scheme = getattr(next(iter(hashes.values()), None), 'scheme', None)
+    
+    # write everything in a single round trip
+    pipeline = client.pipeline()
+    
+    # store each signature as the raw bytes of its hash values, under the entity id as a string
+    pipeline.delete(signatures_key)
+    for entity_id, signature in hashes.items():
+        pipeline.hset(signatures_key, str(entity_id), np.asarray(signature.hashvalues, dtype=np.uint64).tobytes())
+    
+    # store the parameters needed to reconnect to the index (plain json, never unpickled)
+    pipeline.set(params_key, json.dumps({'jaccard_threshold':jaccard_threshold,
+                                         'index_weights':list(index_weights),
+                                         'num_perm':num_perm,
+                                         'scheme':scheme,
+                                         'key_type':get_key_type(hashes)}))
+    pipeline.execute()
+
+# ---------------------------------------------------------------------------------------------------
+# Function to update (or delete) the signature of one entity in a shared storage
+# ---------------------------------------------------------------------------------------------------
+
+def save_min_hash_signature(entity_id, # entity whose signature has changed
+                            signature, # new min hash signature (None if the entity is no longer indexed)
+                            storage_config:dict): # LSH storage backend
+    
+    # nothing is shared with the in-process storage
+    if storage_config is None or storage_config['type'] != 'redis': return
+    
+    # connect to the storage
+    client = connect_to_LSH_storage(storage_config)
+    signatures_key = storage_config['basename'] + b'_signatures'
+    
+    # store the new hash values, or drop the entity
+    if signature is None: client.hdel(signatures_key, str(entity_id))
+    else: client.hset(signatures_key, str(entity_id), np.asarray(signature.hashvalues, dtype=np.uint64).tobytes())
+
+# ---------------------------------------------------------------------------------------------------
+# Function to connect to an LSH index that has already been built in a shared storage
+# ---------------------------------------------------------------------------------------------------
+
+def load_LSH_index(storage_config:dict): # LSH storage backend the index was created with
+    
+    # only shared storages can be connected to
+    if storage_config is None or storage_config['type'] != 'redis':
+        raise ValueError('Only an index in a redis storage can be loaded; in-process indexes must be rebuilt.')
+    
+    # connect to the storage
+    client = connect_to_LSH_storage(storage_config)
+    
+    # get the parameters the index was created with
+    params = client.get(storage_config['basename'] + b'_params')
+    
+    # check if the index exists
+    if params is None: raise KeyError(f"No LSH index found under basename {storage_config['basename']!r}")
+    params = json.loads(params)
+    
+    # attach to the existing hash tables (same basename and parameters, so nothing is inserted)
+    index = PlainKeyMinHashLSH(params['jaccard_threshold'],
+                               tuple(params['index_weights']),
+                               params['num_perm'],
+                               storage_config,
+                               params['key_type'])
+    
+    # pass the hashing scheme only if there is one
+    kwargs = {'scheme':params['scheme']} if params['scheme'] else {}
+    
+    # rebuild the min hash signatures from their raw hash values
+    min_hash_signatures = dict()
+    for entity_id, values in client.hgetall(storage_config['basename'] + b'_signatures').items():
+        min_hash_signatures[index.decode_key(entity_id)] = LeanMinHash(seed=1, hashvalues=np.frombuffer(values, dtype=np.uint64), **kwargs)
+    
     return index, min_hash_signatures
 
 # ---------------------------------------------------------------------------------------------------
@@ -137,7 +532,17 @@ def get_neighbors(item_id:int, # item whose neighbors are to be retrieved
                   ratings:dict, # itemID as key, userID and rating as values
                   index:MinHashLSH, # MinHash indexing
                   hashes:dict, # dict with jokes and their min hash signatures
-                  threshold:float=0.2): # lower true similarity bound
+                  threshold:float=0.2, # lower true similarity bound
+                  cache=None): # optional NeighborCache with previously retrieved neighbors
+    
+    # return the cached neighbors, if any
+    if cache is not None:
+        
+        # look up the item and threshold in the cache
+        neighbors = cache.get(item_id, threshold)
+        
+        # cache hit
+        if neighbors is not None: return neighbors
     
     # get the candidate neighbors (e.g., joke ids)
     candidates = index.query(hashes[item_id])
@@ -165,7 +570,141 @@ def get_neighbors(item_id:int, # item whose neighbors are to be retrieved
             # store neighbor id and jacc sim
             neighbors.append((neighbor_id,jaccard))
     
-    return neighbors
+    # store the neighbors in the cache, along with the candidates they depend on
+    if cache is not None: cache.put(item_id, threshold, neighbors, neighbor_ids)
+    
+    return list(neighbors)
+
+# ---------------------------------------------------------------------------------------------------
+# Class to cache the neighbors retrieved for each entity (least recently used entries are evicted)
+# ---------------------------------------------------------------------------------------------------
+
+class NeighborCache(LRUCache):
+    
+    def __init__(self,
+                 maxsize:int=1024): # maximum number of (item, threshold) entries to keep
+        
+        # (item, threshold) as key, (neighbors, candidates) as values
+        super().__init__(maxsize)
+        
+        # itemID as key, cache keys of the item as values
+        self._keys_by_item = defaultdict(set)
+        
+        # itemID as key, cache keys whose neighbors were computed against the item as values
+        self._keys_by_candidate = defaultdict(set)
+    
+    def get(self,
+            item_id:int,
+            threshold:float):
+        
+        # look up the item and threshold
+        entry = self.lookup((item_id, threshold))
+        
+        return list(entry[0]) if entry is not None else None
+    
+    def put(self,
+            item_id:int,
+            threshold:float,
+            neighbors:list, # neighbor ids and their jaccard similarity
+            candidates:list): # candidate ids the neighbors were computed against
+        
+        # create the cache key
+        key = (item_id, threshold)
+        
+        # drop any previous entry for this key
+        self.discard(key)
+        
+        # keep track of the items the entry depends on
+        self._keys_by_item[item_id].add(key)
+        for candidate in candidates: self._keys_by_candidate[candidate].add(key)
+        
+        # store the entry (evicting the least recently used ones)
+        self.store(key, (list(neighbors), set(candidates)))
+    
+    def invalidate(self,
+                   item_id:int):
+        
+        # get the entries of the item itself and the entries that were computed against it
+        keys = self._keys_by_item.get(item_id, set()) | self._keys_by_candidate.get(item_id, set())
+        
+        # drop the entries
+        for key in keys: self.discard(key)
+    
+    def invalidate_item_keys(self,
+                             item_id:int):
+        
+        # drop the entries of the item itself
+        for key in set(self._keys_by_item.get(item_id, ())): self.discard(key)
+    
+    def clear(self):
+        
+        # drop all entries
+        super().clear()
+        self._keys_by_item.clear()
+        self._keys_by_candidate.clear()
+    
+    def discard(self,
+                key:tuple):
+        
+        # remove the entry
+        entry = super().discard(key)
+        
+        # check if the key was cached
+        if entry is None: return None
+        
+        # remove the entry from the items it depends on
+        self._keys_by_item[key[0]].discard(key)
+        for candidate in entry[1]: self._keys_by_candidate[candidate].discard(key)
+        
+        return entry
+
+# ---------------------------------------------------------------------------------------------------
+# Function to update the ratings of an entity and keep the index and the neighbor cache consistent
+# ---------------------------------------------------------------------------------------------------
+
+def update_item_ratings(item_id:int, # item whose ratings have changed
+                        item_ratings:set, # new userID and rating (polarity) pairs of the item
+                        ratings:dict, # itemID as key, userID and rating as values
+                        index:MinHashLSH, # MinHash indexing
+                        hashes:dict, # dict with jokes and their min hash signatures
+                        cache:NeighborCache=None, # neighbor cache to invalidate
+                        num_perm:int=1000, # must match the number of permutations of the index
+                        min_num_ratings:int=10, # entities with less than this many ratings will not be indexed
+                        storage_config:dict=None): # LSH storage backend of the index (the shared signatures are updated too)
+    
+    # store the new ratings of the item
+    ratings[item_id] = item_ratings
+    
+    # drop the cached neighbors of the item and every cached neighbor list computed against it
+    if cache is not None: cache.invalidate(item_id)
+    
+    # remove the old signature from the index
+    if item_id in hashes:
+        index.remove(item_id)
+        del hashes[item_id]
+    
+    # check if the item has received enough ratings to be indexed
+    if len(item_ratings) < min_num_ratings:
+        
+        # other processes must not load the old signature either
+        save_min_hash_signature(item_id, None, storage_config)
+        
+        return
+    
+    # create the new min hash signature of the item
+    signature = create_min_hash_signature(item_ratings, num_perm)
+    
+    # index the item based on its new signature
+    hashes[item_id] = signature
+    index.insert(item_id, signature)
+    
+    # share the new signature with the other processes using the same storage
+    save_min_hash_signature(item_id, signature, storage_config)
+    
+    # the item may now be a candidate of other items
+    # so their cached neighbors are no longer valid
+    if cache is not None:
+        for candidate_id in index.query(signature): cache.invalidate_item_keys(candidate_id)
 
 # ---------------------------------------------------------------------------------------------------
 # Function to recommend jokes for a given entity
@@ -177,13 +716,21 @@ def make_recommendations_using_item_based_technique(user_id:int,
                                                     ratings:dict,
                                                     index:MinHashLSH,
                                                     hashes:dict,
-                                                    num_recommendations:int=10):
+                                                    num_recommendations:int=10,
+                                                    cache:NeighborCache=None,
+                                                    matrices:dict=None): # output of build_rating_matrices (optional)
     
-    # get all the jokes rated by this user
-    user_jokes = df_ratings[df_ratings.user_id == user_id][['joke_id','rating']]
+    # get all the jokes rated by this user from the rating matrices
+    if matrices is not None:
+        user_jokes = {joke_id:discretize_rating(rating) for joke_id, rating in get_user_ratings(matrices, user_id).items()}
     
-    # convert them to a dict
-    user_jokes = dict(zip(user_jokes.joke_id, user_jokes.rating.apply(discretize_rating)))
+    else:
+        
+        # get all the jokes rated by this user
+        user_jokes = df_ratings[df_ratings.user_id == user_id][['joke_id','rating']]
+        
+        # convert them to a dict
+        user_jokes = dict(zip(user_jokes.joke_id, user_jokes.rating.apply(discretize_rating)))
     
     # create an empty dict
     # to store votes for each joke
@@ -196,7 +743,7 @@ def make_recommendations_using_item_based_technique(user_id:int,
         if polarity != 'P': continue # skip
         
         # get the neighbors of the current joke
-        joke_neighbors = get_neighbors(joke_id, ratings, index, hashes)
+        joke_neighbors = get_neighbors(joke_id, ratings, index, hashes, cache=cache)
         
         # loop through neighbors and their similarity value
         for neighbor, sim_value in joke_neighbors:
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from collections import OrderedDict
+
+# ---------------------------------------------------------------------------------------------------
+# Class to keep a bounded number of entries (least recently used entries are evicted)
+# ---------------------------------------------------------------------------------------------------
+
+class LRUCache:
+
+    def __init__(self,
+                 maxsize:int=1024): # maximum number of entries to keep
+        
+        # maximum number of entries
+        self.maxsize = maxsize
+        
+        # hit and miss counters
+        self.hits = 0
+        self.misses = 0
+        
+        # entries ordered from the least to the most recently used
+        self._entries = OrderedDict()
+    
+    def __len__(self):
+        
+        return len(self._entries)
+    
+    def lookup(self,
+               key,
+               is_valid=None): # function telling if a cached value can still be used (e.g., not stale)
+        
+        # get the cached value
+        value = self._entries.get(key)
+        
+        # check if the key is cached (and its value is still valid)
+        if value is None or (is_valid is not None and not is_valid(value)):
+            
+            # increment
+            self.misses += 1
+            
+            return None
+        
+        # increment
+        self.hits += 1
+        
+        # mark as the most recently used entry
+        self._entries.move_to_end(key)
+        
+        return value
+    
+    def store(self,
+              key,
+              value):
+        
+        # drop any previous entry for this key
+        self.discard(key)
+        
+        # store the entry as the most recently used
+        self._entries[key] = value
+        
+        # evict the least recently used entries
+        while len(self._entries) > self.maxsize:
+            self.discard(next(iter(self._entries)))
+    
+    def discard(self,
+                key):
+        
+        # remove the entry, if cached
+        # (subclasses extend this to forget what the entry depends on)
+        return self._entries.pop(key, None)
+    
+    def clear(self):
+        
+        # drop all entries
+        self._entries.clear()
+    
+    def info(self) -> dict:
+        
+        # total number of lookups
+        lookups = self.hits + self.misses
+        
+        return {'hits':self.hits,
+                'misses':self.misses,
+                'hit_rate':self.hits / lookups if lookups > 0 else 0.0,
+                'size':len(self._entries),
+                'maxsize':self.maxsize}
@@ -2,7 +2,121 @@
 # -*- coding: utf-8 -*-
 
 import pandas as pd
-from sklearn.metrics import mean_squared_error
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+import os
+from functions.data_preprocessing import get_user_ratings
+from functions.lru_cache import LRUCache
+
+# id maps of the factors as keys, (id map, pandas index of the ids, rows) as values
+FACTOR_ROW_LOOKUPS = LRUCache(maxsize=16)
+
+# ---------------------------------------------------------------------------------------------------
+# Function to extract the fitted factors of a matrix factorization model (SVD)
+# ---------------------------------------------------------------------------------------------------
+
+def extract_svd_factors(svd) -> dict: # SVD class from surprise library (fitted)
+    
+    # native models (e.g., ALSFactorization) already expose their factors
+    if hasattr(svd, 'get_factors'): return svd.get_factors()
+    
+    # get the train set the model was fitted on
+    trainset = svd.trainset
+    
+    # map raw user and joke ids to their rows in the factor matrices
+    user_index = {trainset.to_raw_uid(inner_id):inner_id for inner_id in trainset.all_users()}
+    item_index = {trainset.to_raw_iid(inner_id):inner_id for inner_id in trainset.all_items()}
+    
+    return {'global_mean':trainset.global_mean,
+            'bu':np.asarray(svd.bu),
+            'bi':np.asarray(svd.bi),
+            'pu':np.asarray(svd.pu),
+            'qi':np.asarray(svd.qi),
+            'biased':svd.biased,
+            'user_index':user_index,
+            'item_index':item_index,
+            'rating_scale':trainset.rating_scale}
+
+# ---------------------------------------------------------------------------------------------------
+# Function to predict the ratings of a user for many jokes at once
+# ---------------------------------------------------------------------------------------------------
+
+def predict_user_ratings(factors:dict, # output of extract_svd_factors
+                         user_id:int,
+                         joke_ids:np.ndarray) -> np.ndarray:
+    
+    # - Reproduces svd.predict(uid, iid).est for every joke with a single vector operation.
+    # - Unknown users or jokes fall back to the available baselines (or the global mean) as in surprise,
+    #   and the estimates are clipped to the rating scale.
+    
+    # get the row of the user (-1 if unknown)
+    u = factors['user_index'].get(user_id, -1)
+    
+    # get the rows of the jokes (-1 if unknown)
+    i = lookup_factor_rows(factors['item_index'], joke_ids)
+    
+    # predict the user's row of the (users x jokes) estimates
+    return predict_ratings_from_rows(factors, np.array([u]), i, outer=True)[0]
+
+# ---------------------------------------------------------------------------------------------------
+# Function to predict ratings from the rows of the users and jokes in the factor matrices
+# ---------------------------------------------------------------------------------------------------
+
+def predict_ratings_from_rows(factors:dict, # output of extract_svd_factors
+                              user_rows:np.ndarray, # rows of the users in the user factors (-1 if unknown)
+                              item_rows:np.ndarray, # rows of the jokes in the item factors (-1 if unknown)
+                              outer:bool=False, # every user with every joke (users x jokes) instead of (user, joke) pairs
+                              pu:np.ndarray=None, # user factors to use instead of factors['pu'] (e.g., folded-in users)
+                              bu:np.ndarray=None) -> np.ndarray: # user biases to use instead of factors['bu']
+    
+    # user factors and biases of the model
+    if pu is None: pu = factors['pu']
+    if bu is None: bu = factors['bu']
+    
+    # masks of the users and jokes known to the model
+    known_user, known_item = user_rows >= 0, item_rows >= 0
+    
+    # gather the factors (zero for unknown users and jokes)
+    P = np.where(known_user[:,None], pu[user_rows], 0)
+    Q = np.where(known_item[:,None], factors['qi'][item_rows], 0)
+    
+    # interaction term: qi @ pu
+    interaction = P @ Q.T if outer else np.einsum('ij,ij->i', P, Q)
+    
+    # users as rows and jokes as columns
+    if outer: known_user, user_rows = known_user[:,None], user_rows[:,None]
+    
+    # baseline estimates, in the same order as surprise: mu + bu + bi + qi @ pu
+    # (unknown users or jokes only get the available baselines)
+    if factors['biased']:
+        est = factors['global_mean'] + np.where(known_user, bu[user_rows], 0) + np.where(known_item, factors['bi'][item_rows], 0)
+        est = est + interaction
+    
+    # without biases, surprise cannot predict unknown users or jokes and falls back to the global mean
+    else:
+        est = np.where(known_user & known_item, interaction, factors['global_mean'])
+    
+    # clip the estimates into the rating scale
+    lower_bound, higher_bound = factors['rating_scale']
+    
+    return np.clip(est, lower_bound, higher_bound)
+
+# ---------------------------------------------------------------------------------------------------
+# Function to select the indices of the k highest scores, sorted by score
+# ---------------------------------------------------------------------------------------------------
+
+def select_top_k(scores:np.ndarray,
+                 k:int) -> np.ndarray:
+    
+    # number of scores to select
+    k = min(k, len(scores))
+    if k <= 0: return np.empty(0, dtype=np.int64)
+    
+    # find the k highest scores without sorting everything
+    top = np.argpartition(-scores, k-1)[:k]
+    
+    # sort them by score (ties are broken by position)
+    return top[np.lexsort((top, -scores[top]))]
 
 # ---------------------------------------------------------------------------------------------------
 # Function to make recommendations using matrix factorization (SVD)
@@ -12,52 +126,135 @@ def make_recommendations_using_matrix_factorization(svd, # SVD class from surpri
                                                     user_id:int,
                                                     df_ratings_up:pd.DataFrame,
                                                     df_jokes:pd.DataFrame,
-                                                    num_jokes_to_recommend:int=10):
+                                                    num_jokes_to_recommend:int=10,
+                                                    factors:dict=None, # output of extract_svd_factors (extracted if None)
+                                                    matrices:dict=None): # output of build_rating_matrices (optional)
     
-    # get the user ratings
-    user_ratings = df_ratings_up[df_ratings_up.user_id == user_id]
+    # extract the factors of the model once
+    if factors is None: factors = extract_svd_factors(svd)
     
-    # create a dict with the jokes and their respective ratings
-    already_rated = dict(zip(user_ratings.joke_id, user_ratings.rating))
+    # get the jokes already rated by the user
+    if matrices is not None: already_rated = get_user_ratings(matrices, user_id).keys()
+    else: already_rated = df_ratings_up.joke_id[df_ratings_up.user_id == user_id].unique()
     
-    # create a dict to store predicted ratings
-    pred_ratings = {}
+    # get all the joke ids
+    joke_ids = df_jokes.joke_id.to_numpy()
     
-    # loop through jokes
-    for i, row in df_jokes.iterrows():
-        
-        # make predictions for each joke
-        pred_ratings[row.joke_id] = svd.predict(uid=user_id, iid=row.joke_id).est
-        
-    # sort jokes by their predicted rating
-    pred_ratings_sorted = sorted(pred_ratings.items(), key=lambda x:x[1], reverse=True)
+    # predict the ratings of all jokes at once
+    pred_ratings = predict_user_ratings(factors, user_id, joke_ids)
     
-    # create a set to store jokes to be recommended
-    jokes_to_recommend = set()
+    # mask the jokes already rated by the user
+    scores = np.where(np.isin(joke_ids, list(already_rated)), -np.inf, pred_ratings)
+    
+    # select the jokes with the highest predicted rating
+    top = select_top_k(scores, num_jokes_to_recommend)
+    top = top[np.isfinite(scores[top])]
     
-    # loop through jokes
-    for joke_id, predicted_rating in pred_ratings_sorted:
-        
-        # check if the joke is already rated by the user
-        if joke_id not in already_rated:
-            
-            # add to the set of jokes to be recommended
-            jokes_to_recommend.add(joke_id)
-            
-            # check if reached the predefined number of jokes to recommend
-            if len(jokes_to_recommend) == num_jokes_to_recommend: break
-            
     # create a dataframe with the recommender jokes
-    df_rec = pd.DataFrame(df_jokes[df_jokes.joke_id.isin(jokes_to_recommend)])
+    df_rec = pd.DataFrame(df_jokes.iloc[top])
     
     # append the predicted rating
-    df_rec['predicted_rating'] = df_rec.joke_id.map(pred_ratings)
+    df_rec['predicted_rating'] = pred_ratings[top]
     
-    # sort jokes by their predicted rating
-    df_rec = df_rec.sort_values(['predicted_rating'], ascending=False)
+    return df_rec
+
+# ---------------------------------------------------------------------------------------------------
+# Function to precompute the top-k unseen jokes of every user (batch job)
+# ---------------------------------------------------------------------------------------------------
+
+def recommend_for_all_users(factors:dict, # output of extract_svd_factors
+                            matrices:dict, # output of build_rating_matrices (jokes already seen)
+                            num_jokes_to_recommend:int=10,
+                            block_size:int=4096, # number of users scored at once
+                            num_threads:int=None, # number of blocks scored concurrently (number of cores if None)
+                            output_path:str=None) -> pd.DataFrame: # .parquet, .feather or .npz file to write the columns to
+    
+    # - Each block computes (block_size x jokes) predicted ratings with a single matrix product,
+    #   so peak memory is bounded by num_threads x block_size x jokes scores.
+    # - NumPy releases the GIL inside BLAS, so the blocks run concurrently on a thread pool.
+    # - The format of the output file follows its suffix: parquet and feather are written by pandas
+    #   (they need pyarrow), any other suffix is written as one .npz array per column.
+    
+    # get the number of threads
+    if num_threads is None: num_threads = os.cpu_count() or 1
+    
+    # get the users and jokes of the rating matrices
+    user_ids, joke_ids = matrices['user_ids'], matrices['joke_ids']
+    seen = matrices['ratings']
+    num_users, num_jokes = len(user_ids), len(joke_ids)
+    
+    # number of jokes to recommend
+    k = min(num_jokes_to_recommend, num_jokes)
+    
+    # rows of the users and jokes in the factor matrices (-1 if unknown)
+    user_rows = lookup_factor_rows(factors['user_index'], user_ids)
+    item_rows = lookup_factor_rows(factors['item_index'], joke_ids)
+    
+    # arrays to store the results
+    top_jokes = np.zeros((num_users, k), dtype=np.int64)
+    top_ratings = np.full((num_users, k), -np.inf)
+    
+    # function to score one block of users
+    def score_block(start:int):
+        
+        # users of the block
+        end = min(start + block_size, num_users)
+        
+        # predicted ratings of the users of the block for every joke
+        est = predict_ratings_from_rows(factors, user_rows[start:end], item_rows, outer=True)
+        
+        # mask the jokes already rated by the users of the block
+        block = seen[start:end]
+        est[np.repeat(np.arange(end - start), np.diff(block.indptr)), block.indices] = -np.inf
+        
+        # select the k highest predicted ratings of each user
+        top = np.argpartition(-est, k-1, axis=1)[:,:k]
+        top_est = np.take_along_axis(est, top, axis=1)
+        
+        # sort them by predicted rating (ties are broken by position)
+        order = np.lexsort((top, -top_est), axis=1)
+        top_jokes[start:end] = np.take_along_axis(top, order, axis=1)
+        top_ratings[start:end] = np.take_along_axis(top_est, order, axis=1)
+    
+    # score the blocks in a thread pool
+    if k > 0:
+        with ThreadPoolExecutor(max_workers=num_threads) as executor:
+            list(executor.map(score_block, range(0, num_users, block_size)))
+    
+    # drop the empty slots of users that have rated almost every joke
+    is_valid = np.isfinite(top_ratings)
+    
+    # flatten the results into columns
+    columns = {'user_id':np.repeat(user_ids, k)[is_valid.ravel()],
+               'rank':np.tile(np.arange(1, k+1), num_users)[is_valid.ravel()],
+               'joke_id':joke_ids[top_jokes[is_valid]],
+               'predicted_rating':top_ratings[is_valid]}
+    
+    # create a dataframe with the recommendations
+    df_rec = pd.DataFrame(columns)
+    
+    # write the columns to disk
+    if output_path is not None: write_columns(df_rec, output_path)
     
     return df_rec
 
+# ---------------------------------------------------------------------------------------------------
+# Function to write a dataframe to a columnar file (format given by the suffix of the path)
+# ---------------------------------------------------------------------------------------------------
+
+def write_columns(df:pd.DataFrame,
+                  output_path:str): # .parquet, .feather or .npz file (str or path)
+    
+    # get the format of the file
+    suffix = os.path.splitext(os.fspath(output_path))[1].lower()
+    
+    # columnar formats of pandas
+    if suffix == '.parquet': df.to_parquet(output_path, index=False)
+    elif suffix == '.feather': df.reset_index(drop=True).to_feather(output_path)
+    
+    # one array per column
+    else: np.savez(output_path, **{column:df[column].to_numpy() for column in df.columns})
+
 # ---------------------------------------------------------------------------------------------------
 # Function to evaluate the recommendations provided by matrix factorization (SVD)
 # ---------------------------------------------------------------------------------------------------
@@ -65,40 +262,235 @@ def make_recommendations_using_matrix_factorization(svd, # SVD class from surpri
 def evaluate_recommendations_by_matrix_factorization(svd, # SVD class from surprise library
                                                      user_id:int,
                                                      df_ratings_up:pd.DataFrame,
-                                                     df_jokes:pd.DataFrame):
+                                                     df_jokes:pd.DataFrame,
+                                                     factors:dict=None): # output of extract_svd_factors (extracted if None)
+    
+    # extract the factors of the model once
+    if factors is None: factors = extract_svd_factors(svd)
     
     # get the user ratings
     user_ratings = df_ratings_up[df_ratings_up.user_id == user_id]
     
-    # create a dict with the jokes and their respective ratings
-    already_rated = dict(zip(user_ratings.joke_id, user_ratings.rating))
+    # predict only the jokes rated by the user
+    predicted = predict_user_ratings(factors, user_id, user_ratings.joke_id.to_numpy())
+    
+    # calculate RMSE
+    rmse = np.sqrt(np.mean((user_ratings.rating.to_numpy() - predicted)**2))
+    
+    # round
+    rmse_rounded = round(rmse,2)
+    
+    # display result
+    print(f'RMSE: {rmse_rounded}')
+    
+    return
+
+# ---------------------------------------------------------------------------------------------------
+# Function to predict the ratings of many (user, joke) pairs at once
+# ---------------------------------------------------------------------------------------------------
+
+def predict_ratings(factors:dict, # output of extract_svd_factors
+                    user_ids:np.ndarray,
+                    joke_ids:np.ndarray) -> np.ndarray:
+    
+    # map raw ids to rows of the factor matrices (-1 if unknown)
+    u = lookup_factor_rows(factors['user_index'], user_ids)
+    i = lookup_factor_rows(factors['item_index'], joke_ids)
+    
+    # predict the (user, joke) pairs
+    return predict_ratings_from_rows(factors, u, i)
+
+# ---------------------------------------------------------------------------------------------------
+# Function to map raw ids to rows of the factor matrices
+# ---------------------------------------------------------------------------------------------------
+
+def lookup_factor_rows(index:dict, # raw id as key, row as value
+                       ids:np.ndarray) -> np.ndarray:
+    
+    # get the lookup arrays of the id map, built once per id map
+    # (the entry keeps the id map alive, so its id cannot be reused by another dict)
+    lookup = FACTOR_ROW_LOOKUPS.lookup(id(index), is_valid=lambda entry:entry[0] is index and len(entry[1]) == len(index))
+    
+    # build them: the keys as a pandas index, and the rows of the keys
+    if lookup is None:
+        lookup = (index, pd.Index(list(index.keys())), np.fromiter(index.values(), dtype=np.int64, count=len(index)))
+        FACTOR_ROW_LOOKUPS.store(id(index), lookup)
+    _, keys, rows = lookup
+    
+    # position of each id among the keys (-1 if unknown)
+    positions = keys.get_indexer(np.asarray(ids))
+    
+    return np.where(positions >= 0, rows[positions], -1)
+
+# ---------------------------------------------------------------------------------------------------
+# Function to evaluate matrix factorization (SVD) on a whole test set at once
+# ---------------------------------------------------------------------------------------------------
+
+def evaluate_matrix_factorization_on_test_set(factors:dict, # output of extract_svd_factors
+                                              df_test:pd.DataFrame): # user_id, joke_id and rating columns
+    
+    # gather the (user, joke) pairs and the actual ratings
+    user_ids = df_test.user_id.to_numpy()
+    actual = df_test.rating.to_numpy(dtype=np.float64)
+    
+    # predict all the pairs at once
+    errors = actual - predict_ratings(factors, user_ids, df_test.joke_id.to_numpy())
+    
+    # global scores
+    scores = {'rmse':float(np.sqrt(np.mean(errors**2))) if len(errors) > 0 else 0.0,
+              'mae':float(np.mean(np.abs(errors))) if len(errors) > 0 else 0.0}
+    
+    # group the errors by user
+    users, inverse, counts = np.unique(user_ids, return_inverse=True, return_counts=True)
+    
+    # per-user scores
+    df_users = pd.DataFrame({'user_id':users,
+                             'num_ratings':counts,
+                             'rmse':np.sqrt(np.bincount(inverse, weights=errors**2) / counts),
+                             'mae':np.bincount(inverse, weights=np.abs(errors)) / counts})
+    
+    return scores, df_users
+
+
+# ---------------------------------------------------------------------------------------------------
+# Function to compute the factors of a new user from a few ratings (fold-in, no retraining)
+# ---------------------------------------------------------------------------------------------------
+
+def fold_in_user(factors:dict, # output of extract_svd_factors
+                 user_ratings:dict, # jokeID as key, rating as value
+                 reg:float=0.1, # regularization of the factors (scaled by the number of ratings)
+                 reg_bias:float=0.1): # regularization of the bias (scaled by the number of ratings)
     
-    # create a dict to store predicted ratings
-    pred_ratings = {}
+    # - Solves a small regularized least squares problem against the fixed item factors:
+    #   (Y^T Y + reg * n * I) [pu, bu] = Y^T (r - mu - bi), with Y = [qi, 1] for the rated jokes.
     
-    # loop through jokes
-    for i, row in df_jokes.iterrows():
+    # number of unknowns (factors, plus the bias if biased)
+    n_factors = factors['qi'].shape[1]
+    k = n_factors + int(factors['biased'])
+    
+    # keep only the jokes known to the model
+    rows = lookup_factor_rows(factors['item_index'], np.array(list(user_ratings.keys())))
+    ratings = np.array(list(user_ratings.values()), dtype=np.float64)[rows >= 0]
+    rows = rows[rows >= 0]
+    
+    # nothing to learn from
+    if len(rows) == 0: return np.zeros(n_factors), 0.0
+    
+    # features and targets of the rated jokes
+    if factors['biased']:
+        Y = np.hstack([factors['qi'][rows], np.ones((len(rows), 1))])
+        t = ratings - factors['global_mean'] - factors['bi'][rows]
+    else:
+        Y = factors['qi'][rows]
+        t = ratings
+    
+    # regularization of each unknown
+    reg_diag = np.full(k, reg)
+    if factors['biased']: reg_diag[-1] = reg_bias
+    
+    # solve the normal equations
+    x = np.linalg.solve(Y.T @ Y + np.diag(len(rows) * reg_diag), Y.T @ t)
+    
+    # split the factors from the bias
+    if factors['biased']: return x[:-1], float(x[-1])
+    
+    return x, 0.0
+
+# ---------------------------------------------------------------------------------------------------
+# Class to keep the folded-in users (least recently used users are evicted)
+# ---------------------------------------------------------------------------------------------------
+
+class FoldInCache(LRUCache):
+    
+    def __init__(self,
+                 maxsize:int=10000): # maximum number of users to keep
         
-        # make predictions for each joke
-        pred_ratings[row.joke_id] = svd.predict(uid=user_id, iid=row.joke_id).est
+        # userID as key, (ratings, pu, bu) as values
+        super().__init__(maxsize)
         
-    # initialize lists to store actual and predicted ratings
-    actual, predicted = list(), list()
+        # item factors and biases the users were folded in against
+        self._item_factors = None
     
-    # loop through rated jokes
-    for joke_id in already_rated:
+    def _check_factors(self,
+                       factors:dict): # output of extract_svd_factors
+        
+        # the fold-in only depends on the item side of the model
+        arrays, params = (factors['qi'], factors['bi']), (factors['global_mean'], factors['biased'])
         
-        # append actual and predicted ratings
-        actual.append(already_rated[joke_id])
-        predicted.append(pred_ratings[joke_id])
+        # a refitted or another model has new arrays: the folded-in users are stale
+        if (self._item_factors is None or params != self._item_factors[1]
+            or any(new is not old for new, old in zip(arrays, self._item_factors[0]))):
+            self.clear()
+            self._item_factors = (arrays, params)
     
-    # calculate RMSE
-    rmse = mean_squared_error(actual, predicted, squared=False)
+    def get(self,
+            factors:dict, # output of extract_svd_factors
+            user_id:int,
+            user_ratings:dict):
+        
+        # drop the users folded in against other factors
+        self._check_factors(factors)
+        
+        # get the cached user
+        # (a user that has rated more jokes since it was folded in is a miss)
+        entry = self.lookup(user_id, is_valid=lambda entry:entry[0] == user_ratings)
+        
+        return (entry[1], entry[2]) if entry is not None else None
     
-    # round
-    rmse_rounded = round(rmse,2)
+    def put(self,
+            factors:dict, # output of extract_svd_factors (the user was folded in against)
+            user_id:int,
+            user_ratings:dict,
+            pu:np.ndarray,
+            bu:float):
+        
+        # drop the users folded in against other factors
+        self._check_factors(factors)
+        
+        # store the user as the most recently used
+        self.store(user_id, (dict(user_ratings), pu, bu))
+
+# ---------------------------------------------------------------------------------------------------
+# Function to recommend jokes to a user that is not part of the trained model
+# ---------------------------------------------------------------------------------------------------
+
+def make_recommendations_for_new_user(factors:dict, # output of extract_svd_factors
+                                      user_id:int,
+                                      user_ratings:dict, # jokeID as key, rating as value
+                                      df_jokes:pd.DataFrame,
+                                      num_jokes_to_recommend:int=10,
+                                      cache:FoldInCache=None, # folded-in users
+                                      reg:float=0.1,
+                                      reg_bias:float=0.1):
     
-    # display result
-    print(f'RMSE: {rmse_rounded}')
+    # get the folded-in factors of the user
+    folded = cache.get(factors, user_id, user_ratings) if cache is not None else None
+    
+    # fold the user in
+    if folded is None:
+        folded = fold_in_user(factors, user_ratings, reg, reg_bias)
+        if cache is not None: cache.put(factors, user_id, user_ratings, *folded)
+    pu, bu = folded
     
-    return
\ No newline at end of file
+    # get all the joke ids and their rows in the item factors
+    joke_ids = df_jokes.joke_id.to_numpy()
+    rows = lookup_factor_rows(factors['item_index'], joke_ids)
+    
+    # predicted ratings with the folded-in factors of the user
+    pred_ratings = predict_ratings_from_rows(factors, np.zeros(1, dtype=np.int64), rows, outer=True,
+                                             pu=pu[None,:], bu=np.array([bu]))[0]
+    
+    # mask the jokes already rated by the user
+    scores = np.where(np.isin(joke_ids, list(user_ratings.keys())), -np.inf, pred_ratings)
+    
+    # select the jokes with the highest predicted rating
+    top = select_top_k(scores, num_jokes_to_recommend)
+    top = top[np.isfinite(scores[top])]
+    
+    # create a dataframe with the recommender jokes
+    df_rec = pd.DataFrame(df_jokes.iloc[top])
+    
+    # append the predicted rating
+    df_rec['predicted_rating'] = pred_ratings[top]
+    
+    return df_rec
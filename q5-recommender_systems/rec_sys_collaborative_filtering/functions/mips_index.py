@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import time
+from functions.matrix_factorization_recommendations import predict_ratings_from_rows, select_top_k
+
+# ---------------------------------------------------------------------------------------------------
+# Class to retrieve the jokes with the highest predicted rating without scoring the whole catalog
+# ---------------------------------------------------------------------------------------------------
+
+class MIPSIndex:
+
+    # - Approximate Maximum Inner Product Search over the item factors of a matrix factorization model.
+    # - For a given user, ranking jokes by mu + bu + bi + qi @ pu is the same as ranking by [qi, bi] @ [pu, 1].
+    # - Norm augmentation turns this inner product into a cosine similarity:
+    #   items become [x, sqrt(M^2 - |x|^2)] / M (all with unit norm) and queries become [y, 0] / |y|.
+    # - Cosine similarity is then indexed with random-hyperplane LSH (num_tables tables of num_bits hyperplanes),
+    #   and the candidates found in the user's buckets (plus num_probes nearby buckets) are re-scored exactly.
+    
+    def __init__(self,
+                 factors:dict, # output of extract_svd_factors
+                 num_tables:int=8, # number of hash tables
+                 num_bits:int=10, # number of hyperplanes per table (buckets = 2^num_bits)
+                 seed:int=0):
+        
+        # store the factors and the hashing parameters
+        self.factors = factors
+        self.num_tables = num_tables
+        self.num_bits = num_bits
+        
+        # joke ids in the order of the item factor rows
+        self.joke_ids = np.array(sorted(factors['item_index'], key=factors['item_index'].get))
+        
+        # augment the item factors with their bias: [qi, bi]
+        items = self._augment_items()
+        
+        # norm augmentation: every item gets norm M, then is scaled to unit norm
+        norms = np.linalg.norm(items, axis=1)
+        M = norms.max() if len(norms) > 0 else 1.0
+        items = np.hstack([items, np.sqrt(np.maximum(M**2 - norms**2, 0))[:,None]]) / M
+        
+        # draw the random hyperplanes of all tables at once
+        rng = np.random.default_rng(seed)
+        self.hyperplanes = rng.standard_normal((items.shape[1], num_tables * num_bits))
+        
+        # bucket code of each item in each table
+        codes = self._hash(items)
+        
+        # sort the items of each table by bucket code
+        # so that a bucket is a contiguous range found with binary search
+        self.order = np.argsort(codes, axis=0, kind='stable')
+        self.sorted_codes = np.take_along_axis(codes, self.order, axis=0)
+    
+    def _augment_items(self) -> np.ndarray:
+    
+        # append the item bias to the item factors
+        if self.factors['biased']: return np.hstack([self.factors['qi'], self.factors['bi'][:,None]])
+        
+        # without biases, append a zero
+        return np.hstack([self.factors['qi'], np.zeros((len(self.factors['qi']), 1))])
+    
+    def _hash(self,
+              vectors:np.ndarray) -> np.ndarray:
+        
+        # signs of the projections on the hyperplanes
+        bits = (vectors @ self.hyperplanes > 0).reshape(len(vectors), self.num_tables, self.num_bits)
+        
+        # pack the bits of each table into an integer code
+        return bits @ (1 << np.arange(self.num_bits, dtype=np.int64))
+    
+    def candidates(self,
+                   user_id:int,
+                   num_probes:int=0) -> np.ndarray: # extra buckets to visit per table (multi-probe)
+        
+        # get the row of the user
+        u = self.factors['user_index'].get(user_id, -1)
+        
+        # unknown users have no factors, so every joke is a candidate
+        if u < 0: return np.arange(len(self.joke_ids))
+        
+        # augmented query: [pu, 1, 0] (its norm does not change the hyperplane signs)
+        query = np.concatenate([self.factors['pu'][u], [1.0, 0.0]])
+        
+        # projections of the query on the hyperplanes of each table
+        projections = (query @ self.hyperplanes).reshape(self.num_tables, self.num_bits)
+        
+        # powers of two to pack the bits into integer codes
+        powers = 1 << np.arange(self.num_bits, dtype=np.int64)
+        
+        # bucket code of the user in each table
+        codes = (projections > 0) @ powers
+        
+        # gather the items of the user's buckets in each table
+        found = list()
+        for t in range(self.num_tables):
+        
+            # the user's bucket, then the buckets reached by flipping the least confident bits
+            probes = [codes[t]] + [codes[t] ^ powers[b] for b in np.argsort(np.abs(projections[t]))[:num_probes]]
+            
+            # each bucket is a contiguous range of the sorted codes
+            for code in probes:
+                start, end = np.searchsorted(self.sorted_codes[:,t], [code, code + 1])
+                found.append(self.order[start:end, t])
+        
+        return np.unique(np.concatenate(found))
+    
+    def score(self,
+              user_id:int,
+              rows:np.ndarray) -> np.ndarray: # rows of the jokes in the item factors
+        
+        # get the row of the user (-1 if unknown, so only the baselines are used)
+        u = self.factors['user_index'].get(user_id, -1)
+        
+        # predicted ratings of the user for the jokes
+        return predict_ratings_from_rows(self.factors, np.array([u]), np.asarray(rows), outer=True)[0]
+    
+    def query(self,
+              user_id:int,
+              k:int=10, # number of jokes to return
+              exclude:set=None, # joke ids to leave out (e.g., already rated)
+              num_probes:int=0): # extra buckets to visit per table (multi-probe)
+        
+        # get the candidate jokes
+        rows = self.candidates(user_id, num_probes)
+        
+        # leave out the excluded jokes
+        if exclude: rows = rows[~np.isin(self.joke_ids[rows], list(exclude))]
+        
+        # score the candidates exactly
+        pred_ratings = self.score(user_id, rows)
+        
+        # select the best candidates
+        top = select_top_k(pred_ratings, k)
+        
+        return self.joke_ids[rows[top]], pred_ratings[top]
+
+# ---------------------------------------------------------------------------------------------------
+# Function to benchmark the recall@k and latency of the MIPS index against exact scoring
+# ---------------------------------------------------------------------------------------------------
+
+def benchmark_mips_index(index:MIPSIndex,
+                         user_ids:list, # users to query
+                         k:int=10,
+                         num_probes:int=0): # extra buckets to visit per table (multi-probe)
+    
+    # rows of all the jokes of the model
+    all_rows = np.arange(len(index.joke_ids))
+    
+    # initialize lists
+    # to store the latencies, recalls and number of candidates
+    exact_latencies, approx_latencies, recalls, num_candidates = list(), list(), list(), list()
+    
+    # loop through users
+    for user_id in user_ids:
+    
+        # exact top-k: score every joke
+        st = time.perf_counter()
+        exact = index.joke_ids[select_top_k(index.score(user_id, all_rows), k)]
+        exact_latencies.append(time.perf_counter() - st)
+        
+        # approximate top-k: score only the candidates
+        st = time.perf_counter()
+        approx, _ = index.query(user_id, k, num_probes=num_probes)
+        approx_latencies.append(time.perf_counter() - st)
+        
+        # recall@k
+        recalls.append(len(set(exact.tolist()).intersection(approx.tolist())) / max(len(exact), 1))
+        
+        # fraction of the catalog scored
+        num_candidates.append(len(index.candidates(user_id, num_probes)) / max(len(all_rows), 1))
+    
+    return {f'recall@{k}':float(np.mean(recalls)),
+            'exact_latency_ms':float(np.mean(exact_latencies) * 1000),
+            'approx_latency_ms':float(np.mean(approx_latencies) * 1000),
+            'candidate_fraction':float(np.mean(num_candidates))}
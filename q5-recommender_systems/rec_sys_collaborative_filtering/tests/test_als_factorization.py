@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import pandas as pd
+import pytest
+from functions.data_preprocessing import build_rating_matrices, unpivot_rating_matrices
+from functions.matrix_factorization_recommendations import (extract_svd_factors, predict_user_ratings,
+                                                            evaluate_matrix_factorization_on_test_set)
+from functions.als_factorization import ALSFactorization
+
+# ---------------------------------------------------------------------------------------------------
+# Function to create random wide ratings with a low-rank structure (users as rows, jokes as columns)
+# ---------------------------------------------------------------------------------------------------
+
+def make_low_rank_ratings(num_users:int=120,
+                          num_jokes:int=40,
+                          rank:int=3,
+                          seed:int=0) -> pd.DataFrame:
+    
+    # random generator
+    rng = np.random.default_rng(seed)
+    
+    # low-rank ratings with biases and some noise, in [-10, 10]
+    values = rng.normal(0, 1.5, (num_users, rank)) @ rng.normal(0, 1.5, (rank, num_jokes))
+    values += rng.normal(0, 1, (num_users, 1)) + rng.normal(0, 1, (1, num_jokes)) + rng.normal(0, 0.3, values.shape)
+    values = np.clip(np.round(values, 2), -10, 10)
+    
+    # about half of the ratings are missing
+    values[rng.random(values.shape) < 0.5] = np.nan
+    
+    return pd.DataFrame(values, index=pd.Index(np.arange(1, num_users + 1), name='user_id'), columns=np.arange(1, num_jokes + 1))
+
+# ---------------------------------------------------------------------------------------------------
+# Function to compute the RMSE of a model on the ratings of the rating matrices
+# ---------------------------------------------------------------------------------------------------
+
+def compute_rmse(model:ALSFactorization,
+                 matrices:dict) -> float:
+    
+    return evaluate_matrix_factorization_on_test_set(extract_svd_factors(model), unpivot_rating_matrices(matrices))[0]['rmse']
+
+# ---------------------------------------------------------------------------------------------------
+# Tests
+# ---------------------------------------------------------------------------------------------------
+
+@pytest.mark.parametrize('biased', [True, False])
+def test_predict_matches_the_factors(biased):
+    
+    # model trained on all the ratings
+    matrices = build_rating_matrices(make_low_rank_ratings())
+    model = ALSFactorization(n_factors=3, n_epochs=5, biased=biased, random_state=0).fit(matrices)
+    factors = model.get_factors()
+    
+    # the factors are built once per fit
+    assert model.get_factors() is factors
+    
+    # known and unknown users and jokes
+    joke_ids = np.arange(1, 43)
+    for user_id in [1, 60, 120, 1000]:
+        expected = predict_user_ratings(factors, user_id, joke_ids)
+        assert [model.predict(user_id, joke_id).est for joke_id in joke_ids] == pytest.approx(expected.tolist(), rel=1e-12, abs=1e-12)
+    
+    # a new fit gives new factors
+    model.fit(matrices)
+    assert model.get_factors() is not factors
+
+def test_warm_start_lowers_the_rmse_of_a_short_retraining():
+    
+    # the previous ratings, and the same users and jokes with more ratings (and a few new users)
+    df = make_low_rank_ratings(num_users=150)
+    df_previous = df.iloc[:120].copy()
+    df_previous[np.random.default_rng(1).random(df_previous.shape) < 0.2] = np.nan
+    matrices_previous, matrices = build_rating_matrices(df_previous), build_rating_matrices(df)
+    
+    # a model trained on the previous ratings
+    model = ALSFactorization(n_factors=3, n_epochs=10, random_state=0).fit(matrices_previous)
+    
+    # a longer training lowers the RMSE
+    assert compute_rmse(model, matrices_previous) < compute_rmse(ALSFactorization(n_factors=3, n_epochs=1, random_state=0).fit(matrices_previous), matrices_previous)
+    
+    # retrain on the new ratings for a single epoch, from the previous factors or from scratch
+    model.n_epochs = 1
+    warm_rmse = compute_rmse(model.fit(matrices, warm_start=True), matrices)
+    cold_rmse = compute_rmse(ALSFactorization(n_factors=3, n_epochs=1, random_state=0).fit(matrices), matrices)
+    
+    # the warm start keeps what was learned
+    assert warm_rmse < cold_rmse
+
+def test_blocks_do_not_change_the_factors():
+    
+    # the same model solved in single-row blocks, in small blocks on threads, and in one block
+    matrices = build_rating_matrices(make_low_rank_ratings())
+    models = [ALSFactorization(n_factors=3, n_epochs=3, block_budget=budget, num_threads=threads, random_state=0).fit(matrices)
+              for budget, threads in [(1, 1), (500, 4), (2**21, 1)]]
+    
+    # same factors
+    for model in models[1:]:
+        np.testing.assert_allclose(model.pu, models[0].pu, rtol=1e-8, atol=1e-10)
+        np.testing.assert_allclose(model.qi, models[0].qi, rtol=1e-8, atol=1e-10)
+        np.testing.assert_allclose(model.bi, models[0].bi, rtol=1e-8, atol=1e-10)
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import re
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+import pytest
+from functions.data_preprocessing import POLARITY_CODES
+from functions.batch_evaluation import build_ranked_items_matrix, evaluate_ranked_lists
+from functions.item_based_recommendations import (evaluate_recommendations_using_decision_support_methods,
+                                                  evaluate_recommendations_using_nDCG,
+                                                  evaluate_recommendations_using_MRR,
+                                                  evaluate_recommendations_using_AP)
+
+# a rating of each polarity (see discretize_rating)
+RATING_OF_POLARITY = {'N':-3.0, 'A':2.0, 'P':7.0}
+
+# polarity of each code
+POLARITY_OF_CODE = {code:polarity for polarity, code in POLARITY_CODES.items()}
+
+# ---------------------------------------------------------------------------------------------------
+# Function to create random users, polarities and ranked recommendations
+# ---------------------------------------------------------------------------------------------------
+
+def make_users(num_users:int=20,
+               num_jokes:int=40,
+               list_length:int=10,
+               seed:int=0):
+    
+    # random generator
+    rng = np.random.default_rng(seed)
+    
+    # user and joke ids (as in the preprocessed dataset)
+    user_ids, joke_ids = np.arange(1, num_users + 1), np.arange(1, num_jokes + 1)
+    
+    # random polarity codes (0: not rated)
+    codes = rng.choice([0, 1, 2, 3], size=(num_users, num_jokes), p=[0.4, 0.2, 0.2, 0.2]).astype(np.int8)
+    
+    # ranked recommendations of each user
+    recommendations = {int(user_id):[int(joke_id) for joke_id in rng.permutation(joke_ids)[:list_length]] for user_id in user_ids}
+    
+    # the loop functions need at least one rated and one "P" rated recommendation
+    for i, user_id in enumerate(user_ids):
+        codes[i, recommendations[int(user_id)][rng.integers(list_length)] - 1] = POLARITY_CODES['P']
+    
+    return user_ids, joke_ids, codes, recommendations
+
+# ---------------------------------------------------------------------------------------------------
+# Function to get the printed scores of the loop evaluation functions for one user
+# ---------------------------------------------------------------------------------------------------
+
+def evaluate_with_loops(user_id:int,
+                        codes:np.ndarray, # polarity codes of the user
+                        joke_ids:np.ndarray,
+                        ranked_jokes:list,
+                        capsys) -> str:
+    
+    # the long ratings of the user
+    rated = [(joke_id, POLARITY_OF_CODE[code]) for joke_id, code in zip(joke_ids.tolist(), codes.tolist()) if code > 0]
+    df_ratings = pd.DataFrame({'user_id':user_id,
+                               'joke_id':[joke_id for joke_id, _ in rated],
+                               'rating':[RATING_OF_POLARITY[polarity] for _, polarity in rated]})
+    
+    # the rated recommendations, in their recommended order
+    # joke_id: (joke, polarity, scaled votes score)
+    polarities = dict(rated)
+    already_rated = {joke_id:('', polarities[joke_id], 0) for joke_id in ranked_jokes if joke_id in polarities}
+    
+    # print the scores of each function
+    capsys.readouterr()
+    evaluate_recommendations_using_decision_support_methods(user_id, df_ratings, already_rated)
+    evaluate_recommendations_using_nDCG(already_rated)
+    evaluate_recommendations_using_MRR(already_rated)
+    evaluate_recommendations_using_AP(already_rated)
+    
+    return capsys.readouterr().out
+
+# ---------------------------------------------------------------------------------------------------
+# Tests
+# ---------------------------------------------------------------------------------------------------
+
+@pytest.mark.parametrize('sparse', [False, True])
+def test_batch_metrics_match_the_loop_functions(sparse, capsys):
+    
+    # random users
+    user_ids, joke_ids, codes, recommendations = make_users()
+    user_index = {int(user_id):i for i, user_id in enumerate(user_ids)}
+    joke_index = {int(joke_id):j for j, joke_id in enumerate(joke_ids)}
+    
+    # evaluate all users at once
+    ranked_items = build_ranked_items_matrix(recommendations, user_index, joke_index)
+    _, per_user = evaluate_ranked_lists(ranked_items, sp.csr_matrix(codes) if sparse else codes)
+    
+    for i, user_id in enumerate(user_ids.tolist()):
+        
+        # scores printed by the loop functions
+        out = evaluate_with_loops(user_id, codes[i], joke_ids, recommendations[user_id], capsys)
+        
+        # precision and recall (exact counts)
+        count_p, count_total = map(int, re.search(r'Precision: \d+% - \((\d+)/(\d+)\)', out).groups())
+        count_p_recall, count_total_p = map(int, re.search(r'Recall: \d+% - \((\d+)/(\d+)\)', out).groups())
+        assert per_user['precision'][i] == pytest.approx(count_p / count_total)
+        assert per_user['recall'][i] == pytest.approx(count_p_recall / count_total_p)
+        
+        # nDCG, MRR and AP (as rounded by the loop functions)
+        assert f'nDCG: {round(per_user["nDCG"][i],2)}' in out
+        assert f'Mean Reciprocal Rank: {round(per_user["MRR"][i],2)}' in out
+        assert f'Average Precision: {int(round(per_user["AP"][i],2)*100)}%' in out
+
+def test_users_without_rated_recommendations_score_zero():
+    
+    # one user without any rated recommendation, one with a shorter list
+    codes = np.array([[0, 0, 3, 3],
+                      [3, 1, 0, 0]], dtype=np.int8)
+    ranked_items = build_ranked_items_matrix({1:[1, 2], 2:[2]}, {1:0, 2:1}, {1:0, 2:1, 3:2, 4:3})
+    
+    aggregate, per_user = evaluate_ranked_lists(ranked_items, codes)
+    
+    # padded positions are ignored
+    assert ranked_items.tolist() == [[0, 1], [1, -1]]
+    
+    # every metric of the first user is 0, and the second user has no relevant recommendation
+    for metric, scores in per_user.items():
+        assert scores[0] == 0
+    assert per_user['precision'][1] == 0 and per_user['recall'][1] == 0
+    assert per_user['nDCG'][1] == 0
+    assert aggregate['precision'] == 0
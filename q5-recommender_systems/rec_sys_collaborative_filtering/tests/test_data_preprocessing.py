@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+from pathlib import Path
+import numpy as np
+import pandas as pd
+from functions.data_preprocessing import (preprocess_ratings_dataset, unpivot_ratings, unpivot_ratings_to_coo,
+                                          build_rating_matrices, unpivot_rating_matrices, fingerprint_ratings)
+
+# ---------------------------------------------------------------------------------------------------
+# Function to create a random wide ratings dataset (as read from the excel file)
+# ---------------------------------------------------------------------------------------------------
+
+def make_wide_ratings(num_users:int=25,
+                      num_jokes:int=12,
+                      seed:int=0) -> pd.DataFrame:
+    
+    # random generator
+    rng = np.random.default_rng(seed)
+    
+    # ratings in [-10, 10], with 99 for the jokes that are not rated
+    values = np.round(rng.uniform(-10, 10, size=(num_users, num_jokes)), 2)
+    values[rng.random((num_users, num_jokes)) < 0.4] = 99
+    
+    # one user without any rating
+    values[3] = 99
+    
+    # jokes as columns 1..num_jokes, as with usecols in the notebook
+    return preprocess_ratings_dataset(pd.DataFrame(values, columns=range(1, num_jokes + 1)))
+
+# ---------------------------------------------------------------------------------------------------
+# Function to sort a long ratings dataframe by user and joke
+# ---------------------------------------------------------------------------------------------------
+
+def sort_long_ratings(df:pd.DataFrame) -> pd.DataFrame:
+    
+    return df.sort_values(['user_id', 'joke_id']).reset_index(drop=True)[['user_id', 'joke_id', 'rating']]
+
+# ---------------------------------------------------------------------------------------------------
+# Tests
+# ---------------------------------------------------------------------------------------------------
+
+def test_coo_unpivot_matches_melt():
+    
+    # random wide ratings
+    df = make_wide_ratings()
+    
+    # unpivot with pandas melt, and chunk by chunk (several chunks)
+    expected = sort_long_ratings(unpivot_ratings(df))
+    result = pd.DataFrame(unpivot_ratings_to_coo(df, chunk_size=7))
+    
+    # the coo rows are already sorted by user
+    assert result.user_id.is_monotonic_increasing
+    
+    # same ratings
+    pd.testing.assert_frame_equal(sort_long_ratings(result), expected, check_dtype=False)
+
+def test_rating_matrices_match_melt_and_their_cache(tmp_path):
+    
+    # random wide ratings
+    df = make_wide_ratings()
+    expected = sort_long_ratings(unpivot_ratings(df))
+    
+    # build the matrices, then load them back from the cache
+    # (the cache file gets the .npz suffix)
+    cache_path = str(tmp_path / 'ratings')
+    matrices = build_rating_matrices(df, cache_path=cache_path, chunk_size=7)
+    cached = build_rating_matrices(df, cache_path=cache_path, chunk_size=7)
+    assert os.path.exists(cache_path + '.npz')
+    
+    # same ratings (the matrices store float32 ratings)
+    for m in [matrices, cached]:
+        result = sort_long_ratings(unpivot_rating_matrices(m))
+        pd.testing.assert_frame_equal(result[['user_id', 'joke_id']], expected[['user_id', 'joke_id']], check_dtype=False)
+        np.testing.assert_allclose(result.rating.to_numpy(), expected.rating.to_numpy(), rtol=1e-6)
+
+def test_rating_matrices_cache_is_rebuilt_when_the_ratings_change(tmp_path):
+    
+    # build the cache (from a path object)
+    df = make_wide_ratings()
+    cache_path = Path(tmp_path) / 'ratings.npz'
+    build_rating_matrices(df, cache_path=cache_path)
+    
+    # change one rating value (same users, jokes and shape)
+    changed = df.copy()
+    user_id, joke_id = sort_long_ratings(unpivot_ratings(df)).iloc[0][['user_id', 'joke_id']]
+    changed.loc[user_id, joke_id] = 9.5
+    
+    # the cache is not served for the changed ratings
+    matrices = build_rating_matrices(changed, cache_path=cache_path)
+    result = unpivot_rating_matrices(matrices)
+    assert result[(result.user_id == user_id) & (result.joke_id == joke_id)].rating.item() == 9.5
+    
+    # and the rebuilt cache is keyed on the changed ratings
+    assert matrices['fingerprint'] == fingerprint_ratings(changed) != fingerprint_ratings(df)
+    assert build_rating_matrices(changed, cache_path=cache_path)['fingerprint'] == matrices['fingerprint']
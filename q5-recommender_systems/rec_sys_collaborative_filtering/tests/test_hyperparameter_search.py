@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import pytest
+
+pytest.importorskip('surprise')
+
+from functions.hyperparameter_search import search_svd_hyperparameters, share_array, init_search_worker, evaluate_svd_fold, _shared
+
+# ---------------------------------------------------------------------------------------------------
+# Function to create random COO ratings (as returned by unpivot_ratings_to_coo)
+# ---------------------------------------------------------------------------------------------------
+
+def make_coo(num_users:int=60,
+             num_jokes:int=20,
+             seed:int=0) -> dict:
+    
+    # random generator
+    rng = np.random.default_rng(seed)
+    
+    # low-rank ratings in [-10, 10], about 60% of them rated
+    values = np.clip(rng.normal(0, 2, (num_users, 2)) @ rng.normal(0, 2, (2, num_jokes)), -10, 10)
+    users, jokes = np.nonzero(rng.random((num_users, num_jokes)) < 0.6)
+    
+    return {'user_id':users + 1, 'joke_id':jokes + 1, 'rating':values[users, jokes].astype(np.float32)}
+
+# ---------------------------------------------------------------------------------------------------
+# Tests
+# ---------------------------------------------------------------------------------------------------
+
+def test_successive_halving_trains_the_winner_with_the_full_budget():
+    
+    # 4 configurations: 2 are kept after the first rung, 1 after the second
+    coo = make_coo()
+    param_grid = {'n_factors':[2, 8], 'lr_all':[0.005, 0.02]}
+    best_params, df_trials = search_svd_hyperparameters(coo, param_grid, n_folds=3, min_epochs=2, max_epochs=10, eta=3, num_workers=2)
+    
+    # rungs of 4, 2 and 1 configurations, the last one with max_epochs
+    assert df_trials.groupby('rung').size().tolist() == [4, 2, 1]
+    assert df_trials.groupby('rung').n_epochs.first().tolist() == [2, 6, 10]
+    
+    # the winner is the configuration of the last rung, among the best of the previous rung
+    last = df_trials[df_trials.rung == 2].iloc[0]
+    assert best_params == {'n_factors':last.n_factors, 'lr_all':last.lr_all}
+    previous = df_trials[df_trials.rung == 1]
+    assert best_params == previous.loc[previous.rmse.idxmin(), ['n_factors', 'lr_all']].to_dict()
+    
+    # the scores computed by the workers match the same folds evaluated in this process
+    folds = np.random.default_rng(0).permutation(len(coo['rating'])) % 3
+    blocks = [share_array(np.asarray(array)) for array in (coo['user_id'], coo['joke_id'], coo['rating'].astype(np.float64), folds)]
+    try:
+        init_search_worker(dict(zip(['user_ids', 'joke_ids', 'ratings', 'folds'], [spec for _, spec in blocks])), (-10, 10))
+        rmse = np.mean([evaluate_svd_fold(best_params, 10, fold, 0)[0] for fold in range(3)])
+    finally:
+        for shm in _shared.pop('shm'): shm.close()
+        _shared.clear()
+        for shm, _ in blocks:
+            shm.close()
+            shm.unlink()
+    assert last.rmse == pytest.approx(rmse)
+
+def test_a_single_configuration_is_trained_with_the_full_budget_at_once():
+    
+    best_params, df_trials = search_svd_hyperparameters(make_coo(), {'n_factors':[4]}, n_folds=2, min_epochs=2, max_epochs=8, num_workers=1)
+    
+    # one rung, with max_epochs
+    assert best_params == {'n_factors':4}
+    assert df_trials.n_epochs.tolist() == [8]
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import pytest
+from functions.item_based_recommendations import (create_LSH_index, create_LSH_index_in_parallel, get_neighbors,
+                                                  NeighborCache, update_item_ratings, make_LSH_storage_config,
+                                                  load_LSH_index, get_LSH_storage_keys)
+
+# ---------------------------------------------------------------------------------------------------
+# Function to create random (userID, polarity) ratings per joke
+# ---------------------------------------------------------------------------------------------------
+
+def make_ratings(num_jokes:int=30,
+                 num_users:int=200,
+                 seed:int=0) -> dict:
+    
+    # random generator
+    rng = np.random.default_rng(seed)
+    
+    # jokeID as key, set of (userID, polarity) as value
+    # (some jokes have too few ratings to be indexed)
+    ratings = dict()
+    for joke_id in range(1, num_jokes + 1):
+        users = rng.choice(np.arange(1, num_users + 1), size=int(rng.integers(3, 60)), replace=False)
+        ratings[joke_id] = {(int(user_id), str(rng.choice(['N', 'A', 'P']))) for user_id in users}
+    
+    return ratings
+
+# ---------------------------------------------------------------------------------------------------
+# Tests
+# ---------------------------------------------------------------------------------------------------
+
+def test_parallel_LSH_index_matches_the_sequential_index():
+    
+    # random ratings
+    ratings = make_ratings()
+    
+    # build both indexes
+    index, hashes = create_LSH_index(ratings, num_perm=128, min_num_ratings=10)
+    parallel_index, parallel_hashes = create_LSH_index_in_parallel(ratings, num_perm=128, min_num_ratings=10, num_workers=2)
+    
+    # the same entities are indexed, with the same signatures
+    assert set(parallel_hashes) == set(hashes) == {joke_id for joke_id, its_ratings in ratings.items() if len(its_ratings) >= 10}
+    for joke_id, signature in hashes.items():
+        assert np.array_equal(parallel_hashes[joke_id].hashvalues, signature.hashvalues)
+        assert parallel_hashes[joke_id].jaccard(signature) == 1.0
+    
+    # and both indexes return the same neighbors
+    for joke_id, signature in hashes.items():
+        assert sorted(parallel_index.query(signature)) == sorted(index.query(signature))
+
+def test_update_item_ratings_invalidates_the_cached_neighbors():
+    
+    # random ratings, with joke 2 close to joke 1 and joke 3 far from it
+    ratings = make_ratings()
+    ratings[1] = {(user_id, 'P') for user_id in range(1, 41)}
+    ratings[2] = {(user_id, 'P') for user_id in range(1, 37)}
+    ratings[3] = {(user_id, 'N') for user_id in range(100, 140)}
+    index, hashes = create_LSH_index(ratings, num_perm=128)
+    
+    # the second lookup is served by the cache
+    cache = NeighborCache()
+    neighbors = get_neighbors(1, ratings, index, hashes, cache=cache)
+    assert get_neighbors(1, ratings, index, hashes, cache=cache) == neighbors
+    assert cache.info()['hits'] == 1 and dict(neighbors)[2] == 0.9
+    
+    # a neighbor changes: the entries computed against it are dropped
+    update_item_ratings(2, {(user_id, 'P') for user_id in range(1, 21)}, ratings, index, hashes, cache, num_perm=128)
+    assert len(cache) == 0
+    assert dict(get_neighbors(1, ratings, index, hashes, cache=cache))[2] == 0.5
+    
+    # an item that was not a candidate becomes one: the entries of its new candidates are dropped
+    update_item_ratings(3, set(ratings[1]), ratings, index, hashes, cache, num_perm=128)
+    neighbors = get_neighbors(1, ratings, index, hashes, cache=cache)
+    assert dict(neighbors)[3] == 1.0
+    assert neighbors == get_neighbors(1, ratings, index, hashes)
+
+def test_neighbor_cache_evicts_the_least_recently_used_entries():
+    
+    # cache of two entries
+    cache = NeighborCache(maxsize=2)
+    cache.put(1, 0.2, [(2, 0.5)], [2])
+    cache.put(2, 0.2, [(1, 0.5)], [1])
+    
+    # use the first entry, then add a third one
+    assert cache.get(1, 0.2) == [(2, 0.5)]
+    cache.put(3, 0.2, [(1, 0.3)], [1])
+    
+    # the second entry was the least recently used
+    assert len(cache) == 2
+    assert cache.get(2, 0.2) is None
+    assert cache.get(1, 0.2) == [(2, 0.5)] and cache.get(3, 0.2) == [(1, 0.3)]
+    
+    # the evicted entry no longer depends on its candidates
+    cache.invalidate(1)
+    assert cache.get(3, 0.2) is None and cache.get(1, 0.2) is None
+    assert cache.info()['size'] == 0
+
+def test_shared_index_lifecycle_next_to_an_index_with_the_same_prefix(monkeypatch):
+    
+    # in-memory redis server (shared by every client, as a real server would be)
+    fakeredis = pytest.importorskip('fakeredis')
+    import redis
+    server = fakeredis.FakeServer()
+    monkeypatch.setattr(redis, 'Redis', lambda **kwargs: fakeredis.FakeRedis(server=server))
+    client = fakeredis.FakeRedis(server=server)
+    
+    # two indexes, one basename being a prefix of the other
+    ratings = make_ratings()
+    jokes, jokes_v2 = make_LSH_storage_config('redis', 'jokes'), make_LSH_storage_config('redis', 'jokes_v2')
+    create_LSH_index(ratings, num_perm=128, storage_config=jokes_v2)
+    v2_keys = set(client.keys(b'jokes_v2_*'))
+    
+    # build: another process loads the same signatures and neighbors
+    index, hashes = create_LSH_index(ratings, num_perm=128, storage_config=jokes)
+    loaded_index, loaded_hashes = load_LSH_index(jokes)
+    assert set(loaded_hashes) == set(hashes)
+    for joke_id, signature in hashes.items():
+        assert np.array_equal(loaded_hashes[joke_id].hashvalues, signature.hashvalues)
+        assert sorted(loaded_index.query(signature)) == sorted(index.query(signature))
+    
+    # update: the new signature is shared
+    update_item_ratings(1, {(user_id, 'P') for user_id in range(1, 31)}, ratings, index, hashes,
+                        num_perm=128, storage_config=jokes)
+    loaded_index, loaded_hashes = load_LSH_index(jokes)
+    assert np.array_equal(loaded_hashes[1].hashvalues, hashes[1].hashvalues)
+    assert 1 in loaded_index.query(hashes[1])
+    
+    # rebuild under the same basename: the previous keys are replaced, the other index is untouched
+    index, hashes = create_LSH_index(ratings, num_perm=128, storage_config=jokes)
+    assert set(client.keys(b'jokes_v2_*')) == v2_keys
+    assert len(client.keys()) == len(v2_keys) + len(get_LSH_storage_keys(client, b'jokes'))
+    assert set(load_LSH_index(jokes_v2)[1]) == set(load_LSH_index(jokes)[1]) == set(hashes)
@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+import pytest
+from functions.data_preprocessing import build_rating_matrices, get_user_ratings
+from functions.matrix_factorization_recommendations import (extract_svd_factors, predict_user_ratings,
+                                                            make_recommendations_using_matrix_factorization,
+                                                            recommend_for_all_users,
+                                                            evaluate_recommendations_by_matrix_factorization,
+                                                            evaluate_matrix_factorization_on_test_set,
+                                                            fold_in_user, FoldInCache, make_recommendations_for_new_user,
+                                                            lookup_factor_rows, FACTOR_ROW_LOOKUPS)
+from functions.als_factorization import ALSFactorization
+
+# ---------------------------------------------------------------------------------------------------
+# Function to create random long ratings (user_id, joke_id, rating)
+# ---------------------------------------------------------------------------------------------------
+
+def make_long_ratings(num_users:int=40,
+                      num_jokes:int=25,
+                      seed:int=0) -> pd.DataFrame:
+    
+    # random generator
+    rng = np.random.default_rng(seed)
+    
+    # about 60% of the (user, joke) pairs are rated, with ratings in [-10, 10]
+    users, jokes = np.nonzero(rng.random((num_users, num_jokes)) < 0.6)
+    
+    return pd.DataFrame({'user_id':users + 1,
+                         'joke_id':jokes + 1,
+                         'rating':np.round(rng.uniform(-10, 10, size=len(users)), 2)})
+
+# ---------------------------------------------------------------------------------------------------
+# Function to fit a surprise SVD on long ratings
+# ---------------------------------------------------------------------------------------------------
+
+def fit_svd(df:pd.DataFrame,
+            biased:bool=True):
+    
+    surprise = pytest.importorskip('surprise')
+    
+    # load the ratings as the notebook does
+    data = surprise.Dataset.load_from_df(df[['user_id', 'joke_id', 'rating']], surprise.Reader(rating_scale=(-10, 10)))
+    
+    # fit on all the ratings
+    svd = surprise.SVD(n_factors=8, n_epochs=10, biased=biased, random_state=0)
+    svd.fit(data.build_full_trainset())
+    
+    return svd
+
+# ---------------------------------------------------------------------------------------------------
+# Tests
+# ---------------------------------------------------------------------------------------------------
+
+@pytest.mark.parametrize('biased', [True, False])
+def test_predict_user_ratings_matches_svd_predict(biased):
+    
+    # model trained without the last joke
+    df = make_long_ratings()
+    svd = fit_svd(df[df.joke_id < 25], biased=biased)
+    factors = extract_svd_factors(svd)
+    
+    # known jokes, an unknown joke, known users and an unknown user
+    joke_ids = np.arange(1, 27)
+    for user_id in [1, 17, 40, 1000]:
+        expected = [svd.predict(user_id, joke_id).est for joke_id in joke_ids]
+        np.testing.assert_allclose(predict_user_ratings(factors, user_id, joke_ids), expected, rtol=1e-12, atol=1e-12)
+
+def test_recommendations_are_the_highest_unrated_svd_predictions():
+    
+    # model trained on all the ratings
+    df = make_long_ratings()
+    svd = fit_svd(df)
+    df_jokes = pd.DataFrame({'joke_id':np.arange(1, 26), 'joke':[f'joke {i}' for i in range(1, 26)]})
+    
+    for user_id in [1, 17, 40]:
+        
+        # the unrated jokes ranked by svd.predict, as the per-joke loop did
+        rated = set(df.joke_id[df.user_id == user_id])
+        expected = sorted(((svd.predict(user_id, joke_id).est, joke_id) for joke_id in df_jokes.joke_id if joke_id not in rated),
+                          key=lambda pair:-pair[0])[:5]
+        
+        df_rec = make_recommendations_using_matrix_factorization(svd, user_id, df, df_jokes, num_jokes_to_recommend=5)
+        
+        # same jokes, in the same order, with the same predicted ratings
+        assert df_rec.joke_id.tolist() == [joke_id for _, joke_id in expected]
+        np.testing.assert_allclose(df_rec.predicted_rating.to_numpy(), [est for est, _ in expected], rtol=1e-12)
+
+@pytest.mark.parametrize('suffix', ['.npz', '.parquet', '.feather'])
+def test_all_users_recommendations_match_the_single_user_recommendations(suffix, tmp_path):
+    
+    # parquet and feather are written by pandas with pyarrow
+    if suffix != '.npz': pytest.importorskip('pyarrow')
+    
+    # model trained on all the ratings, and the rating matrices of the same ratings
+    # (a user that has rated every joke gets no recommendation)
+    df = make_long_ratings()
+    df = pd.concat([df[df.user_id != 5], pd.DataFrame({'user_id':5, 'joke_id':np.arange(1, 26), 'rating':1.0})])
+    svd = fit_svd(df)
+    matrices = build_rating_matrices(df.pivot(index='user_id', columns='joke_id', values='rating'))
+    df_jokes = pd.DataFrame({'joke_id':np.arange(1, 26)})
+    
+    # all users at once, with several blocks and threads
+    output_path = tmp_path / f'recommendations{suffix}'
+    df_all = recommend_for_all_users(extract_svd_factors(svd), matrices, num_jokes_to_recommend=5,
+                                     block_size=7, num_threads=3, output_path=output_path)
+    
+    # same jokes, ranks and predicted ratings as one user at a time
+    for user_id in matrices['user_ids'].tolist():
+        df_rec = make_recommendations_using_matrix_factorization(svd, user_id, df, df_jokes, num_jokes_to_recommend=5)
+        df_user = df_all[df_all.user_id == user_id]
+        assert df_user.joke_id.tolist() == df_rec.joke_id.tolist()
+        assert df_user['rank'].tolist() == list(range(1, len(df_rec) + 1))
+        np.testing.assert_allclose(df_user.predicted_rating.to_numpy(), df_rec.predicted_rating.to_numpy(), rtol=1e-12)
+    assert (df_all.user_id == 5).sum() == 0
+    
+    # the file holds the same columns
+    if suffix == '.parquet': df_file = pd.read_parquet(output_path)
+    elif suffix == '.feather': df_file = pd.read_feather(output_path)
+    else:
+        with np.load(output_path) as f: df_file = pd.DataFrame({column:f[column] for column in f.files})
+    pd.testing.assert_frame_equal(df_file[df_all.columns.tolist()], df_all.reset_index(drop=True))
+
+def test_test_set_evaluation_matches_svd_predict(capsys):
+    
+    # model trained on 80% of the ratings, evaluated on the rest
+    # (the test set has a user unknown to the model)
+    df = make_long_ratings()
+    is_test = np.random.default_rng(1).random(len(df)) < 0.2
+    df_train, df_test = df[~is_test], df[is_test | (df.user_id == 40)]
+    svd = fit_svd(df_train[df_train.user_id != 40])
+    factors = extract_svd_factors(svd)
+    
+    scores, df_users = evaluate_matrix_factorization_on_test_set(factors, df_test)
+    
+    # errors of svd.predict, one pair at a time
+    errors = df_test.rating.to_numpy() - [svd.predict(user_id, joke_id).est for user_id, joke_id in zip(df_test.user_id, df_test.joke_id)]
+    
+    # global scores
+    assert scores['rmse'] == pytest.approx(np.sqrt(np.mean(errors**2)))
+    assert scores['mae'] == pytest.approx(np.mean(np.abs(errors)))
+    
+    # per-user scores
+    df_errors = pd.DataFrame({'user_id':df_test.user_id.to_numpy(), 'error':errors})
+    for user_id, group in df_errors.groupby('user_id'):
+        row = df_users[df_users.user_id == user_id].iloc[0]
+        assert row.num_ratings == len(group)
+        assert row.rmse == pytest.approx(np.sqrt(np.mean(group.error**2)))
+        assert row.mae == pytest.approx(np.mean(np.abs(group.error)))
+        
+        # the single user evaluation prints the same RMSE
+        evaluate_recommendations_by_matrix_factorization(svd, user_id, df_test, None, factors=factors)
+        assert capsys.readouterr().out == f'RMSE: {round(row.rmse,2)}\n'
+
+@pytest.mark.parametrize('biased', [True, False])
+def test_fold_in_user_matches_the_factors(biased):
+    
+    # an ALS model of the ratings
+    df = make_long_ratings()
+    matrices = build_rating_matrices(df.pivot(index='user_id', columns='joke_id', values='rating'))
+    model = ALSFactorization(n_factors=4, n_epochs=3, reg=0.05, reg_bias=0.02, biased=biased, random_state=0).fit(matrices)
+    factors = model.get_factors()
+    
+    # one more ALS half-epoch solves every user against the fixed item factors
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        pu, bu = model._solve_side(matrices['ratings'].astype(np.float64).tocsr(), factors['qi'], factors['bi'], executor)
+    
+    # folding a user in solves the same regularized least squares (on the same float32 ratings)
+    for user_id in [1, 17, 40]:
+        user_ratings = get_user_ratings(matrices, user_id)
+        user_pu, user_bu = fold_in_user(factors, user_ratings, reg=0.05, reg_bias=0.02)
+        u = factors['user_index'][user_id]
+        np.testing.assert_allclose(user_pu, pu[u], rtol=1e-8, atol=1e-10)
+        assert user_bu == pytest.approx(bu[u], rel=1e-8, abs=1e-10)
+    
+    # jokes unknown to the model are ignored, and a user without known jokes gets no factors
+    assert np.array_equal(fold_in_user(factors, {1000:5.0})[0], np.zeros(4))
+    np.testing.assert_allclose(fold_in_user(factors, {**user_ratings, 1000:5.0})[0], fold_in_user(factors, user_ratings)[0])
+
+def test_fold_in_cache_is_dropped_when_the_factors_change():
+    
+    # an ALS model of the ratings, and a new user
+    df = make_long_ratings()
+    matrices = build_rating_matrices(df.pivot(index='user_id', columns='joke_id', values='rating'))
+    model = ALSFactorization(n_factors=4, n_epochs=3, random_state=0).fit(matrices)
+    df_jokes = pd.DataFrame({'joke_id':np.arange(1, 26)})
+    user_ratings = {1:8.0, 2:-3.0, 5:6.5}
+    
+    # the second request of the user is served by the cache, with the same recommendations
+    cache = FoldInCache()
+    df_rec = make_recommendations_for_new_user(model.get_factors(), 1000, user_ratings, df_jokes, cache=cache)
+    pd.testing.assert_frame_equal(make_recommendations_for_new_user(model.get_factors(), 1000, user_ratings, df_jokes, cache=cache), df_rec)
+    assert cache.info()['hits'] == 1
+    
+    # after a refit, the user is folded in again against the new factors
+    model.fit(matrices, warm_start=True)
+    df_rec = make_recommendations_for_new_user(model.get_factors(), 1000, user_ratings, df_jokes, cache=cache)
+    pd.testing.assert_frame_equal(df_rec, make_recommendations_for_new_user(model.get_factors(), 1000, user_ratings, df_jokes))
+    assert cache.info()['hits'] == 1 and len(cache) == 1
+
+def test_factor_row_lookups_are_built_once_per_id_map():
+    
+    # an id map and the lookups of several id arrays
+    index = {joke_id:row for row, joke_id in enumerate([7, 3, 5])}
+    hits = FACTOR_ROW_LOOKUPS.hits
+    assert lookup_factor_rows(index, np.array([3, 4, 7])).tolist() == [1, -1, 0]
+    assert lookup_factor_rows(index, np.array([5])).tolist() == [2]
+    assert FACTOR_ROW_LOOKUPS.hits == hits + 1
+    
+    # another id map with the same keys but other rows is not served the first lookup
+    assert lookup_factor_rows({joke_id:row for row, joke_id in enumerate([3, 5, 7])}, np.array([3, 4, 7])).tolist() == [0, -1, 2]
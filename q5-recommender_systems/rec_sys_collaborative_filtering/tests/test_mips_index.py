@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import numpy as np
+from functions.matrix_factorization_recommendations import predict_user_ratings, select_top_k
+from functions.mips_index import MIPSIndex, benchmark_mips_index
+
+# ---------------------------------------------------------------------------------------------------
+# Function to create random factors (as returned by extract_svd_factors)
+# ---------------------------------------------------------------------------------------------------
+
+def make_factors(num_users:int=50,
+                 num_jokes:int=5000,
+                 n_factors:int=16,
+                 seed:int=0) -> dict:
+    
+    # random generator
+    rng = np.random.default_rng(seed)
+    
+    # item factors with different norms, so that the norm augmentation matters
+    qi = rng.standard_normal((num_jokes, n_factors)) * rng.uniform(0.2, 1.5, size=(num_jokes, 1))
+    
+    # wide rating scale, so that no estimate is clipped
+    return {'global_mean':1.0,
+            'bu':rng.normal(0, 0.5, size=num_users),
+            'bi':rng.normal(0, 0.5, size=num_jokes),
+            'pu':rng.standard_normal((num_users, n_factors)),
+            'qi':qi,
+            'biased':True,
+            'user_index':{user_id:u for u, user_id in enumerate(range(1, num_users + 1))},
+            'item_index':{joke_id:i for i, joke_id in enumerate(range(1, num_jokes + 1))},
+            'rating_scale':(-1e9, 1e9)}
+
+# ---------------------------------------------------------------------------------------------------
+# Tests
+# ---------------------------------------------------------------------------------------------------
+
+def test_mips_index_recall_against_exact_search():
+    
+    # random factors and their index
+    factors = make_factors()
+    index = MIPSIndex(factors, num_tables=16, num_bits=6)
+    user_ids = list(factors['user_index'])
+    
+    # recall@10 against exact scoring, with more and more probed buckets
+    results = [benchmark_mips_index(index, user_ids, k=10, num_probes=num_probes) for num_probes in [0, 1, 2]]
+    recalls = [result['recall@10'] for result in results]
+    fractions = [result['candidate_fraction'] for result in results]
+    
+    # probing more buckets finds more of the exact top-k, by scoring more of the catalog
+    assert recalls[0] < recalls[1] < recalls[2]
+    assert fractions[0] < fractions[1] < fractions[2]
+    
+    # with 2 probes, most of the exact top-k is found while scoring about half of the catalog
+    assert recalls[2] >= 0.9 and fractions[2] < 0.6
+
+def test_mips_index_results_are_exactly_scored():
+    
+    # random factors and their index
+    factors = make_factors()
+    index = MIPSIndex(factors, num_tables=16, num_bits=6)
+    all_jokes = np.arange(1, 5001)
+    
+    # a known user, with some jokes left out
+    exclude = set(range(1, 1001))
+    joke_ids, pred_ratings = index.query(7, k=10, exclude=exclude, num_probes=2)
+    
+    # the returned jokes are sorted by their exact predicted rating, without the excluded jokes
+    np.testing.assert_allclose(pred_ratings, predict_user_ratings(factors, 7, joke_ids), rtol=1e-12)
+    assert np.all(np.diff(pred_ratings) <= 0) and not exclude.intersection(joke_ids.tolist())
+    
+    # an unknown user is scored on the whole catalog, so the result is exact
+    joke_ids, pred_ratings = index.query(1000, k=10)
+    expected = predict_user_ratings(factors, 1000, all_jokes)
+    assert joke_ids.tolist() == all_jokes[select_top_k(expected, 10)].tolist()
@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import time
+from functions.content_based_recommendations import SummaryEmbeddings, MovieSimilarityEngine, FACTORS, \
+    compute_factor_similarities_block, combine_factor_similarities, explain_factor_similarities, select_top_k
+
+# ---------------------------------------------------------------------------------------------------
+# Class to find the movies with the most similar summaries without comparing with the whole catalog
+# ---------------------------------------------------------------------------------------------------
+
+class IVFIndex:
+
+    # - Inverted file index over the normalized summary embeddings: spherical k-means splits the movies
+    #   into num_lists clusters, and a query only compares with the movies of its num_probes closest clusters.
+    # - The movies of each cluster are stored contiguously (list_items[list_offsets[c]:list_offsets[c+1]]).
+    # - The index can be saved to and loaded from a .npz file.
+
+    def __init__(self,
+                 embeddings, # SummaryEmbeddings, or a (movies x dimensions) array
+                 num_lists:int=None, # number of clusters (sqrt of the number of movies if None)
+                 num_iters:int=10, # number of k-means iterations
+                 block_size:int=4096, # number of movies assigned at once
+                 seed:int=0):
+
+        # normalized embeddings
+        if not isinstance(embeddings, SummaryEmbeddings): embeddings = SummaryEmbeddings(embeddings)
+        self.embeddings = np.asarray(embeddings.embeddings, dtype=np.float32)
+        n = len(self.embeddings)
+
+        # number of clusters
+        if num_lists is None: num_lists = max(1, int(np.sqrt(n)))
+        num_lists = min(num_lists, max(n, 1))
+        self.block_size = block_size
+
+        # initialize the centroids with random movies
+        rng = np.random.default_rng(seed)
+        self.centroids = self.embeddings[rng.choice(n, num_lists, replace=False)] if n > 0 else np.zeros((0, self.embeddings.shape[1]), dtype=np.float32)
+
+        # spherical k-means
+        for i in range(num_iters):
+
+            # assign each movie to its closest centroid
+            assignments = self._assign(self.embeddings)
+
+            # new centroids: normalized sum of their movies
+            sums = np.zeros_like(self.centroids)
+            np.add.at(sums, assignments, self.embeddings)
+            norms = np.linalg.norm(sums, axis=1)
+
+            # empty clusters restart from random movies
+            empty = norms == 0
+            sums[empty] = self.embeddings[rng.choice(n, empty.sum())]
+            norms[empty] = 1
+            self.centroids = (sums / norms[:,None]).astype(np.float32)
+
+        # final assignments, stored as contiguous lists
+        assignments = self._assign(self.embeddings)
+        self.list_items = np.argsort(assignments, kind='stable')
+        self.list_offsets = np.concatenate([[0], np.cumsum(np.bincount(assignments, minlength=len(self.centroids)))])
+
+    def _assign(self,
+                vectors:np.ndarray)->np.ndarray:
+
+        # closest centroid of each vector, block by block
+        return np.concatenate([np.argmax(vectors[start:start + self.block_size] @ self.centroids.T, axis=1)
+                               for start in range(0, len(vectors), self.block_size)] or [np.zeros(0, dtype=np.int64)])
+
+    def save(self,
+             path:str):
+
+        # store the arrays of the index
+        np.savez(path, embeddings=self.embeddings, centroids=self.centroids, list_items=self.list_items, list_offsets=self.list_offsets)
+
+    @classmethod
+    def load(cls,
+             path:str):
+
+        # create the index without training it
+        index = cls.__new__(cls)
+        with np.load(path) as data:
+            index.embeddings, index.centroids = data['embeddings'], data['centroids']
+            index.list_items, index.list_offsets = data['list_items'], data['list_offsets']
+        index.block_size = 4096
+
+        return index
+
+    def candidates(self,
+                   idx:int, # index of the query movie
+                   num_probes:int=4)->np.ndarray: # number of clusters to visit
+
+        # closest clusters of the movie
+        closest = np.argsort(-(self.centroids @ self.embeddings[idx]), kind='stable')[:num_probes]
+
+        # movies of these clusters
+        return np.concatenate([self.list_items[self.list_offsets[c]:self.list_offsets[c+1]] for c in closest])
+
+    def query(self,
+              idx:int, # index of the query movie
+              k:int=50, # number of movies to return
+              num_probes:int=4): # number of clusters to visit
+
+        # movies of the closest clusters
+        rows = self.candidates(idx, num_probes)
+
+        # score the candidates exactly
+        similarities = self.embeddings[rows] @ self.embeddings[idx]
+
+        # select the best candidates
+        top = select_top_k(similarities, k)
+
+        return rows[top], similarities[top]
+
+# ---------------------------------------------------------------------------------------------------
+# Function to benchmark the recall@k and latency of the index against exact search
+# ---------------------------------------------------------------------------------------------------
+
+def benchmark_ann_index(index:IVFIndex,
+                        queries:list, # indices of the query movies
+                        k:int=50,
+                        num_probes:int=4): # number of clusters to visit
+
+    # initialize lists
+    # to store the latencies, recalls and number of candidates
+    exact_latencies, approx_latencies, recalls, num_candidates = list(), list(), list(), list()
+
+    # loop through query movies
+    for idx in queries:
+
+        # exact top-k: compare with every movie
+        st = time.perf_counter()
+        exact = select_top_k(index.embeddings @ index.embeddings[idx], k)
+        exact_latencies.append(time.perf_counter() - st)
+
+        # approximate top-k: compare with the candidates only
+        st = time.perf_counter()
+        approx, _ = index.query(idx, k, num_probes)
+        approx_latencies.append(time.perf_counter() - st)
+
+        # recall@k
+        recalls.append(len(set(exact.tolist()).intersection(approx.tolist())) / max(len(exact), 1))
+
+        # fraction of the catalog compared
+        num_candidates.append(len(index.candidates(idx, num_probes)) / max(len(index.embeddings), 1))
+
+    return {f'recall@{k}':float(np.mean(recalls)),
+            'exact_latency_ms':float(np.mean(exact_latencies) * 1000),
+            'approx_latency_ms':float(np.mean(approx_latencies) * 1000),
+            'candidate_fraction':float(np.mean(num_candidates))}
+
+# ---------------------------------------------------------------------------------------------------
+# Function to recommend similar movies, scoring only the summary neighbors of the input movie
+# ---------------------------------------------------------------------------------------------------
+
+def recommend_movies_with_ann(input_title:str,
+                              engine:MovieSimilarityEngine, # encoded catalog
+                              index:IVFIndex,
+                              weights:dict,
+                              k:int=50,
+                              num_candidates:int=500, # number of summary neighbors to score
+                              num_probes:int=4): # number of clusters to visit
+
+    # - Same output as recommend_movies, but the full weighted similarity is only computed for the
+    #   num_candidates movies with the most similar summaries (found with the index).
+    # - Movies that are similar on the other factors but not on the summary can be missed.
+
+    # get the index of the input movie
+    idx = engine.title_index[input_title]
+
+    # position of each movie in the candidate order of recommend_movies (-1: not a candidate)
+    positions = np.full(engine.num_movies, -1)
+    positions[engine.candidates] = np.arange(len(engine.candidates))
+
+    # summary neighbors of the input movie, in the candidate order
+    rows, _ = index.query(idx, num_candidates, num_probes)
+    rows = rows[positions[rows] >= 0]
+    rows = rows[np.argsort(positions[rows], kind='stable')]
+
+    # factor similarities of the neighbors only
+    scores = {factor:score[0] for factor, score in compute_factor_similarities_block(np.array([idx]), engine.features,
+                                                                                     engine.summaries_sim_matrix, rows).items()}
+
+    # total similarity of each neighbor
+    similarities = combine_factor_similarities(scores, weights)
+
+    # select the top k neighbors
+    top = select_top_k(similarities, k)
+
+    return [(engine.titles[rows[t]], (round(float(similarities[t]), 2), explain_factor_similarities({factor:scores[factor][t] for factor in FACTORS}, weights)))
+            for t in top]
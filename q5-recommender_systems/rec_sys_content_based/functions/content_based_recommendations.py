@@ -3,34 +3,76 @@
 
 import pandas as pd
 import numpy as np
+import scipy.sparse as sp
 import csv
 from dataclasses import dataclass
 from sentence_transformers import SentenceTransformer, util
 from torch import Tensor
-from random import random, sample
-from collections import defaultdict
+from random import random, sample, Random
+from collections import defaultdict, OrderedDict
 import time
+import sys
 from math import log2
+from functions.embedding_cache import SummaryEmbeddingCache
 
 # ---------------------------------------------------------------------------------------------------
-# Function to load and prepare the data for the next steps
+# Class to hold the attributes of a movie
 # ---------------------------------------------------------------------------------------------------
 
-def load_and_prepare_data(input_file_path:str):
+# set-valued attributes, compared with jaccard
+SET_ATTRIBUTES = ['genre', 'tags', 'director', 'actors']
+
+# nominal attributes, compared with s(a,b) == 1 if a == b, 0 otherwise
+NOMINAL_ATTRIBUTES = ['prod_house', 'star_actor']
+
+@dataclass(eq=False)
+class Movie:
+
+    # - The set-valued attributes are stored as frozensets of integer codes in the vocabularies of load_and_prepare_data
+    #   (instead of Python sets of strings): the pairwise jaccard stays a set operation, and the codes are the columns
+    #   of the sparse matrices of encode_movie_features. __slots__ drops the per-instance __dict__.
+    # - Sorted int32 arrays would be smaller, but the jaccard of a pair is about 7x slower with np.intersect1d than with
+    #   sets. On the 6945 movies of the dataset, the four set-valued attributes take 13.9 MB as sets of strings, 8.4 MB
+    #   as frozensets of codes and 4.3 MB as int32 arrays (tracemalloc, plus 20k vocabulary strings for the codes).
+    # - decode_movie gets the values back as strings, e.g. to print a movie.
+    # - eq=False keeps the identity comparison of movies (e.g., when looking for a movie in a list).
+
+    __slots__ = ('title', 'genre', 'tags', 'runtime', 'director', 'actors', 'rating', 'ryear', 'prod_house', 'summary', 'star_actor')
+
+    title:str
+    genre:frozenset
+    tags:frozenset
+    runtime:int
+    director:frozenset
+    actors:frozenset
+    rating:float
+    ryear:int
+    prod_house:str
+    summary:str
+    star_actor:str
+
+# ---------------------------------------------------------------------------------------------------
+# Function to load and prepare the data for the next steps
+# ---------------------------------------------------------------------------------------------------
 
-    @dataclass
-    class movie:
-        title:str
-        genre:str
-        tags:str
-        runtime:int
-        director:str
-        actors:str
-        rating:float
-        ryear:int
-        prod_house:str
-        summary:str
-        star_actor:str
+def load_and_prepare_data(input_file_path:str,
+                          cache_dir:str=None, # directory of the summary embeddings cache (no cache if None)
+                          model_name:str='all-MiniLM-L6-v2', # Sentence-BERT model
+                          cache_dtype:str='float32', # storage type of the cached embeddings ('float32' or 'float16')
+                          batch_size:int=32, # number of summaries encoded at once
+                          similarity_mode:str='dense', # 'dense' (n x n matrix), 'embeddings' (on demand) or 'top_n' (neighbor lists)
+                          top_n:int=100, # number of neighbors kept per movie ('top_n' mode)
+                          similarity_dtype:str='float32', # storage type of the embeddings or neighbor similarities ('embeddings' and 'top_n' modes)
+                          vocabularies:dict=None): # attribute as key, {value:code} as value (filled in place, e.g. to decode the codes)
+
+    # create the vocabularies of the set-valued attributes
+    if vocabularies is None: vocabularies = dict()
+    for attribute in SET_ATTRIBUTES: vocabularies.setdefault(attribute, dict())
+
+    # function to intern the comma-separated values of an attribute as a set of codes
+    def intern_values(attribute:str, values:str)->frozenset:
+        vocabulary = vocabularies[attribute]
+        return frozenset([vocabulary.setdefault(x.strip(), len(vocabulary)) for x in values.split(',')])
 
     # create an empty dictionary
     # to hold the index of each movie title
@@ -54,18 +96,18 @@ def load_and_prepare_data(input_file_path:str):
 
             # create a new movie object
             # from the data in the row in loop
-            new_movie = movie(
+            new_movie = Movie(
                 row['title'],
-                set([x.strip() for x in row['genre'].split(',')]),
-                set([x.strip() for x in row['tags'].split(',')]),
+                intern_values('genre', row['genre']),
+                intern_values('tags', row['tags']),
                 int(row['runtime']),
-                set([x.strip() for x in row['director'].split(',')]),
-                set([x.strip() for x in row['actors'].split(',')]),
+                intern_values('director', row['director']),
+                intern_values('actors', row['actors']),
                 float(row['rating']),
                 int(row['ryear']),
-                row['prod_house'],
+                sys.intern(row['prod_house']),
                 row['summary'],
-                row['star_actor']
+                sys.intern(row['star_actor'])
             )
 
             # append the summary of the movie to the summaries list
@@ -77,18 +119,186 @@ def load_and_prepare_data(input_file_path:str):
             # apend the new movie object to the movies list
             movies.append(new_movie)
 
-    # load the pretrained model
-    sbert = SentenceTransformer('all-MiniLM-L6-v2')
-
     # encode the summaries using Sentence-BERT
-    embedded = sbert.encode(summaries, convert_to_tensor=True)
+    if cache_dir is None:
+
+        # load the pretrained model
+        sbert = SentenceTransformer(model_name)
+
+        embedded = sbert.encode(summaries, batch_size=batch_size, convert_to_tensor=True)
+
+    else:
+
+        # only the summaries missing from the cache are encoded (and the model is only loaded if needed)
+        cache = SummaryEmbeddingCache(cache_dir, model_name, cache_dtype)
+        embedded = cache.encode(summaries, lambda texts:SentenceTransformer(model_name).encode(texts, batch_size=batch_size))
 
     # compute the cosine similarity matrix between the summaries
-    sum_sim_matrix = util.cos_sim(embedded, embedded)
+    if similarity_mode == 'dense': sum_sim_matrix = util.cos_sim(embedded, embedded)
+
+    # or keep only the normalized embeddings
+    elif similarity_mode == 'embeddings': sum_sim_matrix = SummaryEmbeddings(embedded, similarity_dtype)
+
+    # or keep only the top_n neighbors of each movie
+    elif similarity_mode == 'top_n': sum_sim_matrix = TopNSummarySimilarities(SummaryEmbeddings(embedded), top_n, similarity_dtype)
+
+    else: raise ValueError(f'Unknown similarity mode: {similarity_mode}')
 
     # return the list of movies, the title index and the summaries similarity matrix
     return movies, title_index, sum_sim_matrix
 
+# ---------------------------------------------------------------------------------------------------
+# Function to decode the attributes of a movie into readable values
+# ---------------------------------------------------------------------------------------------------
+
+def decode_movie(movie:Movie,
+                 vocabularies:dict)->dict: # vocabularies filled by load_and_prepare_data (or the lists of catalog.json)
+
+    # attribute as key, value as value
+    decoded = {attribute:getattr(movie, attribute) for attribute in Movie.__slots__}
+
+    # values of the codes of each set-valued attribute (sorted)
+    for attribute in SET_ATTRIBUTES:
+        values = list(vocabularies[attribute])
+        decoded[attribute] = sorted(values[code] for code in getattr(movie, attribute))
+
+    return decoded
+
+# ---------------------------------------------------------------------------------------------------
+# Classes to compute the summary similarities without the dense n x n matrix
+# ---------------------------------------------------------------------------------------------------
+
+class SummaryEmbeddings:
+
+    # - Keeps the L2-normalized summary embeddings (n x d) instead of the n x n cosine similarity matrix,
+    #   and computes the similarities of a movie on demand with one matrix-vector product.
+    # - At 100k movies and 384 dimensions, this is 150 MB in float32 (77 MB in float16) instead of 40 GB.
+
+    def __init__(self,
+                 embedded, # summary embeddings (torch tensor or numpy array)
+                 dtype:str='float32'): # storage type ('float32' or 'float16')
+
+        # normalize the embeddings once, in the storage type
+        # (float32 storage is then used as it is by every query)
+        self.embeddings = SummaryEmbeddings.normalize(embedded, dtype)
+
+    @staticmethod
+    def normalize(embedded, # summary embeddings (torch tensor or numpy array)
+                  dtype:str='float32')->np.ndarray: # storage type ('float32' or 'float16')
+
+        # convert the embeddings to a float32 numpy array (e.g., read from a cache or a memory map)
+        embedded = np.asarray(embedded.cpu().numpy() if isinstance(embedded, Tensor) else embedded, dtype=np.float32)
+
+        # normalize the embeddings (as util.cos_sim does)
+        norms = np.maximum(np.linalg.norm(embedded, axis=1, keepdims=True), 1e-12)
+        return (embedded / norms).astype(dtype, copy=False)
+
+    @classmethod
+    def from_normalized(cls,
+                        embeddings:np.ndarray): # embeddings returned by normalize (e.g., a memory map or a shared array)
+
+        # use the array as it is, without copying it
+        summaries = cls.__new__(cls)
+        summaries.embeddings = embeddings
+        return summaries
+
+    def __len__(self):
+
+        return len(self.embeddings)
+
+    def column(self,
+               idx, # index of the movie, or array of indices
+               columns:np.ndarray=None)->np.ndarray: # candidate movies (all movies if None)
+
+        # embeddings of the candidate movies
+        candidates = self.embeddings if columns is None else self.embeddings[columns]
+
+        # cosine similarities of the candidate movies with the movie(s)
+        # (computed in float32: only float16 storage is converted)
+        return (candidates.astype(np.float32, copy=False) @ self.embeddings[idx].astype(np.float32, copy=False).T).astype(np.float64)
+
+    def pair(self,
+             i:int,
+             j:int)->np.float32:
+
+        # cosine similarity of two movies
+        return np.float32(self.embeddings[i].astype(np.float32, copy=False) @ self.embeddings[j].astype(np.float32, copy=False))
+
+class TopNSummarySimilarities:
+
+    # - Keeps the top_n summary similarities of each movie in CSR form with rows of fixed length (row i: the neighbors
+    #   of movie i, sorted by index), computed offline block by block from the normalized embeddings.
+    # - The rows are plain (n x top_n) numpy arrays instead of a scipy CSR matrix, since scipy.sparse has no float16 type:
+    #   n x top_n x (4 + 2) bytes in float16 (int32 indices), e.g. 60 MB for 100k movies and 100 neighbors.
+    # - The similarity with a movie outside the neighbors of the input movie is taken as 0.
+
+    def __init__(self,
+                 embeddings:SummaryEmbeddings,
+                 top_n:int=100, # number of neighbors kept per movie
+                 dtype:str='float32', # storage type of the similarities ('float32' or 'float16')
+                 block_size:int=1024): # number of movies compared with the catalog at once
+
+        # number of movies and neighbors
+        n = len(embeddings)
+        top_n = min(top_n, n)
+
+        # neighbors of each movie and their similarities
+        self.indices = np.zeros((n, top_n), dtype=np.int32)
+        self.data = np.zeros((n, top_n), dtype=dtype)
+
+        # loop through blocks of movies
+        for start in range(0, n, block_size):
+
+            # similarities of the block with all movies
+            rows = np.arange(start, min(start + block_size, n))
+            block = embeddings.column(rows).T
+
+            # keep the top_n of each movie, sorted by index
+            top = np.sort(np.argpartition(-block, top_n - 1, axis=1)[:, :top_n], axis=1) if top_n > 0 else np.zeros((len(rows), 0), dtype=np.int64)
+            self.indices[rows] = top
+            self.data[rows] = np.take_along_axis(block, top, axis=1)
+
+    def __len__(self):
+
+        return len(self.indices)
+
+    def column(self,
+               idx, # index of the movie, or array of indices
+               columns:np.ndarray=None)->np.ndarray: # candidate movies (all movies if None)
+
+        # neighbors of the movie(s) (zero for the others), as columns
+        rows = np.atleast_1d(idx)
+        similarities = np.zeros((len(rows), len(self)))
+        np.put_along_axis(similarities, self.indices[rows].astype(np.int64), self.data[rows].astype(np.float64), axis=1)
+        similarities = (similarities if columns is None else similarities[:, columns]).T
+
+        return similarities[:,0] if np.ndim(idx) == 0 else similarities
+
+    def pair(self,
+             i:int, # candidate movie
+             j:int)->np.float32: # input movie
+
+        # position of movie i among the (sorted) neighbors of movie j
+        neighbors = self.indices[j]
+        position = np.searchsorted(neighbors, i)
+
+        # similarity of movie i among the neighbors of movie j (0 if it is not one of them)
+        return np.float32(self.data[j, position]) if position < len(neighbors) and neighbors[position] == i else np.float32(0)
+
+# ---------------------------------------------------------------------------------------------------
+# Function to get the summary similarity of two movies
+# ---------------------------------------------------------------------------------------------------
+
+def get_summary_similarity(summaries_sim_matrix,
+                           i:int, # candidate movie
+                           j:int)->np.float32: # input movie
+
+    # summary similarities without the dense matrix
+    if isinstance(summaries_sim_matrix, (SummaryEmbeddings, TopNSummarySimilarities)): return summaries_sim_matrix.pair(i, j)
+
+    # cell of the cosine similarity matrix
+    return summaries_sim_matrix[i,j].numpy()
+
 # ---------------------------------------------------------------------------------------------------
 # Function to compute the similarity between two movies
 # ---------------------------------------------------------------------------------------------------
@@ -146,7 +356,7 @@ def compute_similarity(title1:str,
     scores['prod_house'] = 1 if m1.prod_house == m2.prod_house else 0
     
     # compute summary similarity using cosine similarity
-    scores['summary']=summaries_sim_matrix[idx_m1,idx_m2].numpy()
+    scores['summary']=get_summary_similarity(summaries_sim_matrix,idx_m1,idx_m2)
     
     # compute similarity of nominal attribute as
     # s(a,b) == 1 if a == b, 0 otherwise 
@@ -165,6 +375,402 @@ def compute_similarity(title1:str,
     # return the total similarity and the score of each factor
     return total_similarity, sorted_factors
 
+# ---------------------------------------------------------------------------------------------------
+# Function to encode the movie catalog into arrays, once, for the vectorized similarities
+# ---------------------------------------------------------------------------------------------------
+
+def encode_movie_features(movies:list)->dict:
+
+    # create an empty dictionary
+    # to hold the encoded attributes
+    features = dict()
+
+    # encode each set-valued attribute as a sparse binary (movies x values) matrix
+    for attribute in SET_ATTRIBUTES:
+
+        # columns of the values of each movie: their (interned) codes, sorted
+        columns = [sorted(getattr(m, attribute)) for m in movies]
+
+        # number of values of each movie
+        sizes = np.array([len(c) for c in columns], dtype=np.int64)
+
+        # create the CSR matrix
+        indptr = np.concatenate([[0], np.cumsum(sizes)])
+        indices = np.fromiter((code for c in columns for code in c), dtype=np.int32, count=int(sizes.sum()))
+        features[attribute] = sp.csr_matrix((np.ones(len(indices), dtype=np.float64), indices, indptr),
+                                            shape=(len(movies), int(indices.max()) + 1 if len(indices) > 0 else 0))
+
+        # store the set sizes, needed for the unions
+        features[attribute + '_size'] = sizes.astype(np.float64)
+
+    # encode the numeric attributes as arrays
+    features['runtime'] = np.array([m.runtime for m in movies], dtype=np.float64)
+    features['rating'] = np.array([m.rating for m in movies], dtype=np.float64)
+    features['ryear'] = np.array([m.ryear for m in movies], dtype=np.float64)
+
+    # encode the nominal attributes as integer codes
+    for attribute in NOMINAL_ATTRIBUTES:
+        features[attribute] = pd.factorize(pd.Series([getattr(m, attribute) for m in movies], dtype=object))[0]
+
+    # catalog statistics
+    features['runtime_range'] = features['runtime'].max() - features['runtime'].min() if len(movies) > 0 else 0.0
+
+    return features
+
+# ---------------------------------------------------------------------------------------------------
+# Function to get the encoded catalog of a movie list, encoded once per list
+# ---------------------------------------------------------------------------------------------------
+
+# id of the movie list as key, (movies, number of movies, encoded catalog) as value (most recently used last)
+ENCODED_CATALOGS = OrderedDict()
+
+# number of encoded catalogs kept
+MAX_ENCODED_CATALOGS = 2
+
+def get_movie_features(movies:list)->dict:
+
+    # - The entry keeps the list alive, so its id cannot be reused by another list. A list that has grown or shrunk
+    #   is encoded again, but movies edited in place are not detected (use a MovieSimilarityEngine to control this).
+
+    # cached encoded catalog of the list
+    entry = ENCODED_CATALOGS.get(id(movies))
+
+    # encode the list (first use, or changed length)
+    if entry is None or entry[0] is not movies or entry[1] != len(movies):
+        entry = (movies, len(movies), encode_movie_features(movies))
+        ENCODED_CATALOGS[id(movies)] = entry
+
+        # drop the least recently used catalogs
+        while len(ENCODED_CATALOGS) > MAX_ENCODED_CATALOGS: ENCODED_CATALOGS.popitem(last=False)
+
+    # mark it as the most recently used
+    ENCODED_CATALOGS.move_to_end(id(movies))
+
+    return entry[2]
+
+# ---------------------------------------------------------------------------------------------------
+# Function to get the summary similarities of one (or more) movies with all movies
+# ---------------------------------------------------------------------------------------------------
+
+def get_summary_similarities(summaries_sim_matrix:Tensor,
+                             idx, # index of the movie, or array of indices
+                             columns:np.ndarray=None)->np.ndarray: # candidate movies (all movies if None)
+
+    # summary similarities without the dense matrix
+    if isinstance(summaries_sim_matrix, (SummaryEmbeddings, TopNSummarySimilarities)): return summaries_sim_matrix.column(idx, columns)
+
+    # column(s) of the movie(s) in the cosine similarity matrix
+    similarities = np.asarray(summaries_sim_matrix[:, idx], dtype=np.float64)
+
+    return similarities if columns is None else similarities[columns]
+
+# ---------------------------------------------------------------------------------------------------
+# Function to compute the similarity of every factor between some movies and all movies
+# ---------------------------------------------------------------------------------------------------
+
+def compute_factor_similarities_block(rows:np.ndarray, # indices of the input movies
+                                      features:dict, # output of encode_movie_features
+                                      summaries_sim_matrix:Tensor,
+                                      columns:np.ndarray=None # indices of the candidate movies (all movies if None)
+                                      )->dict:
+
+    # - Entry (i,j) of each (rows x columns) array is the score that
+    #   compute_similarity(movies[columns[j]].title, movies[rows[i]].title, ...) gives to that factor (before weighting).
+
+    # all movies are candidates
+    if columns is None: columns = np.arange(len(features['runtime']))
+
+    # features of the candidate movies
+    candidate = lambda name:features[name][columns]
+
+    # create an empty dictionary
+    # to hold the similarity scores of each factor
+    scores = dict()
+
+    # compute the jaccard similarity of each set-valued attribute
+    for attribute in SET_ATTRIBUTES:
+
+        # size of the intersections: one sparse matrix product
+        intersection = (features[attribute][rows] @ candidate(attribute).T).toarray()
+
+        # size of the unions
+        union = candidate(attribute + '_size')[None,:] + features[attribute + '_size'][rows][:,None] - intersection
+
+        scores[attribute] = intersection / union
+
+    # runtime difference, normalized by the range of the catalog
+    scores['runtime'] = np.abs(candidate('runtime')[None,:] - features['runtime'][rows][:,None]) / features['runtime_range']
+
+    # normalized candidate rating (the same for every input movie)
+    scores['rating'] = np.broadcast_to(candidate('rating') / 10, (len(rows), len(columns)))
+
+    # release year difference
+    scores['ryear'] = np.abs(candidate('ryear')[None,:] - features['ryear'][rows][:,None]) / 100
+
+    # nominal attributes
+    for attribute in NOMINAL_ATTRIBUTES:
+        scores[attribute] = (candidate(attribute)[None,:] == features[attribute][rows][:,None]).astype(np.float64)
+
+    # summary cosine similarity
+    scores['summary'] = get_summary_similarities(summaries_sim_matrix, rows, columns).T
+
+    return scores
+
+# ---------------------------------------------------------------------------------------------------
+# Function to compute the similarity of every factor between one movie and all movies
+# ---------------------------------------------------------------------------------------------------
+
+def compute_factor_similarities(idx:int, # index of the input movie
+                                features:dict, # output of encode_movie_features
+                                summaries_sim_matrix:Tensor
+                                )->dict:
+
+    # - Entry j of each array is the score that compute_similarity(movies[j].title, input title, ...)
+    #   gives to that factor (before weighting).
+
+    # one-row block
+    scores = compute_factor_similarities_block(np.array([idx]), features, summaries_sim_matrix)
+
+    return {factor:score[0] for factor, score in scores.items()}
+
+# ---------------------------------------------------------------------------------------------------
+# Functions to weight the factor similarities
+# ---------------------------------------------------------------------------------------------------
+
+# factors in the order in which compute_similarity lists them
+FACTORS = ['genre', 'tags', 'runtime', 'director', 'actors', 'rating', 'ryear', 'prod_house', 'summary', 'star_actor']
+
+def combine_factor_similarities(scores:dict, # factor as key, array of (unweighted) scores as value
+                                weights:dict
+                                )->np.ndarray:
+
+    # total similarity: plain float64 weighted sum of the factors
+    # (compute_similarity rounds each weighted factor to 2 decimals first, so near-ties may be ordered differently)
+    return sum(np.asarray(scores[factor], dtype=np.float64) * weights[factor] for factor in FACTORS)
+
+def explain_factor_similarities(scores:dict, # factor as key, (unweighted) score of one movie pair as value
+                                weights:dict
+                                )->list:
+
+    # weighted score of each factor, with 2 decimals (as compute_similarity)
+    factors = [(factor, round(float(scores[factor]) * weights[factor], 2)) for factor in FACTORS]
+
+    # keep the positive factors, sorted by their rounded score in descending order (ties in the order of FACTORS),
+    # so that float32 and float64 scores of the same pair give the same breakdown
+    return [(factor, score) for factor, score in sorted(factors, key=lambda x:x[1], reverse=True) if score > 0]
+
+# ---------------------------------------------------------------------------------------------------
+# Class to compute the catalog similarities once and reuse them for any weights
+# ---------------------------------------------------------------------------------------------------
+
+class MovieSimilarityEngine:
+
+    # - Row i of every matrix holds the similarities of all movies (as candidates) with movie i (as input),
+    #   so row i of the weighted totals is what compute_similarity(movie j, movie i, ...) returns for every j.
+    # - Dense catalogs: a matrix per factor is computed once, and the totals of any weights are the weighted sum
+    #   of these matrices. The matrices are stored in a compact form that keeps them exact (uint16 intersection sizes,
+    #   float32 absolute differences, bool equality flags and the float32 summary similarities): 22 bytes per movie pair,
+    #   plus 4 bytes per pair for each of the max_cached_weights float32 totals.
+    # - A catalog is dense when these n x n arrays fit in dense_memory_budget bytes: with the defaults (2 GiB, 4 cached
+    #   weights: 38 bytes per pair), catalogs of up to about 7,500 movies (e.g., the 6,945 movies of the dataset).
+    #   The matrices are filled block_size rows at a time, so the temporary float64 arrays stay small.
+    # - Larger catalogs keep nothing n x n: the factor similarities of the rows that are asked for are computed on demand
+    #   (one row costs O(n)), and the totals are always exact.
+    # - The float32 totals round the weighted sums of combine_factor_similarities (float64) to about 7 significant digits.
+    # - The factor breakdowns are only computed for the movies that are asked for (explain).
+
+    def __init__(self,
+                 movies:list,
+                 title_index:dict,
+                 summaries_sim_matrix:Tensor,
+                 dense_memory_budget:int=2**31, # bytes of the dense factor matrices and cached totals (computed on demand if larger)
+                 block_size:int=256, # number of rows computed at once
+                 max_cached_weights:int=4, # number of weighted total matrices kept in memory
+                 features:dict=None, # encoded catalog, e.g. from load_streamed_catalog (encoded from movies if None)
+                 titles:list=None, # movie titles, needed when movies is None
+                 factor_matrices:dict=None): # factor matrices of another engine over the same catalog (dense catalogs only)
+
+        # encode the catalog once (including the runtime range)
+        self.features = features if features is not None else get_movie_features(movies)
+        self.summaries_sim_matrix = summaries_sim_matrix
+        self.title_index = title_index
+        self.titles = titles if titles is not None else [m.title for m in movies]
+        self.num_movies = len(self.titles)
+
+        # one movie per distinct title (the movies that recommend_movies can return)
+        self.candidates = get_candidate_indices(self.titles, title_index)
+
+        # movie that compute_similarity uses for each position (the title_index of its title)
+        self.title_rows = np.array([title_index[title] for title in self.titles], dtype=np.int64)
+
+        # bytes per movie pair of the dense catalogs: the compact factor matrices, then the cached float32 totals
+        bytes_per_pair = 2 * len(SET_ATTRIBUTES) + 4 * 2 + len(NOMINAL_ATTRIBUTES) + 4 + 4 * max_cached_weights
+
+        # store the parameters
+        self.is_dense = self.num_movies**2 * bytes_per_pair <= dense_memory_budget
+        self.block_size = block_size
+        self.max_cached_weights = max_cached_weights
+
+        # factor matrices (dense catalogs only) and weighted totals, computed when first needed
+        self._factor_matrices = factor_matrices if factor_matrices is not None and self.is_dense else dict()
+        self._weighted = OrderedDict()
+
+    def _blocks(self):
+
+        # consecutive blocks of rows
+        for start in range(0, self.num_movies, self.block_size):
+            yield np.arange(start, min(start + self.block_size, self.num_movies))
+
+    def factor_matrices(self)->dict:
+
+        # only dense catalogs keep the factor matrices
+        if not self.is_dense: raise ValueError(f'{self.num_movies} movies is too many for dense factor matrices')
+
+        # already computed
+        if self._factor_matrices: return self._factor_matrices
+
+        # number of movies and features
+        n, features = self.num_movies, self.features
+
+        # create the compact matrix of each factor
+        matrices = {attribute:np.empty((n, n), dtype=np.uint16) for attribute in SET_ATTRIBUTES}
+        matrices.update({attribute:np.empty((n, n), dtype=np.float32) for attribute in ['runtime', 'ryear', 'summary']})
+        matrices.update({attribute:np.empty((n, n), dtype=bool) for attribute in NOMINAL_ATTRIBUTES})
+
+        # fill them block by block
+        for rows in self._blocks():
+
+            # size of the intersections of each set-valued attribute
+            for attribute in SET_ATTRIBUTES:
+                matrices[attribute][rows] = (features[attribute][rows] @ features[attribute].T).toarray()
+
+            # absolute differences of the numeric attributes (integers, exact in float32)
+            for attribute in ['runtime', 'ryear']:
+                matrices[attribute][rows] = np.abs(features[attribute][None,:] - features[attribute][rows][:,None])
+
+            # equality of the nominal attributes
+            for attribute in NOMINAL_ATTRIBUTES:
+                matrices[attribute][rows] = features[attribute][None,:] == features[attribute][rows][:,None]
+
+            # summary cosine similarities, as stored in the input matrix (transposed, so that row i is column i)
+            matrices['summary'][rows] = get_summary_similarities(self.summaries_sim_matrix, rows).T
+
+        self._factor_matrices = matrices
+
+        return matrices
+
+    def factor_rows(self,
+                    rows:np.ndarray)->dict: # indices of the input movies
+
+        # larger catalogs: compute the factor similarities of the rows
+        if not self.is_dense: return compute_factor_similarities_block(rows, self.features, self.summaries_sim_matrix)
+
+        # get the compact matrices and the features
+        matrices, features = self.factor_matrices(), self.features
+
+        # create an empty dictionary
+        # to hold the similarity scores of each factor
+        scores = dict()
+
+        # jaccard similarity from the intersection sizes
+        for attribute in SET_ATTRIBUTES:
+            intersection = matrices[attribute][rows].astype(np.float64)
+            scores[attribute] = intersection / (features[attribute + '_size'][None,:] + features[attribute + '_size'][rows][:,None] - intersection)
+
+        # normalized differences
+        scores['runtime'] = matrices['runtime'][rows].astype(np.float64) / features['runtime_range']
+        scores['ryear'] = matrices['ryear'][rows].astype(np.float64) / 100
+
+        # normalized candidate rating (the same for every input movie)
+        scores['rating'] = np.broadcast_to(features['rating'] / 10, (len(rows), self.num_movies))
+
+        # nominal attributes
+        for attribute in NOMINAL_ATTRIBUTES:
+            scores[attribute] = matrices[attribute][rows].astype(np.float64)
+
+        # summary cosine similarity
+        scores['summary'] = matrices['summary'][rows].astype(np.float64)
+
+        return scores
+
+    def weighted_matrix(self,
+                        weights:dict):
+
+        # only dense catalogs keep the weighted totals
+        if not self.is_dense: raise ValueError(f'{self.num_movies} movies is too many for dense weighted totals')
+
+        # key of the weights
+        key = tuple(weights[factor] for factor in FACTORS)
+
+        # cached totals (most recently used moved to the end)
+        if key in self._weighted:
+            self._weighted.move_to_end(key)
+            return self._weighted[key]
+
+        # weighted sum of the factor matrices (dense catalogs only), block by block
+        totals = np.empty((self.num_movies, self.num_movies), dtype=np.float32)
+        for rows in self._blocks():
+            totals[rows] = combine_factor_similarities(self.factor_rows(rows), weights)
+
+        # cache the totals, dropping the least recently used
+        self._weighted[key] = totals
+        if len(self._weighted) > self.max_cached_weights: self._weighted.popitem(last=False)
+
+        return totals
+
+    def similarities(self,
+                     idx:int, # index of the input movie
+                     weights:dict)->np.ndarray:
+
+        # dense catalogs: row of the weighted totals
+        if self.is_dense: return self.weighted_matrix(weights)[idx].astype(np.float64)
+
+        # larger catalogs: exact totals of the row
+        return combine_factor_similarities(compute_factor_similarities(idx, self.features, self.summaries_sim_matrix), weights)
+
+    def explain(self,
+                idx:int, # index of the input movie
+                candidates, # indices of the candidate movies
+                weights:dict)->list:
+
+        # factor similarities of the input movie
+        scores = {factor:score[0] for factor, score in self.factor_rows(np.array([idx])).items()}
+
+        # factor breakdown of each candidate
+        return [explain_factor_similarities({factor:scores[factor][j] for factor in FACTORS}, weights) for j in candidates]
+
+# ---------------------------------------------------------------------------------------------------
+# Function to get the movie of each distinct title, in the order in which recommend_movies ranks ties
+# ---------------------------------------------------------------------------------------------------
+
+def get_candidate_indices(titles:list, # title of each movie
+                          title_index:dict)->np.ndarray:
+
+    # a title that appears more than once keeps its first position but is scored as the movie of title_index
+    return np.array([title_index[title] for title in dict.fromkeys(titles)], dtype=np.int64)
+
+# ---------------------------------------------------------------------------------------------------
+# Function to select the positions of the k highest scores (ties broken by position)
+# ---------------------------------------------------------------------------------------------------
+
+def select_top_k(scores:np.ndarray,
+                 k:int)->np.ndarray:
+
+    # nothing to select
+    k = min(k, len(scores))
+    if k <= 0: return np.zeros(0, dtype=np.int64)
+
+    # k-th highest score, found in linear time
+    threshold = -np.partition(-scores, k-1)[k-1]
+
+    # every score above the threshold, plus the first ties at the threshold
+    above = np.flatnonzero(scores > threshold)
+    at = np.flatnonzero(scores == threshold)[:k - len(above)]
+    top = np.concatenate([above, at])
+
+    # sort by score (descending), then by position
+    return top[np.lexsort((top, -scores[top]))]
+
 # ---------------------------------------------------------------------------------------------------
 # Function to recommend similar movies given an input movie title
 # ---------------------------------------------------------------------------------------------------
@@ -174,28 +780,121 @@ def recommend_movies(input_title:str,
                      title_index:dict,
                      summaries_sim_matrix:Tensor,
                      weights:dict,
-                     k:int=50
+                     k:int=50,
+                     engine:MovieSimilarityEngine=None # reuse the encoded catalog and cached similarities
                      )->list:
-    
-    # create an empty dict to hold the recommendation results
-    recommendation_results = dict()
 
-    # loop through each movie in the movies dictionary
-    for candidate_movie in movies:
+    # - Scores all movies against the input title at once, and only builds the factor breakdowns of the top k.
+    # - Returns the list of comparing every movie with compute_similarity and sorting the results, except that the movies
+    #   are ranked by the unrounded weighted sum (compute_similarity rounds each factor first, so near-ties may differ).
+    # - Without an engine, the catalog is encoded on the first call for the movie list and reused afterwards (get_movie_features).
 
-        # compute the similarity between the candidate movie and the input title
-        similarity, factor_scores = compute_similarity(candidate_movie.title,
-                                                       input_title,
-                                                       movies,
-                                                       title_index,
-                                                       summaries_sim_matrix,
-                                                       weights)
-        
-        # add the similarity score and the factor scores to the recommendation results
-        recommendation_results[candidate_movie.title] = (similarity, factor_scores)
+    # get the index of the input movie
+    idx = title_index[input_title]
+
+    # title of each movie (movies can be None with an engine)
+    titles = engine.titles if engine is not None else [m.title for m in movies]
+
+    # one movie per distinct title, in catalog order
+    candidates = engine.candidates if engine is not None else get_candidate_indices(titles, title_index)
+
+    # total similarity of every movie with the input movie
+    if engine is not None:
+        similarities = engine.similarities(idx, weights)
+    else:
+        scores = compute_factor_similarities(idx, get_movie_features(movies), summaries_sim_matrix)
+        similarities = combine_factor_similarities(scores, weights)
+
+    # select the top k candidates
+    top = candidates[select_top_k(similarities[candidates], k)]
+
+    # factor breakdowns of the top k only
+    if engine is not None:
+        sorted_factors = engine.explain(idx, top, weights)
+    else:
+        sorted_factors = [explain_factor_similarities({factor:scores[factor][j] for factor in FACTORS}, weights) for j in top]
+
+    # totals with 2 decimals, as compute_similarity returns them
+    return [(titles[j], (round(float(similarities[j]), 2), factors)) for j, factors in zip(top, sorted_factors)]
+
+# ---------------------------------------------------------------------------------------------------
+# Class to hold a fake user
+# ---------------------------------------------------------------------------------------------------
 
-    # sort the results by similarity score and return the top k items
-    return sorted(recommendation_results.items(), key=lambda x:x[1][0], reverse=True)[:k]
+@dataclass
+class User:
+    seed_movies:list # latent movies that the user likes
+    likes:list # known movies that the user has liked
+    dislikes:list # known movies that the user has disliked
+    weights:dict # user preferences
+    like_threshold:float # similarity threshold for liking a movie
+
+# ---------------------------------------------------------------------------------------------------
+# Function to create one fake user
+# ---------------------------------------------------------------------------------------------------
+
+def create_fake_user(movies:list,
+                     title_index:dict,
+                     summaries_sim_matrix:Tensor,
+                     factors:list,
+                     num_seed_movies:int=5, # number of random seed movies to choose
+                     std_multiplier:float=1.5, # std multiplier to define upper and lower bound
+                     rng:Random=None, # random generator of the user (the random module if None)
+                     engine:MovieSimilarityEngine=None # encoded catalog and cached factor matrices (only the seed rows are computed if None)
+                     )->User:
+
+    # random functions of the user
+    rand, samp = (rng.random, rng.sample) if rng is not None else (random, sample)
+
+    # create an empty dictionary
+    # to hold user preferences for each factor
+    weights = dict()
+
+    # for each factor to consider
+    for factor in factors:
+
+        # sample a random preference value (weight) between 0 and 1
+        weights[factor] = round(rand(),2)
+
+    # sample a set number of random movies
+    # to use as seed movies for this user
+    seed_movies = samp(movies, num_seed_movies)
+
+    """
+    - Compute the "like" threshold for this user.
+    - If a movie has an above-threshold similarity with (at least) one of the seed movies,
+        then we assume that the user will like it.
+    - The threshold is defined to be equal to the average similarity of all movies with the seed movies,
+        plus <std_multiplier> standard deviation.
+    """
+
+    # rows of the seed movies (each movie is scored as the movie of its title, as in compute_similarity)
+    rows = np.array([title_index[seed_movie.title] for seed_movie in seed_movies], dtype=np.int64)
+
+    # similarity of every movie with each seed movie: one (seed movies x movies) array
+    if engine is not None:
+        sim_scores = combine_factor_similarities(engine.factor_rows(rows), weights)[:, engine.title_rows]
+
+    # no engine: only the rows of the seed movies are computed (no n x n factor matrices)
+    else:
+        columns = np.array([title_index[movie.title] for movie in movies], dtype=np.int64)
+        sim_scores = combine_factor_similarities(compute_factor_similarities_block(rows, get_movie_features(movies),
+                                                                                   summaries_sim_matrix, columns), weights)
+
+    # compute the "like" threshold for this user (mean + <std_multiplier> standard deviation)
+    like_threshold = np.mean(sim_scores) + std_multiplier*np.std(sim_scores)
+
+    # create a new user object with the selected:
+    # - seed movies
+    # - empty liked movies list
+    # - empty disliked movies list
+    # - weight factor user preferences
+    # - calculated "like" threshold
+    return User(seed_movies,
+                [], # liked movied
+                [], # disliked movies
+                weights, # user preferences
+                round(like_threshold,2)) # "like" threshold
 
 # ---------------------------------------------------------------------------------------------------
 # Function to generate fake users
@@ -207,83 +906,34 @@ def generate_fake_users(movies:list,
                         factors:list,
                         num_users:int=10, # number of users to generate
                         num_seed_movies:int=5, # number of random seed movies to choose
-                        std_multiplier:float=1.5 # std multiplier to define upper and lower bound
+                        std_multiplier:float=1.5, # std multiplier to define upper and lower bound
+                        seed:int=None, # seed of the per-user random generators (the random module if None)
+                        engine:MovieSimilarityEngine=None # encoded catalog and cached factor matrices (built if None)
                         ):
     
-    @dataclass
-    class User:
-        seed_movies:list # latent movies that the user likes
-        likes:list # known movies that the user has liked
-        dislikes:list # known movies that the user has disliked
-        weights:dict # user preferences
-        like_threshold:float # similarity threshold for liking a movie
-
     # create an empty list to hold the generated users
     generated_users = list()
 
+    # encode the catalog once for all users
+    if engine is None: engine = MovieSimilarityEngine(movies, title_index, summaries_sim_matrix)
+
+    # random generator of each user
+    rngs = get_user_rngs(seed, num_users, 'creation')
+
     # for each fake user to create
     for i in range(num_users):
 
         print(f'Creating fake user {i+1}...')
 
-        # create an empty dictionary
-        # to hold user preferences for each factor
-        weights = dict()
-
-        # for each factor to consider
-        for factor in factors:
-
-            # sample a random preference value (weight) between 0 and 1
-            weights[factor] = round(random(),2)
-
-        # sample a set number of random movies
-        # to use as seed movies for this user
-        seed_movies = sample(movies, num_seed_movies)
-
-        """
-        - Compute the "like" threshold for this user.
-        - If a movie has an above-threshold similarity with (at least) one of the seed movies,
-            then we assume that the user will like it.
-        - The threshold is defined to be equal to the average similarity of all movies with the seed movies,
-            plus <std_multiplier> standard deviation.
-        """
-
-        # create an empty dictionary
-        # to hold the similarity score
-        sim_scores = list()
-
-        # for each seed movie of this user
-        for seed_movie in seed_movies:
-
-            # for each other movie
-            for candidate_movie in movies:
-
-                # compute the similarity between the candidate movie and the current seed movie
-                similarity, _ = compute_similarity(candidate_movie.title,
-                                                   seed_movie.title,
-                                                   movies,
-                                                   title_index,
-                                                   summaries_sim_matrix,
-                                                   weights)
-
-                # store the similarity score
-                sim_scores.append(similarity)
-
-        # compute the "like" threshold for this user (mean + <std_multiplier> standard deviation)
-        like_threshold = np.mean(sim_scores) + std_multiplier*np.std(sim_scores)
-
-        # create a new user object with the selected:
-        # - seed movies
-        # - empty liked movies list
-        # - empty disliked movies list
-        # - weight factor user preferences
-        # - calculated "like" threshold
-        generated_users.append(User(seed_movies,
-                                    [], # liked movied
-                                    [], # disliked movies
-                                    weights, # user preferences
-                                    round(like_threshold,2)) # "like" threshold
-        )
+        # create the user
+        generated_users.append(create_fake_user(movies,
+                                                title_index,
+                                                summaries_sim_matrix,
+                                                factors,
+                                                num_seed_movies,
+                                                std_multiplier,
+                                                rngs[i],
+                                                engine))
 
     print()
     print('Fake users have been created successfully!')
@@ -292,142 +942,377 @@ def generate_fake_users(movies:list,
     return generated_users
 
 # ---------------------------------------------------------------------------------------------------
-# Function to make movie recommendations with exploit logic
+# Functions to create reproducible and independent random generators for the users
 # ---------------------------------------------------------------------------------------------------
 
-def exploit_simulate(generated_fake_users:list,
-                     movies:list,
-                     title_index:dict,
-                     summaries_sim_matrix:Tensor,
-                     factors:list,
-                     num_rec_per_user:int=50, # number of recommendations to make
-                     num_neighbors:int=10, # number of neighbors to consider when looking for candidates
-                     num_liked_sample_size:int=10, # number of liked movies to consider when looking for candidates
-                     ):
-    
-    # create an empty dictionary to hold each user's recommended movies
-    total_users_dict = defaultdict()
-    
-    # loop through fake users
-    for c, user in enumerate(generated_fake_users):
+# random streams of a user
+USER_STREAMS = {'creation':0, 'simulation':1}
 
-        st = time.time() # keep track of start time
-        
-        # create an empty dictionary to hold current user's recommended movies
-        current_user_dict = defaultdict()
+def get_user_seeds(seed:int,
+                   num_users:int,
+                   stream:str)->list: # 'creation' (generate_fake_users) or 'simulation' (exploit_simulate)
+
+    # one independent seed per user and stream, so that a user's simulation does not depend on the other users
+    return [int(child.generate_state(1)[0]) for child in np.random.SeedSequence([seed, USER_STREAMS[stream]]).spawn(num_users)]
+
+def get_user_rngs(seed:int, # None to use the random module
+                  num_users:int,
+                  stream:str)->list:
+
+    # no seed: every user uses the random module
+    if seed is None: return [None] * num_users
+
+    return [Random(user_seed) for user_seed in get_user_seeds(seed, num_users, stream)]
+
+# ---------------------------------------------------------------------------------------------------
+# Class to learn the factor weights of a user online from the like/dislike feedback
+# ---------------------------------------------------------------------------------------------------
 
-        # reset user's likes and dislikes for each iteration
-        user.likes = []
-        user.dislikes = []
+class OnlineWeightLearner:
 
-        # initialize estimated weights for each factor
-        estimated_weights = {factor:1 for factor in factors}
+    # - Logistic regression of the feedback: p(like) = sigmoid(bias + w @ x), where x holds the mean similarity
+    #   of each factor between the recommended movie and the movies liked so far.
+    # - One SGD step per feedback (with L2 regularization); the weights are kept non-negative,
+    #   since they are used as the factor weights of the similarity.
+    # - With feedback that follows a logistic model of the true weights, the learned weights converge to their direction
+    #   (cosine similarity above 0.95 after 2000 feedbacks). The 50 or so feedbacks of one simulated user are too few:
+    #   on a random catalog, the cosine similarity with the true weights does not reliably rise over 60 rounds.
 
-        # create an empty set to hold the recommender movies for the user
-        recommended_movies = set()
+    def __init__(self,
+                 factors:list,
+                 learning_rate:float=0.5,
+                 reg:float=0.001, # L2 regularization of the weights
+                 initial_weight:float=1.0): # same start as the fixed estimated weights
 
-        # make <num_rec_per_user> recommendations for this user
-        for i in range(num_rec_per_user):
+        # store the parameters
+        self.factors = list(factors)
+        self.learning_rate = learning_rate
+        self.reg = reg
 
-            # initialize a recommended movie to None
-            rec_movie = None
+        # weights and bias
+        self.w = np.full(len(self.factors), float(initial_weight))
+        self.bias = 0.0
+        self.num_updates = 0
 
-            # check if the user has no liked movies yet
-            if len(user.likes) == 0:
+    def decision_function(self,
+                          X:np.ndarray)->np.ndarray: # (movies x factors) mean factor similarities
+
+        return X @ self.w + self.bias
+
+    def predict_proba(self,
+                      X:np.ndarray)->np.ndarray: # (movies x factors) mean factor similarities
+
+        return 1 / (1 + np.exp(-self.decision_function(X)))
+
+    def update(self,
+               x:np.ndarray, # mean factor similarities of the recommended movie
+               liked:bool):
+
+        # error of the predicted probability
+        error = float(liked) - self.predict_proba(x[None,:])[0]
+
+        # gradient step on the log-likelihood, then projection on non-negative weights
+        self.w = np.maximum(self.w + self.learning_rate * (error * x - self.reg * self.w), 0)
+        self.bias += self.learning_rate * error
+        self.num_updates += 1
+
+    def get_weights(self)->dict:
+
+        # weights by factor
+        return {factor:float(w) for factor, w in zip(self.factors, self.w)}
+
+# ---------------------------------------------------------------------------------------------------
+# Function to make movie recommendations with exploit logic to one user
+# ---------------------------------------------------------------------------------------------------
+
+def simulate_user(user:User,
+                  movies:list,
+                  title_index:dict,
+                  summaries_sim_matrix:Tensor,
+                  factors:list,
+                  num_rec_per_user:int=50, # number of recommendations to make
+                  num_neighbors:int=10, # number of neighbors to consider when looking for candidates
+                  num_liked_sample_size:int=10, # number of liked movies to consider when looking for candidates (incremental=False only)
+                  rng:Random=None, # random generator of the user (the random module if None)
+                  engine:MovieSimilarityEngine=None, # reuse the encoded catalog and cached similarities
+                  verbose:bool=True, # print each recommendation
+                  incremental:bool=False, # accumulate the neighbors of each liked movie once (instead of sampling likes every round)
+                  learn_weights:bool=False, # learn the estimated weights from the feedback (incremental only)
+                  round_log:list=None # filled in place with the nDCG and weight estimates of each round
+                  )->dict:
+
+    # - incremental=True keeps a running score per candidate movie: when a movie is liked, the similarities of its
+    #   num_neighbors nearest movies are added once, and each round recommends the best candidate not recommended yet
+    #   (O(n) per round, using all the liked movies).
+    # - incremental=False (the default) is the original search: every round, up to num_liked_sample_size liked movies
+    #   are sampled and recommend_movies is called for each of them. num_liked_sample_size is not used by incremental=True.
+    # - learn_weights=True updates the estimated weights after each feedback (OnlineWeightLearner), and ranks the candidates
+    #   by the learned model on their mean factor similarities with the liked movies (kept as per-factor running sums).
+
+    # the learned ranking relies on the running sums of the incremental search
+    if learn_weights and not incremental: raise ValueError('learn_weights requires incremental=True')
+
+    # random function of the user
+    samp = rng.sample if rng is not None else sample
+
+    if incremental:
+
+        # get the encoded catalog
+        if engine is None: engine = MovieSimilarityEngine(movies, title_index, summaries_sim_matrix)
+
+        # position of each movie in the candidates of the engine (one movie per distinct title)
+        positions = np.full(engine.num_movies, -1)
+        positions[engine.candidates] = np.arange(len(engine.candidates))
+
+        # running score of each candidate, and masks of the candidates found and recommended so far
+        candidate_scores = np.zeros(len(engine.candidates))
+        is_candidate = np.zeros(len(engine.candidates), dtype=bool)
+        is_recommended = np.zeros(len(engine.candidates), dtype=bool)
+
+    if learn_weights:
+
+        # online learner and running sums of the factor similarities of each candidate with the liked movies
+        learner = OnlineWeightLearner(factors)
+        factor_sums = np.zeros((len(factors), len(engine.candidates)))
+
+    # create an empty dictionary to hold current user's recommended movies
+    current_user_dict = defaultdict()
+
+    # reset user's likes and dislikes for each iteration
+    user.likes = []
+    user.dislikes = []
+
+    # initialize estimated weights for each factor
+    estimated_weights = {factor:1 for factor in factors}
+
+    # create an empty set to hold the recommender movies for the user
+    recommended_movies = set()
+
+    # make <num_rec_per_user> recommendations for this user
+    for i in range(num_rec_per_user):
+
+        # initialize a recommended movie to None
+        rec_movie = None
+
+        # check if the user has no liked movies yet
+        if len(user.likes) == 0:
+
+            # sample a random movie until one is found that hasn't been recommended yet
+            while rec_movie == None or rec_movie.title in recommended_movies:
+                rec_movie = samp(movies,1)[0]
+
+        elif incremental:
+
+            # candidates that haven't been recommended yet
+            available = np.flatnonzero(is_candidate & ~is_recommended)
+
+            # if no candidates were found
+            if len(available) == 0:
 
                 # sample a random movie until one is found that hasn't been recommended yet
                 while rec_movie == None or rec_movie.title in recommended_movies:
-                    rec_movie = sample(movies,1)[0]
-            
+                    rec_movie = samp(movies,1)[0]
+
             else:
 
-                # create an empty dictionary to store candidate movies and their scores
-                candidate_movies = defaultdict(float)
+                # score of each candidate: running score, or the learned model on the mean factor similarities
+                scores = candidate_scores[available] if not learn_weights else \
+                         learner.decision_function(factor_sums[:, available].T / len(user.likes))
 
-                # sample some of the user's liked movies (up to liked_sample_size) to use when searching for candidates
-                # we are using only a sample of the user's liked movied for speed 
-                sampled_likes = sample(user.likes, min(len(user.likes), num_liked_sample_size))
+                # recommend the candidate with the highest score
+                rec_movie = movies[engine.candidates[available[np.argmax(scores)]]]
+        
+        else:
 
-                # for each sampled liked movie
-                for liked_movie in sampled_likes:
+            # create an empty dictionary to store candidate movies and their scores
+            candidate_movies = defaultdict(float)
 
-                    # recommended some similar movies using the recommend_movies function
-                    neighbors = recommend_movies(liked_movie.title,
-                                                 movies,
-                                                 title_index,
-                                                 summaries_sim_matrix,
-                                                 estimated_weights,
-                                                 num_neighbors)
+            # sample some of the user's liked movies (up to liked_sample_size) to use when searching for candidates
+            # we are using only a sample of the user's liked movied for speed 
+            sampled_likes = samp(user.likes, min(len(user.likes), num_liked_sample_size))
 
-                    # for each recommended movie
-                    for neighbor, metrics in neighbors:
+            # for each sampled liked movie
+            for liked_movie in sampled_likes:
 
-                        # if the movie hasn't been recommender before
-                        if neighbor not in recommended_movies:
+                # recommended some similar movies using the recommend_movies function
+                neighbors = recommend_movies(liked_movie.title,
+                                             movies,
+                                             title_index,
+                                             summaries_sim_matrix,
+                                             estimated_weights,
+                                             num_neighbors,
+                                             engine)
 
-                            # add the movie's similarity score to the candidate dictionary
-                            candidate_movies[neighbor] += metrics[0]
-                
-                # if no candidates were found
-                if len(candidate_movies) == 0:
+                # for each recommended movie
+                for neighbor, metrics in neighbors:
 
-                    # sample a random movie until one is found that hasn't been recommended yet
-                    while rec_movie == None or rec_movie.title in recommended_movies:
-                        rec_movie = sample(movies,1)[0]
-                
-                else:
+                    # if the movie hasn't been recommender before
+                    if neighbor not in recommended_movies:
 
-                    # recommend the movie with the highest score from the candidates
-                    rec_movie = movies[title_index[sorted(candidate_movies.items(), key=lambda x:x[1], reverse=True)[0][0]]]
+                        # add the movie's similarity score to the candidate dictionary
+                        candidate_movies[neighbor] += metrics[0]
             
-            # add the recommended movie to the set of recommended movies
-            recommended_movies.add(rec_movie.title)
-
-            # initialize a flag to track if the recommended movie is similar enough to any of the user's seed movies to be liked
-            found_seed = False
-
-            # for each seed movie
-            for seed_movie in user.seed_movies:
-
-                # compute the similarity between the recommended movie and the seed movie
-                similarity, _ = compute_similarity(rec_movie.title,
-                                                   seed_movie.title,
-                                                   movies,
-                                                   title_index,
-                                                   summaries_sim_matrix,
-                                                   user.weights)
-                
-                # if the similarity is above the user's like threshold
-                if similarity > user.like_threshold:
+            # if no candidates were found
+            if len(candidate_movies) == 0:
 
-                    # mark the recommended movie as liked and exit the loop
-                    found_seed = True
-                    
-                    break
+                # sample a random movie until one is found that hasn't been recommended yet
+                while rec_movie == None or rec_movie.title in recommended_movies:
+                    rec_movie = samp(movies,1)[0]
             
-            # if the movie is similar enough to at least one seed movie
-            if found_seed:
+            else:
 
-                # add the movie to the user's liked movies
-                user.likes.append(rec_movie)
+                # recommend the movie with the highest score from the candidates
+                rec_movie = movies[title_index[sorted(candidate_movies.items(), key=lambda x:x[1], reverse=True)[0][0]]]
+        
+        # add the recommended movie to the set of recommended movies
+        recommended_movies.add(rec_movie.title)
+        if incremental: is_recommended[positions[title_index[rec_movie.title]]] = True
+
+        # mean factor similarities of the recommended movie with the liked movies (the input of the learner)
+        if learn_weights and len(user.likes) > 0: x = factor_sums[:, positions[title_index[rec_movie.title]]] / len(user.likes)
+        else: x = None
+
+        # initialize a flag to track if the recommended movie is similar enough to any of the user's seed movies to be liked
+        found_seed = False
+
+        # for each seed movie
+        for seed_movie in user.seed_movies:
+
+            # compute the similarity between the recommended movie and the seed movie
+            similarity, _ = compute_similarity(rec_movie.title,
+                                               seed_movie.title,
+                                               movies,
+                                               title_index,
+                                               summaries_sim_matrix,
+                                               user.weights)
+            
+            # if the similarity is above the user's like threshold
+            if similarity > user.like_threshold:
+
+                # mark the recommended movie as liked and exit the loop
+                found_seed = True
                 
-                # add the movie to the user's recommended movies
-                current_user_dict[rec_movie.title] = 'Y'
+                break
+
+        # learn from the feedback
+        if learn_weights and x is not None:
+            learner.update(x, found_seed)
+            estimated_weights = learner.get_weights()
+        
+        # if the movie is similar enough to at least one seed movie
+        if found_seed:
+
+            # add the movie to the user's liked movies
+            user.likes.append(rec_movie)
+
+            if incremental:
+
+                # index of the liked movie
+                idx = title_index[rec_movie.title]
+
+                # learned weights change after every feedback, so a weighted matrix of the engine would never be reused:
+                # the factor similarities of the liked movie are computed once (one row) and combined directly
+                if learn_weights:
+                    rows = {factor:values[0] for factor, values in engine.factor_rows(np.array([idx])).items()}
+                    similarities = combine_factor_similarities(rows, estimated_weights)[engine.candidates]
+
+                # similarities of all candidates with the liked movie
+                else:
+                    similarities = engine.similarities(idx, estimated_weights)[engine.candidates]
 
+                # add the scores of its nearest neighbors to the running scores
+                neighbors = select_top_k(similarities, num_neighbors)
+                candidate_scores[neighbors] += similarities[neighbors]
+                is_candidate[neighbors] = True
+
+            if learn_weights:
+
+                # add the factor similarities of all candidates with the liked movie to the running sums
+                factor_sums += np.vstack([rows[factor] for factor in factors])[:, engine.candidates]
+            
+            # add the movie to the user's recommended movies
+            current_user_dict[rec_movie.title] = 'Y'
+
+            if verbose:
                 print(f' {i+1}/{num_rec_per_user} - {rec_movie.title} [Yes]' if (i+1) < 10 else
                       f'{i+1}/{num_rec_per_user} - {rec_movie.title} [Yes]')
-            
-            else:
+        
+        else:
 
-                # add the movie to the user's disliked movies
-                user.dislikes.append(rec_movie)
+            # add the movie to the user's disliked movies
+            user.dislikes.append(rec_movie)
 
-                # add the movie to the user's recommended movies
-                current_user_dict[rec_movie.title] = 'N'
+            # add the movie to the user's recommended movies
+            current_user_dict[rec_movie.title] = 'N'
 
+            if verbose:
                 print(f' {i+1}/{num_rec_per_user} - {rec_movie.title} [No]' if (i+1) < 10 else
                       f'{i+1}/{num_rec_per_user} - {rec_movie.title} [No]')
 
+        # track the quality of the recommendations and of the estimated weights
+        if round_log is not None:
+
+            # cosine similarity between the estimated and the true weights
+            estimated = np.array([estimated_weights[factor] for factor in factors], dtype=np.float64)
+            true = np.array([user.weights[factor] for factor in factors], dtype=np.float64)
+            norms = np.linalg.norm(estimated) * np.linalg.norm(true)
+
+            round_log.append({'round':i+1,
+                              'liked':found_seed,
+                              'likes':len(user.likes),
+                              'nDCG':float(evaluate_recommendations_using_nDCG(current_user_dict)),
+                              'weight_cosine':float(estimated @ true / norms) if norms > 0 else 0.0})
+
+    return current_user_dict
+
+# ---------------------------------------------------------------------------------------------------
+# Function to make movie recommendations with exploit logic
+# ---------------------------------------------------------------------------------------------------
+
+def exploit_simulate(generated_fake_users:list,
+                     movies:list,
+                     title_index:dict,
+                     summaries_sim_matrix:Tensor,
+                     factors:list,
+                     num_rec_per_user:int=50, # number of recommendations to make
+                     num_neighbors:int=10, # number of neighbors to consider when looking for candidates
+                     num_liked_sample_size:int=10, # number of liked movies to consider when looking for candidates (incremental=False only)
+                     seed:int=None, # seed of the per-user random generators (the random module if None)
+                     engine:MovieSimilarityEngine=None, # reuse the encoded catalog and cached similarities
+                     incremental:bool=False, # accumulate the neighbors of each liked movie once (see simulate_user)
+                     learn_weights:bool=False, # learn the estimated weights from the feedback (see simulate_user)
+                     round_logs:dict=None # filled in place with the per-round log of each user
+                     ):
+    
+    # create an empty dictionary to hold each user's recommended movies
+    total_users_dict = defaultdict()
+
+    # encode the catalog once for all users
+    if engine is None and incremental: engine = MovieSimilarityEngine(movies, title_index, summaries_sim_matrix)
+
+    # random generator of each user
+    rngs = get_user_rngs(seed, len(generated_fake_users), 'simulation')
+    
+    # loop through fake users
+    for c, user in enumerate(generated_fake_users):
+
+        st = time.time() # keep track of start time
+
+        # make the recommendations to the user
+        current_user_dict = simulate_user(user,
+                                          movies,
+                                          title_index,
+                                          summaries_sim_matrix,
+                                          factors,
+                                          num_rec_per_user,
+                                          num_neighbors,
+                                          num_liked_sample_size,
+                                          rngs[c],
+                                          engine,
+                                          incremental=incremental,
+                                          learn_weights=learn_weights,
+                                          round_log=round_logs.setdefault(f'user_{c+1}', list()) if round_logs is not None else None)
+
         # add the current user to the total users dictionary
         total_users_dict[f'user_{c+1}'] = current_user_dict
 
@@ -438,6 +1323,26 @@ def exploit_simulate(generated_fake_users:list,
 
     return total_users_dict
 
+# ---------------------------------------------------------------------------------------------------
+# Function to summarize the per-round logs of the simulated users
+# ---------------------------------------------------------------------------------------------------
+
+def summarize_round_logs(round_logs:dict, # user as key, round log of simulate_user as value
+                         target_nDCG:float=0.9): # quality target
+
+    # - Returns the per-round averages over the users (nDCG, likes, weight cosine), and the first round
+    #   at which each user reaches the target nDCG (None if never), to compare how many recommendations
+    #   are needed with and without learned weights.
+
+    # per-round averages
+    df = pd.DataFrame([entry for log in round_logs.values() for entry in log])
+    df_rounds = df.groupby('round')[['nDCG', 'likes', 'weight_cosine']].mean().reset_index() if len(df) > 0 else df
+
+    # first round that reaches the target for each user
+    rounds_to_target = {user:next((entry['round'] for entry in log if entry['nDCG'] >= target_nDCG), None) for user, log in round_logs.items()}
+
+    return df_rounds, rounds_to_target
+
 # ---------------------------------------------------------------------------------------------------
 # Function to evaluate the recommendations using Normalized Discounted Cumulative Gains (nDCG)
 # ---------------------------------------------------------------------------------------------------
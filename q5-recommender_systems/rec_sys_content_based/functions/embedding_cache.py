@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import json
+import os
+import re
+from hashlib import sha1
+from contextlib import contextmanager
+
+# file locks: fcntl on POSIX systems, msvcrt on Windows
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+# ---------------------------------------------------------------------------------------------------
+# Class to store the summary embeddings of a model on disk, so that each summary is only encoded once
+# ---------------------------------------------------------------------------------------------------
+
+class SummaryEmbeddingCache:
+
+    # - One set of files per model in cache_dir: <model>.bin holds the raw embeddings (one row per distinct summary),
+    #   and <model>.index.json maps the sha1 of each summary to its row (with the number of rows and dimensions).
+    # - Only the summaries that are not in the cache (new or changed) are encoded, then appended to the files.
+    # - The rows of the .bin file are never rewritten: a writer appends its rows, then replaces the index (os.replace),
+    #   so a reader (e.g., a worker process) always sees an index whose rows are all in the .bin file.
+    # - Writers take an exclusive lock on <model>.lock and re-read the index before appending,
+    #   so concurrent writers never pair their rows with each other's index.
+
+    def __init__(self,
+                 cache_dir:str,
+                 model_name:str='all-MiniLM-L6-v2',
+                 dtype:str='float32'): # storage type of the embeddings ('float32' or 'float16')
+
+        # store the parameters
+        self.model_name = model_name
+        self.dtype = np.dtype(dtype)
+
+        # paths of the files of the model
+        os.makedirs(cache_dir, exist_ok=True)
+        basename = os.path.join(cache_dir, re.sub(r'[^A-Za-z0-9_.-]', '_', model_name) + '_' + self.dtype.name)
+        self.data_path = basename + '.bin'
+        self.index_path = basename + '.index.json'
+        self.lock_path = basename + '.lock'
+
+        # load the index and the embeddings (if any)
+        self._load()
+
+    @staticmethod
+    def key(summary:str)->str:
+
+        # content address of the summary
+        return sha1(summary.encode('utf-8')).hexdigest()
+
+    def __len__(self):
+
+        return len(self.index)
+
+    def _load(self):
+
+        # empty cache
+        self.index, self.num_rows, self.dim, self.embeddings = dict(), 0, None, None
+        if not os.path.exists(self.index_path): return
+
+        # read the index (replaced as a whole, so it is never partially written)
+        with open(self.index_path, encoding='utf-8') as f:
+            meta = json.load(f)
+        self.index, self.num_rows, self.dim = meta['rows'], meta['num_rows'], meta['dim']
+
+        # open the rows of the index as a read-only memory map
+        if self.num_rows > 0: self.embeddings = np.memmap(self.data_path, dtype=self.dtype, mode='r', shape=(self.num_rows, self.dim))
+
+    @contextmanager
+    def lock(self):
+
+        # exclusive lock on the lock file of the model (one writer at a time, across processes)
+        with open(self.lock_path, 'a+b') as f:
+
+            if fcntl is not None: fcntl.flock(f, fcntl.LOCK_EX)
+            else: f.seek(0); msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+
+            try:
+                yield
+
+            finally:
+                if fcntl is not None: fcntl.flock(f, fcntl.LOCK_UN)
+                else: f.seek(0); msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+    def add(self,
+            keys:list, # keys of the new summaries
+            vectors:np.ndarray): # embeddings of the new summaries
+
+        # nothing to add
+        if len(keys) == 0: return
+
+        # convert to the storage type
+        vectors = np.asarray(vectors, dtype=self.dtype)
+
+        with self.lock():
+
+            # another writer may have added rows since the index was read
+            self._load()
+
+            # check the dimensions
+            if self.dim is not None and vectors.shape[1] != self.dim:
+                raise ValueError(f'Expected {self.dim}-dimensional embeddings, got {vectors.shape[1]}')
+            dim = vectors.shape[1]
+
+            # summaries that are still missing (once each)
+            new = {key:i for i, key in enumerate(keys) if key not in self.index}
+            if not new: return
+
+            # append the new rows
+            # (dropping the rows of a writer that was interrupted before replacing the index)
+            with open(self.data_path, 'ab') as f:
+                f.truncate(self.num_rows * dim * self.dtype.itemsize)
+                vectors[list(new.values())].tofile(f)
+                f.flush()
+                os.fsync(f.fileno())
+
+            # replace the index, now that its rows are on disk
+            index = dict(self.index, **{key:self.num_rows + i for i, key in enumerate(new)})
+            tmp_path = self.index_path + f'.{os.getpid()}.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({'model_name':self.model_name, 'dtype':self.dtype.name, 'dim':dim, 'num_rows':len(index), 'rows':index}, f)
+            os.replace(tmp_path, self.index_path)
+
+            # reopen the embeddings
+            self._load()
+
+    def encode(self,
+               summaries:list,
+               encoder)->np.ndarray: # function that encodes a list of summaries (only called for the missing ones)
+
+        # key of each summary
+        keys = [self.key(summary) for summary in summaries]
+
+        # distinct summaries that are not in the cache
+        missing = {key:summary for key, summary in zip(keys, summaries) if key not in self.index}
+
+        # encode and store them
+        if missing:
+            print(f'Encoding {len(missing)} new summaries ({len(self.index)} cached)...')
+            self.add(list(missing.keys()), np.asarray(encoder(list(missing.values())), dtype=np.float32))
+
+        # gather the embeddings of the summaries
+        if len(keys) == 0: return np.zeros((0, self.dim or 0), dtype=np.float32)
+
+        return np.asarray(self.embeddings[[self.index[key] for key in keys]], dtype=np.float32)
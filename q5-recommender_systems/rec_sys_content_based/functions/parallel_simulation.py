@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import scipy.sparse as sp
+import torch
+import os
+import time
+from random import Random
+from collections import defaultdict
+from multiprocessing import shared_memory
+from concurrent.futures import ProcessPoolExecutor
+from functions.content_based_recommendations import User, SummaryEmbeddings, MovieSimilarityEngine, \
+    create_fake_user, simulate_user, get_user_seeds
+
+# read-only catalog of each worker process
+# (set once per worker by "init_simulation_worker", instead of being sent with every task)
+_shared = dict()
+
+# ---------------------------------------------------------------------------------------------------
+# Function to copy an array into shared memory
+# ---------------------------------------------------------------------------------------------------
+
+def share_array(array:np.ndarray):
+
+    # create the shared memory block and copy the array into it
+    shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)[:] = array
+
+    # the block is attached by the workers from its name, shape and type
+    return shm, (shm.name, array.shape, array.dtype.str)
+
+# ---------------------------------------------------------------------------------------------------
+# Function to attach an array shared by share_array, in a worker process
+# ---------------------------------------------------------------------------------------------------
+
+def attach_array(spec:tuple)->np.ndarray: # (name, shape, dtype) returned by share_array
+
+    # attach the block without copying it
+    name, shape, dtype = spec
+    shm = shared_memory.SharedMemory(name=name)
+
+    # keep the block attached while the worker lives
+    _shared.setdefault('blocks', list()).append(shm)
+
+    return np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+
+# ---------------------------------------------------------------------------------------------------
+# Function to copy the arrays of an engine into shared memory
+# ---------------------------------------------------------------------------------------------------
+
+def share_engine(engine:MovieSimilarityEngine):
+
+    # - Shares the encoded catalog (the CSR matrices as their data, indices and row pointers) and, for dense
+    #   catalogs, the factor matrices, computed once here instead of once per worker.
+    # - Returns the shared memory blocks and the spec to rebuild the engine with attach_engine.
+
+    # create empty containers
+    # to hold the shared memory blocks and the spec of each array
+    blocks, spec = list(), {'features':dict(), 'factor_matrices':None}
+
+    # function to share one array
+    def share(array:np.ndarray)->tuple:
+        shm, array_spec = share_array(np.asarray(array))
+        blocks.append(shm)
+        return array_spec
+
+    # encoded catalog
+    for name, value in engine.features.items():
+        if sp.issparse(value): spec['features'][name] = ('csr', value.shape, [share(value.data), share(value.indices), share(value.indptr)])
+        elif isinstance(value, np.ndarray): spec['features'][name] = ('array', share(value))
+        else: spec['features'][name] = ('value', value)
+
+    # factor matrices of dense catalogs
+    if engine.is_dense: spec['factor_matrices'] = {name:share(matrix) for name, matrix in engine.factor_matrices().items()}
+
+    return blocks, spec
+
+# ---------------------------------------------------------------------------------------------------
+# Function to rebuild an engine from the arrays shared by share_engine, in a worker process
+# ---------------------------------------------------------------------------------------------------
+
+def attach_engine(movies:list,
+                  title_index:dict,
+                  summaries_sim_matrix,
+                  spec:dict)->MovieSimilarityEngine:
+
+    # encoded catalog
+    features = dict()
+    for name, (kind, *value) in spec['features'].items():
+        if kind == 'csr': features[name] = sp.csr_matrix(tuple(attach_array(part) for part in value[1]), shape=value[0])
+        elif kind == 'array': features[name] = attach_array(value[0])
+        else: features[name] = value[0]
+
+    # factor matrices of dense catalogs
+    factor_matrices = None
+    if spec['factor_matrices'] is not None: factor_matrices = {name:attach_array(array_spec) for name, array_spec in spec['factor_matrices'].items()}
+
+    return MovieSimilarityEngine(movies, title_index, summaries_sim_matrix, features=features, factor_matrices=factor_matrices)
+
+# ---------------------------------------------------------------------------------------------------
+# Function to receive the catalog once in each worker process
+# ---------------------------------------------------------------------------------------------------
+
+def init_simulation_worker(movies:list,
+                           title_index:dict,
+                           summaries_sim_matrix, # None when the similarities are in shared memory
+                           shared_similarities:tuple, # (kind, (name, shape, dtype)) of the shared similarities, or None
+                           factors:list,
+                           shared_engine:dict): # spec returned by share_engine (no engine if None)
+
+    # attach the shared similarities without copying them
+    if shared_similarities is not None:
+        kind, array_spec = shared_similarities
+        array = attach_array(array_spec)
+
+        # dense cosine similarity matrix (as a tensor) or normalized embeddings
+        summaries_sim_matrix = torch.from_numpy(array) if kind == 'dense' else SummaryEmbeddings.from_normalized(array)
+
+    # keep the catalog for the tasks of this worker
+    _shared.update(movies=movies,
+                   title_index=title_index,
+                   summaries_sim_matrix=summaries_sim_matrix,
+                   factors=factors,
+                   positions={id(m):i for i, m in enumerate(movies)},
+                   engine=attach_engine(movies, title_index, summaries_sim_matrix, shared_engine) if shared_engine is not None else None)
+
+# ---------------------------------------------------------------------------------------------------
+# Function to create and simulate one fake user in a worker process
+# ---------------------------------------------------------------------------------------------------
+
+def simulate_user_task(creation_seed:int,
+                       simulation_seed:int,
+                       num_seed_movies:int,
+                       std_multiplier:float,
+                       num_rec_per_user:int,
+                       num_neighbors:int,
+                       num_liked_sample_size:int,
+                       incremental:bool,
+                       learn_weights:bool):
+
+    # start time
+    st = time.time()
+
+    # create the user, with the same random stream as generate_fake_users
+    user = create_fake_user(_shared['movies'], _shared['title_index'], _shared['summaries_sim_matrix'], _shared['factors'],
+                            num_seed_movies, std_multiplier, Random(creation_seed), _shared['engine'])
+
+    # make the recommendations, with the same random stream as exploit_simulate
+    round_log = list()
+    history = simulate_user(user, _shared['movies'], _shared['title_index'], _shared['summaries_sim_matrix'], _shared['factors'],
+                            num_rec_per_user, num_neighbors, num_liked_sample_size, Random(simulation_seed), _shared['engine'], verbose=False,
+                            incremental=incremental, learn_weights=learn_weights, round_log=round_log)
+
+    # send the movies back as their positions in the catalog
+    positions = lambda movie_list:[_shared['positions'][id(m)] for m in movie_list]
+    user_data = {'seed_movies':positions(user.seed_movies),
+                 'likes':positions(user.likes),
+                 'dislikes':positions(user.dislikes),
+                 'weights':user.weights,
+                 'like_threshold':user.like_threshold}
+
+    return user_data, dict(history), round_log, time.time() - st
+
+# ---------------------------------------------------------------------------------------------------
+# Function to create and simulate many fake users in parallel
+# ---------------------------------------------------------------------------------------------------
+
+def run_simulation_in_parallel(movies:list,
+                               title_index:dict,
+                               summaries_sim_matrix,
+                               factors:list,
+                               num_users:int=10, # number of users to generate
+                               num_seed_movies:int=5, # number of random seed movies to choose
+                               std_multiplier:float=1.5, # std multiplier to define upper and lower bound
+                               num_rec_per_user:int=50, # number of recommendations to make
+                               num_neighbors:int=10, # number of neighbors to consider when looking for candidates
+                               num_liked_sample_size:int=10, # number of liked movies to consider when looking for candidates (incremental=False only)
+                               num_workers:int=None, # number of worker processes (number of cores if None)
+                               seed:int=0, # seed of the per-user random generators
+                               use_engine:bool=True, # build a MovieSimilarityEngine, shared by the workers
+                               incremental:bool=False, # accumulate the neighbors of each liked movie once (see simulate_user)
+                               learn_weights:bool=False, # learn the estimated weights from the feedback (see simulate_user)
+                               round_logs:dict=None): # filled in place with the per-round log of each user
+
+    # - Each user is created and simulated in a worker process, with its own random generators
+    #   (seeded as in generate_fake_users and exploit_simulate with the same seed, so the results
+    #   do not depend on the number of workers and match the sequential functions).
+    # - The summary similarities (dense matrix or normalized embeddings) are placed once in shared memory,
+    #   as are the arrays of the engine (its encoded catalog and, for dense catalogs, its factor matrices),
+    #   which is built once here. The movies are sent once per worker.
+    # - Returns the generated users and their recommendations, as generate_fake_users and exploit_simulate do.
+
+    # get the number of workers
+    if num_workers is None: num_workers = os.cpu_count() or 1
+
+    # build the engine once, and place its arrays in shared memory
+    blocks, shared_engine = list(), None
+    if use_engine: blocks, shared_engine = share_engine(MovieSimilarityEngine(movies, title_index, summaries_sim_matrix))
+
+    # place the summary similarities in shared memory
+    shared_similarities = None
+    if isinstance(summaries_sim_matrix, torch.Tensor):
+        shm, spec = share_array(summaries_sim_matrix.cpu().numpy())
+        blocks.append(shm)
+        shared_similarities, summaries_sim_matrix = ('dense', spec), None
+    elif isinstance(summaries_sim_matrix, SummaryEmbeddings):
+        shm, spec = share_array(np.asarray(summaries_sim_matrix.embeddings))
+        blocks.append(shm)
+        shared_similarities, summaries_sim_matrix = ('embeddings', spec), None
+
+    # seeds of each user
+    creation_seeds = get_user_seeds(seed, num_users, 'creation')
+    simulation_seeds = get_user_seeds(seed, num_users, 'simulation')
+
+    # create empty containers
+    # to hold the users and their recommended movies
+    generated_users, total_users_dict = list(), defaultdict()
+
+    try:
+
+        # start the worker processes with the catalog
+        with ProcessPoolExecutor(max_workers=num_workers,
+                                 initializer=init_simulation_worker,
+                                 initargs=(movies, title_index, summaries_sim_matrix, shared_similarities, factors, shared_engine)) as executor:
+
+            # submit every user
+            futures = [executor.submit(simulate_user_task, creation_seeds[c], simulation_seeds[c], num_seed_movies, std_multiplier,
+                                       num_rec_per_user, num_neighbors, num_liked_sample_size, incremental, learn_weights)
+                       for c in range(num_users)]
+
+            # merge the results in the order of the users
+            for c, future in enumerate(futures):
+
+                user_data, history, round_log, elapsed = future.result()
+                if round_logs is not None: round_logs[f'user_{c+1}'] = round_log
+
+                # rebuild the user with the movies of the catalog
+                to_movies = lambda positions:[movies[i] for i in positions]
+                user = User(to_movies(user_data['seed_movies']),
+                            to_movies(user_data['likes']),
+                            to_movies(user_data['dislikes']),
+                            user_data['weights'],
+                            user_data['like_threshold'])
+
+                generated_users.append(user)
+                total_users_dict[f'user_{c+1}'] = defaultdict(None, history)
+
+                print(f'User {c+1}: {len(user.likes)}/{num_rec_per_user} liked movies ({int(elapsed)} secs.)')
+
+    finally:
+
+        # release the shared memory
+        for shm in blocks:
+            shm.close()
+            shm.unlink()
+
+    return generated_users, total_users_dict
@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import scipy.sparse as sp
+import csv
+import json
+import os
+import time
+from itertools import islice
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from sentence_transformers import SentenceTransformer
+from functions.content_based_recommendations import SET_ATTRIBUTES, NOMINAL_ATTRIBUTES, SummaryEmbeddings
+
+# numeric attributes and the type of their column
+NUMERIC_ATTRIBUTES = {'runtime':int, 'rating':float, 'ryear':int}
+
+# ---------------------------------------------------------------------------------------------------
+# Function to convert a raw binary column into a .npy file, without loading it in memory
+# ---------------------------------------------------------------------------------------------------
+
+def finalize_column(raw_path:str,
+                    dtype, # type of the values
+                    num_columns:int=None): # number of values per row (1-d column if None)
+
+    # number of rows written
+    itemsize = np.dtype(dtype).itemsize * (num_columns or 1)
+    num_rows = os.path.getsize(raw_path) // itemsize
+    shape = (num_rows,) if num_columns is None else (num_rows, num_columns)
+
+    # copy the raw values into the .npy file (both memory-mapped)
+    out = np.lib.format.open_memmap(raw_path[:-len('.bin')] + '.npy', mode='w+', dtype=dtype, shape=shape)
+    if num_rows > 0: out[:] = np.memmap(raw_path, dtype=dtype, mode='r', shape=shape)
+    out.flush()
+    del out
+
+    # remove the raw file
+    os.remove(raw_path)
+
+# ---------------------------------------------------------------------------------------------------
+# Function to stream the catalog into columnar files, encoding the summaries batch by batch
+# ---------------------------------------------------------------------------------------------------
+
+def stream_catalog(input_file_path:str,
+                   output_dir:str,
+                   batch_size:int=1000, # number of rows parsed at once
+                   encode_batch_size:int=32, # number of summaries encoded at once by Sentence-BERT
+                   num_threads:int=2, # number of batches encoded concurrently
+                   model_name:str='all-MiniLM-L6-v2',
+                   similarity_dtype:str='float32'): # storage type of the normalized embeddings ('float32' or 'float16')
+
+    # - Parses the csv file batch by batch and appends each batch to columnar files in output_dir:
+    #   for each set-valued attribute, the CSR indices and set sizes over an interned vocabulary,
+    #   the numeric attributes, the codes of the nominal attributes and the summary embeddings (L2-normalized and stored
+    #   in similarity_dtype, so that load_streamed_catalog can memory-map them as they are).
+    # - The summaries of each batch are encoded in a thread pool while the next batches are parsed;
+    #   at most num_threads batches are in flight, so peak memory is bounded by the batch size, not the catalog.
+    # - Only the titles and the vocabularies are kept in memory until the end.
+    # - The output is read with load_streamed_catalog.
+
+    # start time
+    st = time.time()
+
+    # create the output directory
+    os.makedirs(output_dir, exist_ok=True)
+    path = lambda name: os.path.join(output_dir, name)
+
+    # create empty dictionaries
+    # to hold the vocabulary (value as key, code as value) of each set-valued and nominal attribute
+    vocabularies = {attribute:dict() for attribute in SET_ATTRIBUTES + NOMINAL_ATTRIBUTES}
+
+    # create an empty list
+    # to hold the title of each movie
+    titles = list()
+
+    # open the raw column files
+    raw = {name:open(path(name + '.bin'), 'wb') for name in [f'{attribute}_{suffix}' for attribute in SET_ATTRIBUTES for suffix in ['indices', 'size']]
+                                                          + list(NUMERIC_ATTRIBUTES) + NOMINAL_ATTRIBUTES + ['embeddings']}
+
+    # load the pretrained model
+    sbert = SentenceTransformer(model_name)
+
+    # function to write the normalized embeddings of the oldest batch in flight
+    def write_oldest(pending:deque):
+        SummaryEmbeddings.normalize(pending.popleft().result(), similarity_dtype).tofile(raw['embeddings'])
+
+    # open the input file
+    # and read each row as a dictionary
+    with open(input_file_path, encoding='utf-8') as f, ThreadPoolExecutor(max_workers=num_threads) as executor:
+
+        # batches being encoded, in order
+        pending = deque()
+
+        # loop through batches of rows
+        reader = csv.DictReader(f)
+        while True:
+
+            batch = list(islice(reader, batch_size))
+            if not batch: break
+
+            # encode the summaries of the batch in the background
+            pending.append(executor.submit(sbert.encode, [row['summary'] for row in batch], batch_size=encode_batch_size))
+
+            # titles
+            titles.extend(row['title'] for row in batch)
+
+            # set-valued attributes: codes of the distinct values of each movie (in order of appearance)
+            for attribute in SET_ATTRIBUTES:
+                vocabulary = vocabularies[attribute]
+                codes = [[vocabulary.setdefault(value, len(vocabulary)) for value in dict.fromkeys(x.strip() for x in row[attribute].split(','))] for row in batch]
+                np.fromiter((c for movie_codes in codes for c in movie_codes), dtype=np.int32).tofile(raw[attribute + '_indices'])
+                np.array([len(movie_codes) for movie_codes in codes], dtype=np.int64).tofile(raw[attribute + '_size'])
+
+            # numeric attributes
+            for attribute, cast in NUMERIC_ATTRIBUTES.items():
+                np.array([cast(row[attribute]) for row in batch], dtype=np.float64).tofile(raw[attribute])
+
+            # nominal attributes
+            for attribute in NOMINAL_ATTRIBUTES:
+                vocabulary = vocabularies[attribute]
+                np.array([vocabulary.setdefault(row[attribute], len(vocabulary)) for row in batch], dtype=np.int64).tofile(raw[attribute])
+
+            # write the embeddings of the finished batches (keeping at most num_threads in flight)
+            while len(pending) >= num_threads or (pending and pending[0].done()): write_oldest(pending)
+
+            print(f'{len(titles)} movies streamed ({int(time.time()-st)} secs.)')
+
+        # write the remaining embeddings
+        while pending: write_oldest(pending)
+
+    # close the raw files
+    for file in raw.values(): file.close()
+
+    # convert the raw files into .npy files
+    for attribute in SET_ATTRIBUTES:
+        finalize_column(path(attribute + '_indices.bin'), np.int32)
+        finalize_column(path(attribute + '_size.bin'), np.int64)
+    for attribute in list(NUMERIC_ATTRIBUTES) + NOMINAL_ATTRIBUTES:
+        finalize_column(path(attribute + '.bin'), np.float64 if attribute in NUMERIC_ATTRIBUTES else np.int64)
+    finalize_column(path('embeddings.bin'), similarity_dtype, sbert.get_sentence_embedding_dimension())
+
+    # write the titles and the vocabularies
+    with open(path('catalog.json'), 'w', encoding='utf-8') as f:
+        json.dump({'titles':titles, 'vocabularies':{attribute:list(vocabulary) for attribute, vocabulary in vocabularies.items()}}, f)
+
+    print(f'{len(titles)} movies streamed to {output_dir} ({int(time.time()-st)} secs.)')
+
+# ---------------------------------------------------------------------------------------------------
+# Function to load the columnar files written by stream_catalog
+# ---------------------------------------------------------------------------------------------------
+
+def load_streamed_catalog(output_dir:str):
+
+    # - Returns the encoded features (same layout as encode_movie_features), the titles, the title index
+    #   and the summary embeddings, ready for MovieSimilarityEngine(None, title_index, summaries,
+    #   features=features, titles=titles).
+    # - The summary embeddings, the numeric and nominal columns and the indices of the set-valued attributes are
+    #   memory-mapped as they are, so they are only read from disk when used.
+    # - The rest is built in memory: for each set-valued attribute, the CSR data (8 bytes per value) and row pointers
+    #   and the set sizes as float64 (16 bytes per movie), plus the titles and the vocabularies. On the 6945 movies of
+    #   the dataset (99k set values), the load peaks at 3.9 MB (1.2 MB for the set-valued attributes, the rest for
+    #   catalog.json), while the 10 MB of float32 embeddings stay on disk.
+
+    # path of a file of the catalog
+    path = lambda name: os.path.join(output_dir, name)
+    load = lambda name: np.load(path(name + '.npy'), mmap_mode='r')
+
+    # read the titles and the vocabularies
+    with open(path('catalog.json'), encoding='utf-8') as f:
+        catalog = json.load(f)
+    titles = catalog['titles']
+
+    # index of each title (the last movie of a duplicated title, as in load_and_prepare_data)
+    title_index = {title:i for i, title in enumerate(titles)}
+
+    # create an empty dictionary
+    # to hold the encoded attributes
+    features = dict()
+
+    # set-valued attributes as CSR matrices
+    for attribute in SET_ATTRIBUTES:
+        indices, sizes = load(attribute + '_indices'), load(attribute + '_size')
+        indptr = np.concatenate([[0], np.cumsum(sizes)])
+        features[attribute] = sp.csr_matrix((np.ones(len(indices)), indices, indptr),
+                                            shape=(len(titles), len(catalog['vocabularies'][attribute])))
+        features[attribute + '_size'] = sizes.astype(np.float64)
+
+    # numeric and nominal attributes
+    for attribute in list(NUMERIC_ATTRIBUTES) + NOMINAL_ATTRIBUTES:
+        features[attribute] = load(attribute)
+
+    # catalog statistics
+    features['runtime_range'] = features['runtime'].max() - features['runtime'].min() if len(titles) > 0 else 0.0
+
+    # normalized summary embeddings (memory-mapped, not copied)
+    summaries = SummaryEmbeddings.from_normalized(load('embeddings'))
+
+    return features, titles, title_index, summaries
@@ -0,0 +1,8 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+
+# import the functions package from the project folder (as the notebook does)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
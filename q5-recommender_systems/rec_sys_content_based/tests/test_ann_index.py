@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import numpy as np
+from functions.content_based_recommendations import SummaryEmbeddings, select_top_k
+from functions.ann_index import IVFIndex, benchmark_ann_index
+
+# ---------------------------------------------------------------------------------------------------
+# Function to create clustered random summary embeddings (as topics of summaries)
+# ---------------------------------------------------------------------------------------------------
+
+def make_embeddings(num_movies:int=2000,
+                    num_topics:int=20,
+                    dim:int=32,
+                    seed:int=0) -> np.ndarray:
+
+    # random generator
+    rng = np.random.default_rng(seed)
+
+    # each movie is a random topic plus noise
+    topics = rng.standard_normal((num_topics, dim))
+    return (topics[rng.integers(num_topics, size=num_movies)] + rng.standard_normal((num_movies, dim))).astype(np.float32)
+
+# ---------------------------------------------------------------------------------------------------
+# Tests
+# ---------------------------------------------------------------------------------------------------
+
+def test_ivf_recall_rises_with_the_number_of_probes():
+
+    # index of 40 clusters, and random query movies
+    index = IVFIndex(make_embeddings(), num_lists=40)
+    queries = np.random.default_rng(1).choice(2000, 50, replace=False).tolist()
+
+    # recall@20 and fraction of the catalog compared for an increasing number of probes
+    results = [benchmark_ann_index(index, queries, k=20, num_probes=num_probes) for num_probes in [1, 2, 4, 8]]
+    recalls = [result['recall@20'] for result in results]
+    assert recalls == sorted(recalls)
+
+    # a few probes find almost every neighbor, comparing with a small part of the catalog
+    assert recalls[2] >= 0.95 and results[2]['candidate_fraction'] < 0.2
+
+    # probing every cluster is the exact search
+    result = benchmark_ann_index(index, queries, k=20, num_probes=40)
+    assert result['recall@20'] == 1.0 and result['candidate_fraction'] == 1.0
+
+def test_ivf_query_scores_the_candidates_exactly(tmp_path):
+
+    # index, saved and loaded back
+    embeddings = make_embeddings()
+    index = IVFIndex(embeddings, num_lists=40)
+    index.save(tmp_path / 'index.npz')
+    loaded = IVFIndex.load(tmp_path / 'index.npz')
+
+    for idx in [0, 500, 1999]:
+
+        # the similarities are the cosine similarities of the summaries
+        rows, similarities = index.query(idx, k=20, num_probes=40)
+        np.testing.assert_allclose(similarities, SummaryEmbeddings(embeddings).column(idx)[rows], atol=1e-6)
+
+        # the exact top-k when probing every cluster
+        exact = select_top_k(index.embeddings @ index.embeddings[idx], 20)
+        assert set(rows.tolist()) == set(exact.tolist())
+
+        # the loaded index gives the same results
+        loaded_rows, loaded_similarities = loaded.query(idx, k=20, num_probes=4)
+        expected_rows, expected_similarities = index.query(idx, k=20, num_probes=4)
+        np.testing.assert_array_equal(loaded_rows, expected_rows)
+        np.testing.assert_array_equal(loaded_similarities, expected_similarities)
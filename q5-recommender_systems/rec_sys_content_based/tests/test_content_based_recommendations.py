@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import torch
+import pytest
+from functions.content_based_recommendations import (Movie, SummaryEmbeddings, FACTORS, compute_similarity, encode_movie_features,
+                                                     compute_factor_similarities, compute_factor_similarities_block,
+                                                     combine_factor_similarities, explain_factor_similarities, MovieSimilarityEngine,
+                                                     recommend_movies, TopNSummarySimilarities, get_summary_similarity,
+                                                     get_summary_similarities, create_fake_user, simulate_user, User,
+                                                     OnlineWeightLearner)
+from random import Random
+from sentence_transformers import util
+import functions.content_based_recommendations as content_based_recommendations
+
+# ---------------------------------------------------------------------------------------------------
+# Function to create a random movie catalog (with random summary embeddings instead of Sentence-BERT)
+# ---------------------------------------------------------------------------------------------------
+
+def make_catalog(num_movies:int=60,
+                 dim:int=16,
+                 seed:int=0):
+
+    # random generator
+    rng = np.random.default_rng(seed)
+
+    # random set of codes
+    def codes(num_values:int, max_size:int) -> frozenset:
+        return frozenset(rng.choice(num_values, size=int(rng.integers(1, max_size + 1)), replace=False).tolist())
+
+    # create the movies (the last title is a duplicate, as in the dataset)
+    movies, title_index = [], dict()
+    for i in range(num_movies):
+        title = f'movie {i}' if i < num_movies - 1 else 'movie 0'
+        movies.append(Movie(title, codes(8, 3), codes(20, 4), int(rng.integers(80, 180)), codes(30, 1), codes(60, 4),
+                            float(np.round(rng.uniform(5, 9), 1)), int(rng.integers(1960, 2022)),
+                            f'house {rng.integers(6)}', f'summary {i}', f'actor {rng.integers(10)}'))
+        title_index[title] = i
+
+    # random summary embeddings
+    embeddings = rng.standard_normal((num_movies, dim)).astype(np.float32)
+
+    return movies, title_index, embeddings
+
+# ---------------------------------------------------------------------------------------------------
+# Function to get the (unweighted) factor scores of compute_similarity for a pair of movies
+# ---------------------------------------------------------------------------------------------------
+
+def compute_factor_scores(title1:str,
+                          title2:str,
+                          movies:list,
+                          title_index:dict,
+                          summaries_sim_matrix) -> dict:
+
+    # unit weights: the positive factors are the scores rounded to 2 decimals (the others are left out)
+    _, sorted_factors = compute_similarity(title1, title2, movies, title_index, summaries_sim_matrix, {factor:1 for factor in FACTORS})
+
+    return {factor:dict(sorted_factors).get(factor, 0) for factor in FACTORS}
+
+# ---------------------------------------------------------------------------------------------------
+# Tests
+# ---------------------------------------------------------------------------------------------------
+
+@pytest.mark.parametrize('similarities', ['dense', 'embeddings'])
+def test_factor_similarities_match_compute_similarity(similarities):
+
+    # random catalog, with the dense cosine similarity matrix or the normalized embeddings
+    movies, title_index, embeddings = make_catalog()
+    summaries = SummaryEmbeddings(embeddings)
+    if similarities == 'dense': summaries = torch.from_numpy(summaries.embeddings @ summaries.embeddings.T)
+
+    # encode the catalog once
+    features = encode_movie_features(movies)
+    assert features['genre'].shape == (len(movies), 8) and features['runtime_range'] == max(m.runtime for m in movies) - min(m.runtime for m in movies)
+
+    # the movies of the titles (the duplicate title is scored as its last movie, as in title_index)
+    rows = [j for j, movie in enumerate(movies) if title_index[movie.title] == j]
+
+    for idx in [7, 33, 59]:
+
+        # one movie against all movies
+        scores = compute_factor_similarities(idx, features, summaries)
+
+        # same factor scores as compute_similarity (rounded to 2 decimals, and only the positive ones)
+        for j in rows:
+            expected = compute_factor_scores(movies[j].title, movies[idx].title, movies, title_index, summaries)
+            for factor in FACTORS:
+                assert max(scores[factor][j], 0) == pytest.approx(expected[factor], abs=0.005 + 1e-6), (idx, j, factor)
+
+def test_factor_similarity_blocks_match_the_single_rows():
+
+    # random catalog
+    movies, title_index, embeddings = make_catalog()
+    summaries = SummaryEmbeddings(embeddings)
+    features = encode_movie_features(movies)
+
+    # a block of input movies, against a subset of the candidates
+    rows, columns = np.array([3, 0, 59, 12]), np.array([5, 1, 40, 2, 59])
+    block = compute_factor_similarities_block(rows, features, summaries, columns)
+
+    # entry (i, j) is entry columns[j] of the single row of rows[i]
+    for i, idx in enumerate(rows):
+        scores = compute_factor_similarities(idx, features, summaries)
+        for factor in FACTORS:
+            np.testing.assert_allclose(block[factor][i], scores[factor][columns], rtol=1e-6, atol=1e-6)
+
+@pytest.mark.parametrize('dense', [True, False])
+def test_engine_similarities_match_the_factor_similarities(dense):
+
+    # random catalog, with dense factor matrices (in several blocks) or rows computed on demand
+    movies, title_index, embeddings = make_catalog()
+    summaries = SummaryEmbeddings(embeddings)
+    features = encode_movie_features(movies)
+    engine = MovieSimilarityEngine(movies, title_index, summaries, dense_memory_budget=2**31 if dense else 0, block_size=16,
+                                   max_cached_weights=2)
+    assert engine.is_dense == dense
+
+    # random weights
+    rng = np.random.default_rng(1)
+    all_weights = [{factor:float(np.round(rng.random(), 2)) for factor in FACTORS} for _ in range(3)]
+
+    for weights in all_weights:
+        for idx in [0, 17, 59]:
+
+            # exact float64 totals of the row
+            scores = compute_factor_similarities(idx, features, summaries)
+            expected = combine_factor_similarities(scores, weights)
+
+            # same totals (the dense totals are stored in float32)
+            np.testing.assert_allclose(engine.similarities(idx, weights), expected, rtol=1e-6, atol=1e-6)
+
+            # same factor breakdowns
+            assert engine.explain(idx, [3, 25], weights) == [explain_factor_similarities({factor:scores[factor][j] for factor in FACTORS}, weights)
+                                                             for j in [3, 25]]
+
+            # and the same as compute_similarity, even for the float32 summary similarity of a movie with itself
+            # (the duplicate title of movie 0 is scored as movie 59)
+            if idx > 0:
+                assert engine.explain(idx, [idx], weights)[0] == compute_similarity(movies[idx].title, movies[idx].title, movies, title_index,
+                                                                                    summaries, weights)[1]
+
+    # dense catalogs keep the float32 totals of the last weights, the others keep no n x n array
+    if dense:
+        assert len(engine._weighted) == 2 and all(totals.dtype == np.float32 for totals in engine._weighted.values())
+        assert engine.weighted_matrix(all_weights[-1]) is engine.weighted_matrix(all_weights[-1])
+    else:
+        with pytest.raises(ValueError): engine.weighted_matrix(all_weights[0])
+        assert not engine._weighted and not engine._factor_matrices
+
+def test_like_threshold_does_not_depend_on_the_engine():
+
+    # random catalog
+    movies, title_index, embeddings = make_catalog()
+    summaries = SummaryEmbeddings(embeddings)
+    features = encode_movie_features(movies)
+
+    # engines with dense factor matrices and with rows computed on demand
+    engines = [None, MovieSimilarityEngine(movies, title_index, summaries), MovieSimilarityEngine(movies, title_index, summaries, dense_memory_budget=0)]
+
+    for seed in range(5):
+
+        # the same user, created with each engine
+        users = [create_fake_user(movies, title_index, summaries, FACTORS, rng=Random(seed), engine=engine) for engine in engines]
+        assert all(user.weights == users[0].weights and user.seed_movies == users[0].seed_movies for user in users)
+        assert len({user.like_threshold for user in users}) == 1
+
+        # mean + 1.5 std of the similarities of every movie with the seed movies (scored as the movies of their titles)
+        columns = [title_index[movie.title] for movie in movies]
+        sim_scores = [combine_factor_similarities(compute_factor_similarities(title_index[movie.title], features, summaries), users[0].weights)[columns]
+                      for movie in users[0].seed_movies]
+        assert users[0].like_threshold == pytest.approx(np.mean(sim_scores) + 1.5 * np.std(sim_scores), abs=0.005 + 1e-6)
+
+def test_simulate_user_samples_the_liked_movies_by_default(monkeypatch):
+
+    # random catalog and user
+    movies, title_index, embeddings = make_catalog()
+    summaries = SummaryEmbeddings(embeddings)
+    user = create_fake_user(movies, title_index, summaries, FACTORS, rng=Random(0))
+
+    # count the searches of the original simulation
+    calls = list()
+    monkeypatch.setattr(content_based_recommendations, 'recommend_movies',
+                        lambda *args, **kwargs:calls.append(args[0]) or recommend_movies(*args, **kwargs))
+
+    # function to simulate a copy of the user
+    def simulate(**kwargs):
+        copy = User(list(user.seed_movies), [], [], user.weights, user.like_threshold)
+        calls.clear()
+        history = simulate_user(copy, movies, title_index, summaries, FACTORS, num_rec_per_user=20, rng=Random(1), verbose=False, **kwargs)
+        return dict(history), len(calls), len(copy.likes)
+
+    # by default, every round searches the neighbors of up to num_liked_sample_size sampled likes
+    history, num_calls, num_likes = simulate(num_liked_sample_size=2)
+    assert num_likes > 2 and 0 < num_calls < simulate(num_liked_sample_size=10)[1]
+    assert simulate(num_liked_sample_size=2, incremental=False) == (history, num_calls, num_likes)
+
+    # the incremental search does not sample the likes
+    incremental = simulate(num_liked_sample_size=2, incremental=True)
+    assert incremental[1] == 0 and incremental == simulate(num_liked_sample_size=10, incremental=True)
+
+    # and the learned weights require it
+    with pytest.raises(ValueError): simulate(learn_weights=True)
+
+@pytest.mark.parametrize('seed', [0, 1, 2])
+def test_online_weight_learner_moves_toward_the_true_weights(seed):
+
+    # random true weights (as in create_fake_user), and the cosine similarity of the learned weights with them
+    rng = np.random.default_rng(seed)
+    true = np.round(rng.random(len(FACTORS)), 2)
+    cosine = lambda w:w @ true / (np.linalg.norm(w) * np.linalg.norm(true))
+
+    # feedback of a user that likes a movie with a probability increasing with its weighted factor similarities
+    X = rng.random((2000, len(FACTORS)))
+    liked = rng.random(len(X)) < 1 / (1 + np.exp(-4 * (X @ true - true.sum() / 2)))
+
+    # learn the weights from the feedback, starting from the fixed estimated weights
+    learner = OnlineWeightLearner(FACTORS)
+    initial = cosine(learner.w)
+    for x, y in zip(X, liked): learner.update(x, bool(y))
+
+    # the learned weights point toward the true weights, and stay non-negative
+    weights = np.array([learner.get_weights()[factor] for factor in FACTORS])
+    assert cosine(weights) > max(initial, 0.95)
+    assert learner.num_updates == len(X) and (weights >= 0).all()
+
+    # and the liked movies get the highest predicted probabilities
+    proba = learner.predict_proba(X)
+    assert proba[liked].mean() > proba[~liked].mean() + 0.2
+
+def test_dense_catalogs_are_chosen_from_the_memory_budget():
+
+    # a catalog of the size of the dataset (nothing is computed before the first similarities)
+    titles = [f'movie {i}' for i in range(6945)]
+    title_index = {title:i for i, title in enumerate(titles)}
+    engine = lambda **kwargs:MovieSimilarityEngine(None, title_index, None, features=dict(), titles=titles, **kwargs)
+
+    # 22 bytes per pair for the factor matrices, plus 4 bytes per pair for each cached totals
+    assert engine().is_dense
+    assert engine(dense_memory_budget=6945**2 * 38).is_dense and not engine(dense_memory_budget=6945**2 * 38 - 1).is_dense
+    assert not engine(max_cached_weights=16).is_dense
+
+def test_recommend_movies_encodes_the_catalog_once(monkeypatch):
+
+    # random catalog and weights
+    movies, title_index, embeddings = make_catalog()
+    summaries = SummaryEmbeddings(embeddings)
+    weights = {factor:1 for factor in FACTORS}
+
+    # count the encodings of the catalog
+    calls = list()
+    encode = content_based_recommendations.encode_movie_features
+    monkeypatch.setattr(content_based_recommendations, 'encode_movie_features', lambda movies:calls.append(len(movies)) or encode(movies))
+
+    # several titles, without an engine
+    recommendations = [recommend_movies(f'movie {i}', movies, title_index, summaries, weights, k=10) for i in range(1, 6)]
+    assert calls == [60]
+
+    # same recommendations as with an engine (which reuses the same encoded catalog)
+    engine = MovieSimilarityEngine(movies, title_index, summaries)
+    for i, expected in zip(range(1, 6), recommendations):
+        assert recommend_movies(f'movie {i}', None, title_index, summaries, weights, k=10, engine=engine) == expected
+    assert calls == [60]
+
+    # the top titles are the highest totals of compute_similarity (which rounds each factor, hence the tolerance)
+    expected = sorted(((compute_similarity(movie.title, 'movie 1', movies, title_index, summaries, weights)[0], movie.title)
+                       for movie in movies[:-1]), key=lambda pair:-pair[0])
+    assert [total for _, (total, _) in recommendations[0]] == pytest.approx([total for total, _ in expected[:10]], abs=0.05)
+
+    # another list is encoded again
+    assert recommend_movies('movie 1', list(movies), title_index, summaries, weights, k=10) == recommendations[0]
+    assert calls == [60, 60]
+
+@pytest.mark.parametrize('dtype', ['float32', 'float16'])
+def test_summary_similarities_match_the_dense_matrix(dtype):
+
+    # random embeddings and their dense cosine similarity matrix
+    _, _, embeddings = make_catalog()
+    dense = util.cos_sim(torch.from_numpy(embeddings), torch.from_numpy(embeddings))
+    expected = dense.numpy().astype(np.float64)
+    atol = 2e-3 if dtype == 'float16' else 1e-6
+
+    # normalized embeddings: columns and pairs computed on demand
+    summaries = SummaryEmbeddings(embeddings, dtype)
+    assert summaries.embeddings.dtype == np.dtype(dtype) and len(summaries) == 60
+    np.testing.assert_allclose(get_summary_similarities(summaries, 7), expected[:,7], atol=atol)
+    np.testing.assert_allclose(get_summary_similarities(summaries, np.array([7, 3]), np.array([1, 2, 59])), expected[[1, 2, 59]][:,[7, 3]], atol=atol)
+    assert get_summary_similarity(summaries, 5, 7) == pytest.approx(expected[5, 7], abs=atol)
+    assert get_summary_similarity(summaries, 5, 7) == pytest.approx(get_summary_similarity(dense, 5, 7), abs=atol)
+
+    # top_n neighbors: the 10 highest similarities of each movie, and 0 for the others
+    top_n = TopNSummarySimilarities(SummaryEmbeddings(embeddings), top_n=10, dtype=dtype, block_size=16)
+    assert top_n.data.dtype == np.dtype(dtype) and top_n.data.shape == top_n.indices.shape == (60, 10)
+    for idx in [0, 7, 59]:
+        column = get_summary_similarities(top_n, idx)
+        neighbors = np.argsort(-expected[:,idx], kind='stable')[:10]
+        assert set(np.flatnonzero(column).tolist()) == set(neighbors.tolist())
+        np.testing.assert_allclose(column[neighbors], expected[neighbors, idx], atol=atol)
+        assert get_summary_similarity(top_n, neighbors[3], idx) == pytest.approx(expected[neighbors[3], idx], abs=atol)
+        outside = np.setdiff1d(np.arange(60), neighbors)[0]
+        assert get_summary_similarity(top_n, outside, idx) == 0
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import pytest
+from hashlib import sha1
+from concurrent.futures import ProcessPoolExecutor
+from functions.embedding_cache import SummaryEmbeddingCache
+
+# ---------------------------------------------------------------------------------------------------
+# Function to encode summaries into random (but reproducible) embeddings, instead of Sentence-BERT
+# ---------------------------------------------------------------------------------------------------
+
+def fake_encode(summaries:list,
+                dim:int=8) -> np.ndarray:
+
+    # the embedding of a summary only depends on its text
+    return np.stack([np.random.default_rng(int(sha1(summary.encode('utf-8')).hexdigest()[:8], 16)).standard_normal(dim)
+                     for summary in summaries]).astype(np.float32)
+
+# ---------------------------------------------------------------------------------------------------
+# Function to append the embeddings of some summaries in a worker process
+# ---------------------------------------------------------------------------------------------------
+
+def add_summaries(cache_dir:str,
+                  summaries:list,
+                  batch_size:int=5):
+
+    # each batch is appended under the lock, interleaved with the other workers
+    cache = SummaryEmbeddingCache(cache_dir)
+    for start in range(0, len(summaries), batch_size):
+        batch = summaries[start:start + batch_size]
+        cache.add([cache.key(summary) for summary in batch], fake_encode(batch))
+
+# ---------------------------------------------------------------------------------------------------
+# Tests
+# ---------------------------------------------------------------------------------------------------
+
+@pytest.mark.parametrize('dtype', ['float32', 'float16'])
+def test_cache_round_trip_only_encodes_new_summaries(dtype, tmp_path):
+
+    # encoder that records the summaries it is given
+    encoded = list()
+    encoder = lambda summaries:encoded.extend(summaries) or fake_encode(summaries)
+
+    # first run: every distinct summary is encoded once
+    summaries = ['a heist', 'a love story', 'a heist', 'a war movie']
+    embeddings = SummaryEmbeddingCache(tmp_path, dtype=dtype).encode(summaries, encoder)
+    assert encoded == ['a heist', 'a love story', 'a war movie']
+
+    # the embeddings are returned in the order of the summaries (in the storage precision)
+    rtol = 1e-3 if dtype == 'float16' else 0
+    np.testing.assert_allclose(embeddings, fake_encode(summaries), rtol=rtol, atol=rtol)
+
+    # next run (e.g., another process): only the new or changed summaries are encoded
+    encoded.clear()
+    summaries = ['a heist', 'a love story (remastered)', 'a war movie', 'a documentary']
+    cache = SummaryEmbeddingCache(tmp_path, dtype=dtype)
+    embeddings = cache.encode(summaries, encoder)
+    assert encoded == ['a love story (remastered)', 'a documentary']
+    np.testing.assert_allclose(embeddings, fake_encode(summaries), rtol=rtol, atol=rtol)
+
+    # the rows are memory mapped, and every summary is still cached
+    assert isinstance(cache.embeddings, np.memmap) and len(cache) == 5
+    encoded.clear()
+    cache.encode(summaries, encoder)
+    assert encoded == []
+
+    # other embeddings dimensions are rejected
+    with pytest.raises(ValueError): cache.add(['x'], np.zeros((1, 4)))
+
+def test_concurrent_writers_keep_the_rows_paired_with_their_summaries(tmp_path):
+
+    # 4 processes append distinct and shared summaries, batch by batch, at the same time
+    summaries = [[f'summary {i} of worker {worker}' for i in range(20)] + [f'shared summary {i}' for i in range(10)] for worker in range(4)]
+    with ProcessPoolExecutor(max_workers=4) as executor:
+        list(executor.map(add_summaries, [tmp_path] * 4, summaries))
+
+    # every summary is stored once, and its row holds its embedding
+    all_summaries = sorted(set(summary for worker_summaries in summaries for summary in worker_summaries))
+    cache = SummaryEmbeddingCache(tmp_path)
+    assert len(cache) == cache.num_rows == len(all_summaries) == 90
+    np.testing.assert_array_equal(cache.encode(all_summaries, lambda summaries:pytest.fail('nothing should be encoded')),
+                                  fake_encode(all_summaries))
+    assert sorted(cache.index.values()) == list(range(90))
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import torch
+import pytest
+from functions.content_based_recommendations import (Movie, SummaryEmbeddings, FACTORS, MovieSimilarityEngine, generate_fake_users,
+                                                     exploit_simulate)
+from functions.parallel_simulation import run_simulation_in_parallel, share_engine, attach_engine, _shared
+import functions.content_based_recommendations as content_based_recommendations
+
+# ---------------------------------------------------------------------------------------------------
+# Function to create a random movie catalog (with random summary embeddings instead of Sentence-BERT)
+# ---------------------------------------------------------------------------------------------------
+
+def make_catalog(num_movies:int=120,
+                 dim:int=16,
+                 seed:int=0):
+
+    # random generator
+    rng = np.random.default_rng(seed)
+
+    # random set of codes
+    def codes(num_values:int, max_size:int) -> frozenset:
+        return frozenset(rng.choice(num_values, size=int(rng.integers(1, max_size + 1)), replace=False).tolist())
+
+    # create the movies (the last title is a duplicate, as in the dataset)
+    movies, title_index = [], dict()
+    for i in range(num_movies):
+        title = f'movie {i}' if i < num_movies - 1 else 'movie 0'
+        movies.append(Movie(title, codes(8, 3), codes(20, 4), int(rng.integers(80, 180)), codes(30, 1), codes(60, 4),
+                            float(np.round(rng.uniform(5, 9), 1)), int(rng.integers(1960, 2022)),
+                            f'house {rng.integers(6)}', f'summary {i}', f'actor {rng.integers(10)}'))
+        title_index[title] = i
+
+    # random summary embeddings
+    embeddings = SummaryEmbeddings(rng.standard_normal((num_movies, dim)).astype(np.float32))
+
+    return movies, title_index, embeddings
+
+# ---------------------------------------------------------------------------------------------------
+# Function to get the comparable results of a simulation
+# ---------------------------------------------------------------------------------------------------
+
+def summarize(users:list,
+              histories:dict):
+
+    return ([([m.title for m in u.seed_movies], [m.title for m in u.likes], [m.title for m in u.dislikes],
+              u.weights, u.like_threshold) for u in users],
+            {user:dict(history) for user, history in histories.items()})
+
+# ---------------------------------------------------------------------------------------------------
+# Tests
+# ---------------------------------------------------------------------------------------------------
+
+@pytest.mark.parametrize('similarities, incremental, learn_weights', [('embeddings', True, False),
+                                                                      ('embeddings', False, False),
+                                                                      ('embeddings', True, True),
+                                                                      ('dense', True, False)])
+def test_parallel_simulation_matches_the_sequential_simulation(similarities, incremental, learn_weights):
+
+    # random catalog
+    movies, title_index, summaries = make_catalog()
+
+    # dense cosine similarity matrix of the summaries
+    if similarities == 'dense': summaries = torch.from_numpy(summaries.embeddings @ summaries.embeddings.T)
+
+    # simulate the users sequentially
+    users = generate_fake_users(movies, title_index, summaries, FACTORS, num_users=4, seed=7)
+    histories = exploit_simulate(users, movies, title_index, summaries, FACTORS, num_rec_per_user=8, seed=7,
+                                 incremental=incremental, learn_weights=learn_weights)
+
+    # simulate the same users in worker processes
+    parallel_users, parallel_histories = run_simulation_in_parallel(movies, title_index, summaries, FACTORS, num_users=4,
+                                                                    num_rec_per_user=8, num_workers=2, seed=7,
+                                                                    incremental=incremental, learn_weights=learn_weights)
+
+    assert summarize(parallel_users, parallel_histories) == summarize(users, histories)
+
+def test_parallel_simulation_does_not_depend_on_the_number_of_workers():
+
+    # random catalog
+    movies, title_index, summaries = make_catalog()
+
+    # simulate the users with one and with three workers (and without the engine)
+    results = [summarize(*run_simulation_in_parallel(movies, title_index, summaries, FACTORS, num_users=3, num_rec_per_user=6,
+                                                     num_workers=num_workers, seed=3, use_engine=use_engine))
+               for num_workers, use_engine in [(1, True), (3, False)]]
+
+    assert results[0] == results[1]
+
+def test_shared_engine_reuses_the_factor_matrices_of_the_parent(monkeypatch):
+
+    # random catalog, and its engine with the factor matrices computed
+    movies, title_index, summaries = make_catalog()
+    engine = MovieSimilarityEngine(movies, title_index, summaries)
+    blocks, spec = share_engine(engine)
+
+    try:
+
+        # the factor matrices are not computed again by the attached engine
+        monkeypatch.setattr(content_based_recommendations, 'get_summary_similarities', lambda *args:pytest.fail('factor matrices computed again'))
+        attached = attach_engine(movies, title_index, summaries, spec)
+        assert attached.is_dense and set(attached.factor_matrices()) == set(engine.factor_matrices())
+
+        # same arrays and similarities, read from the shared blocks
+        for name, matrix in attached.factor_matrices().items():
+            assert any(np.shares_memory(matrix, np.frombuffer(shm.buf, dtype=np.uint8)) for shm in _shared['blocks'])
+            np.testing.assert_array_equal(matrix, engine.factor_matrices()[name])
+        weights = {factor:float(w) for factor, w in zip(FACTORS, np.linspace(0.1, 1, len(FACTORS)))}
+        for idx in [1, 50, 119]:
+            np.testing.assert_array_equal(attached.similarities(idx, weights), engine.similarities(idx, weights))
+
+    finally:
+
+        # detach (once the arrays are released) and release the shared memory
+        attached = matrix = None
+        for shm in _shared.pop('blocks', []): shm.close()
+        for shm in blocks:
+            shm.close()
+            shm.unlink()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import csv
+import json
+import zlib
+import numpy as np
+import pytest
+from functions.content_based_recommendations import (SET_ATTRIBUTES, FACTORS, SummaryEmbeddings, MovieSimilarityEngine, load_and_prepare_data,
+                                                     decode_movie)
+from functions.streaming_loader import stream_catalog, load_streamed_catalog
+import functions.content_based_recommendations as content_based_recommendations
+import functions.streaming_loader as streaming_loader
+
+# ---------------------------------------------------------------------------------------------------
+# Sentence-BERT replacement: a fixed random embedding per summary
+# ---------------------------------------------------------------------------------------------------
+
+class FakeSentenceTransformer:
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def get_sentence_embedding_dimension(self)->int:
+        return 16
+
+    def encode(self, texts:list, batch_size:int=32, convert_to_tensor:bool=False)->np.ndarray:
+        return np.stack([np.random.default_rng(zlib.crc32(text.encode())).standard_normal(16).astype(np.float32) for text in texts])
+
+# ---------------------------------------------------------------------------------------------------
+# Function to write a random catalog in the layout of data_preprocessed.csv
+# ---------------------------------------------------------------------------------------------------
+
+def write_catalog(path,
+                  num_movies:int=50,
+                  seed:int=0):
+
+    # random generator
+    rng = np.random.default_rng(seed)
+
+    # random comma-separated values
+    def values(prefix:str, num_values:int, max_size:int)->str:
+        return ', '.join(f'{prefix} {v}' for v in rng.choice(num_values, size=int(rng.integers(1, max_size + 1)), replace=False))
+
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['index', 'title', 'genre', 'tags', 'runtime', 'director', 'actors', 'rating', 'ryear', 'prod_house', 'summary', 'star_actor'])
+        for i in range(num_movies):
+            writer.writerow([i, f'movie {i}', values('genre', 8, 3), values('tag', 20, 4), int(rng.integers(80, 180)), values('director', 30, 1),
+                             values('actor', 60, 4), float(np.round(rng.uniform(5, 9), 1)), int(rng.integers(1960, 2022)),
+                             f'house {rng.integers(6)}', f'summary {i}', f'actor {rng.integers(10)}'])
+
+# ---------------------------------------------------------------------------------------------------
+# Tests
+# ---------------------------------------------------------------------------------------------------
+
+@pytest.mark.parametrize('dtype', ['float32', 'float16'])
+def test_streamed_catalog_matches_the_loaded_catalog(dtype, tmp_path, monkeypatch):
+
+    # random catalog, encoded with the replacement model
+    monkeypatch.setattr(streaming_loader, 'SentenceTransformer', FakeSentenceTransformer)
+    monkeypatch.setattr(content_based_recommendations, 'SentenceTransformer', FakeSentenceTransformer)
+    input_path = tmp_path / 'catalog.csv'
+    write_catalog(input_path)
+
+    # stream it (several batches), and load it in memory
+    stream_catalog(str(input_path), str(tmp_path / 'streamed'), batch_size=16, similarity_dtype=dtype)
+    features, titles, title_index, summaries = load_streamed_catalog(str(tmp_path / 'streamed'))
+    movies, expected_title_index, expected_summaries = load_and_prepare_data(str(input_path), similarity_mode='embeddings', similarity_dtype=dtype)
+
+    # the normalized embeddings are memory-mapped as they were stored
+    assert isinstance(summaries.embeddings, np.memmap) and summaries.embeddings.dtype == np.dtype(dtype)
+    np.testing.assert_array_equal(summaries.embeddings, expected_summaries.embeddings)
+
+    # same similarities as the catalog loaded in memory
+    assert title_index == expected_title_index
+    engine = MovieSimilarityEngine(None, title_index, summaries, features=features, titles=titles)
+    expected_engine = MovieSimilarityEngine(movies, expected_title_index, expected_summaries)
+    weights = {factor:1 for factor in FACTORS}
+    for idx in [0, 17, 49]:
+        np.testing.assert_allclose(engine.similarities(idx, weights), expected_engine.similarities(idx, weights), atol=1e-6)
+
+def test_summary_embeddings_from_normalized_arrays_are_not_copied():
+
+    # normalized embeddings
+    embeddings = SummaryEmbeddings.normalize(np.random.default_rng(0).standard_normal((10, 16)), 'float16')
+
+    # the array is used as it is
+    summaries = SummaryEmbeddings.from_normalized(embeddings)
+    assert summaries.embeddings is embeddings
+    np.testing.assert_allclose(summaries.column(3), SummaryEmbeddings(embeddings.astype(np.float32)).column(3), atol=1e-3)
+
+def test_decoded_movies_match_the_csv_values(tmp_path, monkeypatch):
+
+    # random catalog, loaded in memory (with its vocabularies) and streamed
+    monkeypatch.setattr(streaming_loader, 'SentenceTransformer', FakeSentenceTransformer)
+    monkeypatch.setattr(content_based_recommendations, 'SentenceTransformer', FakeSentenceTransformer)
+    input_path = tmp_path / 'catalog.csv'
+    write_catalog(input_path)
+    vocabularies = dict()
+    movies, _, _ = load_and_prepare_data(str(input_path), similarity_mode='embeddings', vocabularies=vocabularies)
+    stream_catalog(str(input_path), str(tmp_path / 'streamed'), batch_size=16)
+    with open(tmp_path / 'streamed' / 'catalog.json', encoding='utf-8') as f:
+        streamed_vocabularies = json.load(f)['vocabularies']
+
+    # the decoded values are the values of the csv file, with either vocabularies
+    with open(input_path, encoding='utf-8') as f:
+        for movie, row in zip(movies, csv.DictReader(f)):
+            decoded = decode_movie(movie, vocabularies)
+            assert decode_movie(movie, streamed_vocabularies) == decoded
+            assert decoded['title'] == row['title'] and decoded['star_actor'] == row['star_actor']
+            for attribute in SET_ATTRIBUTES:
+                assert decoded[attribute] == sorted(x.strip() for x in row[attribute].split(','))